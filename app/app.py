@@ -1,18 +1,38 @@
 import tkinter as tk
 from tkinter import filedialog, ttk
 import threading
+import queue
+import time
 import os
-from unzip import extract_zip
-from parser import xml_to_csv
+import multiprocessing
+from parse import xml_to_csv
+
+# 変換中の進捗を画面に反映する間隔（ミリ秒）
+POLL_INTERVAL = 100
+
+
+def format_seconds(seconds):
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
 
 class App(tk.Tk):
     def __init__(self):
         super().__init__()
 
         self.title("XML to CSV Converter")
-        self.geometry("400x300")
+        self.geometry("400x360")
+
+        # 変換スレッドから画面への通知（Tk の変数は変換スレッドから触らない）
+        self.events = queue.Queue()
+        self.cancel = threading.Event()
+        self.worker = None
+        self.started = None
 
         self.create_widgets()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def create_widgets(self):
         # ZIP file selection
@@ -37,9 +57,18 @@ class App(tk.Tk):
         self.output_entry = tk.Entry(self, textvariable=self.output_path, width=50)
         self.output_entry.pack(pady=5)
 
-        # Convert button
-        self.convert_button = tk.Button(self, text="Convert", command=self.start_conversion)
-        self.convert_button.pack(pady=20)
+        # Extract option (off: read XML and PDF directly from the ZIP)
+        self.extract = tk.BooleanVar(value=False)
+        self.extract_check = tk.Checkbutton(self, text="Extract ZIP before converting", variable=self.extract)
+        self.extract_check.pack()
+
+        # Convert / Cancel buttons
+        buttons = tk.Frame(self)
+        buttons.pack(pady=20)
+        self.convert_button = tk.Button(buttons, text="Convert", command=self.start_conversion)
+        self.convert_button.pack(side="left", padx=5)
+        self.cancel_button = tk.Button(buttons, text="Cancel", command=self.cancel_conversion, state="disabled")
+        self.cancel_button.pack(side="left", padx=5)
 
         # Progress bar
         self.progress = ttk.Progressbar(self, orient="horizontal", length=300, mode="determinate")
@@ -50,6 +79,11 @@ class App(tk.Tk):
         self.status_label = tk.Label(self, textvariable=self.status)
         self.status_label.pack()
 
+        # Document counts, throughput and ETA
+        self.detail = tk.StringVar()
+        self.detail_label = tk.Label(self, textvariable=self.detail)
+        self.detail_label.pack()
+
     def select_zip(self):
         filename = filedialog.askopenfilename(filetypes=[("ZIP files", "*.zip")])
         self.zip_path.set(filename)
@@ -67,32 +101,111 @@ class App(tk.Tk):
             return
 
         self.convert_button.config(state="disabled")
+        self.cancel_button.config(state="normal")
         self.progress["value"] = 0
-        self.status.set("Starting conversion...")
-
-        thread = threading.Thread(target=self.convert_process, args=(zip_file, output_dir))
-        thread.start()
-
-    def convert_process(self, zip_file, output_dir):
+        self.progress["maximum"] = 100
+        self.status.set("Extracting ZIP file..." if self.extract.get() else "Reading ZIP file...")
+        self.detail.set("")
+
+        self.cancel.clear()
+        self.started = None
+        self.worker = threading.Thread(
+            target=self.convert_process, args=(zip_file, output_dir, self.extract.get()), daemon=True)
+        self.worker.start()
+        self.after(POLL_INTERVAL, self.poll)
+
+    def cancel_conversion(self):
+        # 処理中の1件を書き終えたところで止まる
+        self.cancel.set()
+        self.cancel_button.config(state="disabled")
+        self.status.set("Cancelling after the current document...")
+
+    def convert_process(self, zip_file, output_dir, extract=False):
+        # 変換スレッド: 画面は触らず、結果はすべて self.events に送る
         try:
-            # Extract ZIP
-            self.status.set("Extracting ZIP file...")
-            zip_extracted_dir = os.path.join(output_dir, "extracted")
-            extract_zip(zip_file, zip_extracted_dir)
-            self.progress["value"] = 25
-
-            # Convert to CSV
-            self.status.set("Converting to CSV...")
             csv_extracted_dir = os.path.join(output_dir, "csv")
-            xml_to_csv(zip_extracted_dir, csv_extracted_dir)
-            self.progress["value"] = 100
+            counts = xml_to_csv(zip_file, csv_extracted_dir, extract=extract,
+                                progress=self.report_progress, cancel=self.cancel)
+            self.events.put(("done", counts))
+        except Exception as e:
+            self.events.put(("error", str(e)))
 
+    def report_progress(self, done, total, counts):
+        self.events.put(("progress", (done, total, counts)))
+
+    def poll(self):
+        # Tk のメインループから通知を読み、画面に反映する
+        finished = False
+        latest = None
+        try:
+            while True:
+                kind, value = self.events.get_nowait()
+                if kind == "progress":
+                    latest = value
+                    continue
+                if latest is not None:
+                    self.show_progress(*latest)
+                    latest = None
+                finished = True
+                self.finish(kind, value)
+        except queue.Empty:
+            pass
+        if latest is not None:
+            self.show_progress(*latest)
+        if not finished:
+            self.after(POLL_INTERVAL, self.poll)
+
+    def show_progress(self, done, total, counts):
+        now = time.perf_counter()
+        if self.started is None:
+            # 最初の通知（一覧の作成とZIPの展開が終わった時点）から速度を測る
+            self.started = now
+            if not self.cancel.is_set():
+                self.status.set("Converting to CSV...")
+        self.progress["maximum"] = max(total, 1)
+        self.progress["value"] = done
+        elapsed = now - self.started
+        text = f"{done} / {total} documents"
+        if done and elapsed > 0:
+            rate = done / elapsed
+            text += f"  {rate:.1f} docs/s  ETA {format_seconds((total - done) / rate)}"
+        skipped = counts.get("skip", 0) + counts.get("unchanged", 0)
+        if skipped or counts.get("error"):
+            text += f"\nskipped {skipped}, errors {counts.get('error', 0)}"
+        self.detail.set(text)
+
+    def finish(self, kind, value):
+        if kind == "error":
+            self.status.set(f"Error occurred: {value}")
+        elif value.get("cancelled"):
+            self.status.set(f"Cancelled: {value['ok']} converted, {value['cancelled']} not processed.")
+        else:
+            self.progress["value"] = self.progress["maximum"]
             self.status.set("Conversion completed successfully!")
-        except Exception as e:
-            self.status.set(f"Error occurred: {str(e)}")
-        finally:
-            self.convert_button.config(state="normal")
+        self.convert_button.config(state="normal")
+        self.cancel_button.config(state="disabled")
+        self.worker = None
+
+    def on_close(self):
+        # 変換中に閉じた場合も、書き終えた分を記録してから終了する
+        # （変換スレッドの終了はメインループで待ち、待つ間も画面の描画と通知の反映を止めない）
+        if self.worker is None or not self.worker.is_alive():
+            self.destroy()
+            return
+        self.cancel.set()
+        self.cancel_button.config(state="disabled")
+        self.convert_button.config(state="disabled")
+        self.status.set("Closing after the current document...")
+        self.protocol("WM_DELETE_WINDOW", lambda: None)
+        self.close_when_done(self.worker)
+
+    def close_when_done(self, worker):
+        if worker.is_alive():
+            self.after(POLL_INTERVAL, self.close_when_done, worker)
+        else:
+            self.destroy()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     app = App()
-    app.mainloop()
\ No newline at end of file
+    app.mainloop()
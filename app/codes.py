@@ -0,0 +1,242 @@
+import os
+import re
+import sys
+import sqlite3
+from array import array
+from fields import COLUMNS
+
+# 分類（IPC・FI）・テーマコード・Fタームの列を個々のコードに分け、
+# コードを共通の辞書で番号に置き換えて保存する。
+# 公報ごとには番号の配列だけを持ち、コード -> 公報の転置索引で「Fターム X を持つ公報」を探す。
+
+INDEX_NAME = 'codes.sqlite'
+
+# この文書数ごとに保存する
+COMMIT_DOCS = 1000
+
+_SYMBOL = r'([A-H]\d{2}[A-Z])\s*(\d{1,4})\s*/\s*(\d{2,6})'
+# IPC: 'H01L  21/00        20060101AFI20240101BHJP'（後ろの版の情報は使わない）
+_IPC = re.compile(_SYMBOL)
+# FI: 'H01L21/00'、'A61K31/00 101'、'H01L21/02 B'、'G06F3/041,400@A' など（展開記号と分冊識別記号を含む）
+_FI = re.compile(_SYMBOL + r'(?:[\s,]*(\d{3})(?!\d))?(?:[\s@]*([A-Z])(?![A-Za-z0-9]))?')
+# テーマコード: '5F045'
+_THEME = re.compile(r'(\d[A-Z]\d{3})')
+# Fターム: '5F045AA01'（付加コードの1文字を含む）
+_FTERM = re.compile(r'(\d[A-Z]\d{3})\s*([A-Z]{2})\s*(\d{2})([A-Z]?)')
+
+
+def _symbol(m):
+    return f"{m.group(1)}{int(m.group(2))}/{m.group(3)}"
+
+
+def _fi(m):
+    code = _symbol(m)
+    if m.group(4):
+        code += f",{m.group(4)}"
+    if m.group(5):
+        code += f"@{m.group(5)}"
+    return code
+
+
+def _split(pattern, text, form):
+    """
+    文字列から pattern に一致するコードを順に取り出す関数
+
+    一致するものが1つも無い場合は、空白を除いた文字列全体を1つのコードとする（値を失わないため）。
+    """
+    codes = []
+    for m in pattern.finditer(text):
+        code = form(m)
+        if code not in codes:
+            codes.append(code)
+    if not codes and text.strip():
+        codes.append(" ".join(text.split()))
+    return codes
+
+
+# 列名 -> 列の文字列をコードのリストに分ける関数
+SCHEMES = {
+    'ipc': lambda text: _split(_IPC, text, _symbol),
+    'fi': lambda text: _split(_FI, text, _fi),
+    'theme_code': lambda text: _split(_THEME, text, lambda m: m.group(1)),
+    'fterm': lambda text: _split(_FTERM, text, lambda m: "".join(m.groups())),
+}
+_SCHEME_COLUMNS = [COLUMNS.index(name) for name in SCHEMES]
+_PUBLICATION_NUMBER = COLUMNS.index('publication_number')
+
+
+def split_codes(row):
+    """
+    CSVの1行から分類・テーマコード・Fタームのコードを取り出す関数
+
+    Args:
+        row (list): CSVの1行
+
+    Returns:
+        dict: 列名 -> コードのリスト（記載順、重複なし）
+    """
+    return {scheme: split(row[i] or "") for (scheme, split), i in zip(SCHEMES.items(), _SCHEME_COLUMNS)}
+
+
+def encode_ids(ids):
+    # 番号の配列 -> バイト列（uint32）
+    return array('I', ids).tobytes()
+
+
+def decode_ids(blob):
+    ids = array('I')
+    ids.frombytes(blob)
+    return ids
+
+
+class CodeIndex:
+    """
+    コードの辞書・公報ごとの番号の配列・コード -> 公報の転置索引
+
+    コードは (列名, コード) ごとに1つの番号を持ち、すべての公報で共有する。
+    add() で公報を追加し（同じ公開番号が既にあれば置き換える）、discard() で取り除く。
+    sinks.py の書き出し先と同じ write/remove/close を持つため、解析しながら作れる。
+    """
+
+    def __init__(self, path, commit_docs=COMMIT_DOCS):
+        self.path = os.fspath(path)
+        self.commit_docs = commit_docs
+        self.db = sqlite3.connect(self.path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS codes ("
+            " code_id INTEGER PRIMARY KEY, scheme TEXT, code TEXT, UNIQUE (scheme, code))")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS publication_codes ("
+            " publication_number TEXT PRIMARY KEY, "
+            + ", ".join(f"{scheme} BLOB" for scheme in SCHEMES) + ")")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS code_postings ("
+            " code_id INTEGER, publication_number TEXT,"
+            " PRIMARY KEY (code_id, publication_number)) WITHOUT ROWID")
+        self.db.commit()
+        # (列名, コード) -> 番号
+        self._ids = {(scheme, code): code_id for code_id, scheme, code
+                     in self.db.execute("SELECT code_id, scheme, code FROM codes")}
+        self._pending = 0
+
+    @classmethod
+    def in_directory(cls, directory, **kwargs):
+        os.makedirs(directory, exist_ok=True)
+        return cls(os.path.join(directory, INDEX_NAME), **kwargs)
+
+    def intern(self, scheme, code):
+        # コードの番号を返す（初めてのコードは辞書に追加する）
+        key = (scheme, code)
+        code_id = self._ids.get(key)
+        if code_id is None:
+            code_id = self._ids[key] = self.db.execute(
+                "INSERT INTO codes (scheme, code) VALUES (?, ?)", key).lastrowid
+        return code_id
+
+    def add(self, publication_number, codes):
+        """
+        公報のコードを追加する関数
+
+        Args:
+            publication_number (str): 公開番号
+            codes (dict): 列名 -> コードのリスト（split_codes の戻り値）
+        """
+        self.discard(publication_number)
+        arrays = []
+        postings = set()
+        for scheme in SCHEMES:
+            ids = [self.intern(scheme, code) for code in codes.get(scheme, ())]
+            arrays.append(encode_ids(ids))
+            postings.update(ids)
+        self.db.execute(
+            f"INSERT INTO publication_codes VALUES (?{', ?' * len(SCHEMES)})",
+            [publication_number] + arrays)
+        self.db.executemany(
+            "INSERT INTO code_postings VALUES (?, ?)",
+            ((code_id, publication_number) for code_id in postings))
+        self._pending += 1
+        if self._pending >= self.commit_docs:
+            self.commit()
+
+    def discard(self, publication_number):
+        row = self.db.execute(
+            f"SELECT {', '.join(SCHEMES)} FROM publication_codes WHERE publication_number = ?",
+            (publication_number,)).fetchone()
+        if row is None:
+            return
+        ids = {code_id for blob in row for code_id in decode_ids(blob)}
+        self.db.executemany(
+            "DELETE FROM code_postings WHERE code_id = ? AND publication_number = ?",
+            ((code_id, publication_number) for code_id in ids))
+        self.db.execute("DELETE FROM publication_codes WHERE publication_number = ?", (publication_number,))
+
+    def commit(self):
+        self.db.commit()
+        self._pending = 0
+
+    def codes(self, publication_number):
+        """
+        公報のコードを返す関数
+
+        Returns:
+            dict: 列名 -> コードのリスト（公報が無い場合は None）
+        """
+        row = self.db.execute(
+            f"SELECT {', '.join(SCHEMES)} FROM publication_codes WHERE publication_number = ?",
+            (publication_number,)).fetchone()
+        if row is None:
+            return None
+        ids = {code_id for blob in row for code_id in decode_ids(blob)}
+        names = dict(self.db.execute(
+            f"SELECT code_id, code FROM codes WHERE code_id IN ({','.join('?' * len(ids))})", list(ids)))
+        return {scheme: [names[code_id] for code_id in decode_ids(blob)] for scheme, blob in zip(SCHEMES, row)}
+
+    def publications(self, scheme, code, prefix=False):
+        """
+        コードを持つ公報の公開番号を返す関数
+
+        Args:
+            scheme (str): 列名（'ipc', 'fi', 'theme_code', 'fterm'）
+            code (str): コード（FI は 'A61K31/00,101@A' の形）
+            prefix (bool): True の場合は code で始まるコードをすべて対象にする
+                （例: Fターム '5F045AA' で観点 AA のすべて）
+
+        Returns:
+            list: 公開番号のリスト（昇順）
+        """
+        if prefix:
+            rows = self.db.execute(
+                "SELECT DISTINCT p.publication_number FROM codes c"
+                " JOIN code_postings p ON p.code_id = c.code_id"
+                " WHERE c.scheme = ? AND c.code >= ? AND c.code < ?"
+                " ORDER BY p.publication_number", (scheme, code, code + '\U0010ffff'))
+        else:
+            rows = self.db.execute(
+                "SELECT publication_number FROM code_postings WHERE code_id = ?"
+                " ORDER BY publication_number", (self._ids.get((scheme, code), -1),))
+        return [r[0] for r in rows]
+
+    # sinks.py の書き出し先と同じ使い方
+    def write(self, csv_name, row, parties=None):
+        self.add(row[_PUBLICATION_NUMBER], split_codes(row))
+
+    def remove(self, csv_name, publication_number):
+        self.discard(publication_number)
+
+    def flush(self):
+        self.commit()
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+
+if __name__ == "__main__":
+    # 使い方: python app/codes.py <出力先ディレクトリ> <列名> <コード>（末尾が * なら前方一致）
+    index = CodeIndex.in_directory(sys.argv[1])
+    code = sys.argv[3]
+    found = index.publications(sys.argv[2], code.rstrip('*'), prefix=code.endswith('*'))
+    for publication_number in found:
+        print(publication_number)
+    print(f"{len(found)} 件")
+    index.close()
@@ -0,0 +1,366 @@
+import os
+import datetime
+from collections import Counter
+from fields import COLUMNS, PARTY_COLUMNS, parties_from_row
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # 列指向の出力を使わない場合は不要
+    pa = None
+    ds = None
+    pq = None
+
+# 変換した行を Parquet ファイルに書き出す（sinks.py の書き出し先と同じ使い方）
+# CSVの110列のうち、日付は日付型、請求項の数とページ数は整数型、
+# 出願人・代理人・発明者は12個の列ではなく可変長のリスト列にする（13件目以降も含む）。
+# ファイルは公開月ごとのディレクトリ（publication_month=2024-01/part-00000.parquet）に分ける。
+
+PARTITION_KEY = 'publication_month'
+ROW_GROUP_ROWS = 5000
+PART_BYTES = 128 * 2**20  # 各月のファイルを切り替える大きさの目安
+
+_DATE_COLUMNS = ('publication_date', 'filing_date')
+_INT_COLUMNS = ('claim_count', 'page_count')
+# リスト列の名前 -> (役割, Party の項目名と列の項目名の組)
+_PARTY_LISTS = {
+    'applicants': ('applicant', (('identifier', 'id'), ('name', 'name'), ('address', 'address'))),
+    'agents': ('agent', (('identifier', 'number'), ('name', 'name'))),
+    'inventors': ('inventor', (('name', 'name'), ('address', 'address'))),
+}
+
+
+def _schema():
+    fields = []
+    for name in COLUMNS:
+        if name in PARTY_COLUMNS:
+            # 各役割の1件目の列の位置にリスト列を置く
+            role, n, attr = PARTY_COLUMNS[name]
+            for column, (r, items) in _PARTY_LISTS.items():
+                if r == role and n == 1 and attr == items[0][0]:
+                    fields.append(pa.field(column, pa.list_(pa.struct([(key, pa.string()) for _, key in items]))))
+            continue
+        if name in _DATE_COLUMNS:
+            fields.append(pa.field(name, pa.date32()))
+        elif name in _INT_COLUMNS:
+            fields.append(pa.field(name, pa.int32()))
+        else:
+            fields.append(pa.field(name, pa.string()))
+    return pa.schema(fields)
+
+
+def _date(text):
+    # 'YYYYMMDD' を日付に変換する（読み取れない場合は None）
+    try:
+        return datetime.date(int(text[:4]), int(text[4:6]), int(text[6:8]))
+    except (TypeError, ValueError):
+        return None
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_record(row, parties=None):
+    """
+    CSVの1行（110列）を Parquet の1レコードに変換する関数
+
+    Args:
+        row (list): CSVの1行
+        parties (list): fields.Party のリスト（None の場合は行の12件分の列から作る）
+
+    Returns:
+        dict: 列名 -> 値
+    """
+    if parties is None:
+        parties = parties_from_row(row)
+    record = {}
+    for name, value in zip(COLUMNS, row):
+        if name in PARTY_COLUMNS:
+            continue
+        if name in _DATE_COLUMNS:
+            record[name] = _date(value)
+        elif name in _INT_COLUMNS:
+            record[name] = _int(value)
+        else:
+            record[name] = value
+    for column, (role, items) in _PARTY_LISTS.items():
+        record[column] = [{key: getattr(p, attr) or "" for attr, key in items}
+                          for p in parties if p.role == role]
+    return record
+
+
+def publication_month(record):
+    date = record.get('publication_date')
+    return f"{date.year:04d}-{date.month:02d}" if date else 'unknown'
+
+
+class ParquetSink:
+    """
+    行を公開月ごとの Parquet ファイルに書き出す書き出し先
+
+    行は公開月ごとに row_group_rows 行ずつまとめて書き、各月のファイルは part_bytes を超えた
+    flush() か close() で閉じて次のファイルに切り替える（flush() ごとにはファイルを増やさない）。
+    Parquet は閉じるまで読めないため、書きかけのファイルは _part-00000.parquet という名前にして
+    read_dataset では読まず、flush() までに書いた行は同じ名前の .journal（Arrow IPC）に書き足す
+    （row_group_rows 行に満たない行はファイルには書かずに持っておき、行グループを小さくしない）。
+    強制終了した場合は次に開いたときに .journal から閉じたファイルを作り直す。
+    置き換えで取り除いた行は flush()・close() で消し、書きかけのファイルにある行はそのファイルを閉じて、
+    閉じたファイルにある行はその行を含むファイルだけを書き直す（閉じたファイルの行の一覧は、
+    閉じたファイルの行を初めて取り除くときに一度だけ読む）。
+    pyarrow が必要。
+    """
+
+    def __init__(self, directory, row_group_rows=ROW_GROUP_ROWS, part_bytes=PART_BYTES):
+        if pa is None:
+            raise ImportError("Parquet への出力には pyarrow が必要です (pip install pyarrow)")
+        self.directory = os.fspath(directory)
+        self.row_group_rows = row_group_rows
+        self.part_bytes = part_bytes
+        self.schema = _schema()
+        os.makedirs(self.directory, exist_ok=True)
+        self._recover()
+        self._buffers = {}    # 公開月 -> まだ表にしていない行
+        self._tables = {}     # 公開月 -> .journal には記録し、ファイルにはまだ書いていない表
+        self._writers = {}    # 公開月 -> (書きかけのファイル, ParquetWriter)
+        self._journals = {}   # 公開月 -> (OSFile, RecordBatchStreamWriter)
+        self._pending = {}    # 公開月 -> ファイルには書き、.journal にはまだ記録していない表
+        self._open_keys = {}  # 公開月 -> 書きかけのファイルの行の (出願番号, 公開番号) ごとの行数
+        self._dropped = {}    # 公開月 -> 書きかけのファイルの先頭から取り除く (出願番号, 公開番号) ごとの行数
+        self._removed = set()  # 閉じたファイルから取り除く行
+        self._keys = None     # 閉じたファイル -> (出願番号, 公開番号) ごとの行数（必要になったときに読む）
+
+    def _part_files(self):
+        files = []
+        for root, _, names in os.walk(self.directory):
+            files += [os.path.join(root, name) for name in names
+                      if name.endswith('.parquet') and not name.startswith('_')]
+        return sorted(files)
+
+    def _recover(self):
+        # 前回が途中で強制終了した場合、書きかけのファイルを閉じたファイルにする
+        # （閉じ終えていれば名前を変え、読めなければ最後の flush() までの行を .journal から書き直す）
+        for root, _, names in os.walk(self.directory):
+            stems = set()
+            for name in names:
+                if name.startswith('_') and name.endswith('.tmp'):
+                    os.remove(os.path.join(root, name))
+                elif name.startswith('_part-') and name.endswith(('.parquet', '.journal')):
+                    stems.add(name[1:].rsplit('.', 1)[0])
+            for stem in stems:
+                path = os.path.join(root, f"{stem}.parquet")
+                part = os.path.join(root, f"_{stem}.parquet")
+                journal = os.path.join(root, f"_{stem}.journal")
+                if not os.path.exists(path):
+                    if self._readable(part):
+                        os.replace(part, path)
+                    elif os.path.exists(journal):
+                        table = self._read_journal(journal)
+                        if table.num_rows:
+                            self._write_table(table, path)
+                for leftover in (part, journal):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+        # 閉じていない（読めない）ファイルは消す
+        for path in self._part_files():
+            if not self._readable(path):
+                os.remove(path)
+
+    @staticmethod
+    def _readable(path):
+        try:
+            pq.read_metadata(path)
+            return True
+        except (pa.ArrowInvalid, OSError):
+            return False
+
+    def _read_journal(self, path):
+        # 最後の書きかけのレコードバッチは読まない
+        batches = []
+        try:
+            with pa.OSFile(path) as f:
+                for batch in pa.ipc.open_stream(f):
+                    batches.append(batch)
+        except (pa.ArrowInvalid, OSError):
+            pass
+        return pa.Table.from_batches(batches, self.schema)
+
+    @staticmethod
+    def _write_table(table, path):
+        # 一時ファイルに書いてから置き換える（一時ファイルは _ で始まるため read_dataset では読まない）
+        tmp = os.path.join(os.path.dirname(path), f"_{os.path.basename(path)}.tmp")
+        pq.write_table(table, tmp, compression='zstd')
+        os.replace(tmp, path)
+
+    def _writer(self, month):
+        entry = self._writers.get(month)
+        if entry is None:
+            directory = os.path.join(self.directory, f"{PARTITION_KEY}={month}")
+            os.makedirs(directory, exist_ok=True)
+            numbers = [int(name.lstrip('_')[len('part-'):-len('.parquet')]) for name in os.listdir(directory)
+                       if name.lstrip('_').startswith('part-') and name.endswith('.parquet')]
+            number = max(numbers) + 1 if numbers else 0
+            path = os.path.join(directory, f"_part-{number:05d}.parquet")
+            entry = self._writers[month] = (path, pq.ParquetWriter(path, self.schema, compression='zstd'))
+            self._open_keys[month] = Counter()
+        return entry[1]
+
+    def _table(self, month):
+        # まだ表にしていない行を表にする（書きかけのファイルの行として扱う）
+        records = self._buffers.pop(month, None)
+        if not records:
+            return None
+        self._writer(month)
+        self._open_keys[month].update((r['application_number'], r['publication_number']) for r in records)
+        return pa.Table.from_pylist(records, self.schema)
+
+    def _flush(self, month):
+        table = self._table(month)
+        tables = self._tables.pop(month, [])
+        if table is not None:
+            self._pending.setdefault(month, []).append(table)
+            tables.append(table)
+        if tables:
+            self._writer(month).write_table(pa.concat_tables(tables))
+
+    def _journal(self, month):
+        # flush() までの行を .journal に書き足す（強制終了したときに閉じたファイルを作り直すため）
+        table = self._table(month)
+        tables = self._pending.pop(month, [])
+        if table is not None:
+            self._tables.setdefault(month, []).append(table)
+            tables.append(table)
+        if not tables:
+            return
+        entry = self._journals.get(month)
+        if entry is None:
+            path = self._writers[month][0][:-len('.parquet')] + '.journal'
+            f = pa.OSFile(path, 'wb')
+            options = pa.ipc.IpcWriteOptions(compression='zstd')
+            entry = self._journals[month] = (f, pa.ipc.new_stream(f, self.schema, options=options))
+        for table in tables:
+            entry[1].write_table(table)
+
+    def _rotate(self, month):
+        # 書きかけのファイルを閉じ、取り除いた行を消してから part-00000.parquet の名前にする
+        self._flush(month)
+        part, writer = self._writers.pop(month)
+        writer.close()
+        self._pending.pop(month, None)
+        keys = self._open_keys.pop(month)
+        dropped = self._dropped.pop(month, None)
+        if dropped:
+            self._filter(part, dropped)
+        path = os.path.join(os.path.dirname(part), os.path.basename(part)[1:])
+        if os.path.exists(part):
+            os.replace(part, path)
+            if self._keys is not None:
+                self._keys[path] = keys
+        entry = self._journals.pop(month, None)
+        if entry is not None:
+            entry[1].close()
+            entry[0].close()
+            os.remove(part[:-len('.parquet')] + '.journal')
+
+    def write(self, csv_name, row, parties=None):
+        record = to_record(row, parties)
+        month = publication_month(record)
+        records = self._buffers.setdefault(month, [])
+        records.append(record)
+        if len(records) + sum(t.num_rows for t in self._tables.get(month, ())) >= self.row_group_rows:
+            self._flush(month)
+
+    def remove(self, csv_name, publication_number):
+        key = (csv_name, publication_number)
+        for records in self._buffers.values():
+            records[:] = [r for r in records
+                          if (r['application_number'], r['publication_number']) != key]
+        # 書きかけのファイルにある行は、その時点までに書いた行数だけを取り除く（後から書く行は残す）
+        found = False
+        for month, keys in self._open_keys.items():
+            count = keys.pop(key, 0)
+            if count:
+                dropped = self._dropped.setdefault(month, {})
+                dropped[key] = dropped.get(key, 0) + count
+                found = True
+        if not found:
+            self._removed.add(key)
+
+    def _filter(self, path, removed):
+        # 公開番号と出願番号の列だけを読み、取り除く行を含む場合だけ書き直す
+        # （removed は (出願番号, 公開番号) -> ファイルの先頭から取り除く行数）
+        keys = pq.read_table(path, columns=['application_number', 'publication_number'])
+        remaining = dict(removed)
+        keep = []
+        for key in zip(keys.column('application_number').to_pylist(),
+                       keys.column('publication_number').to_pylist()):
+            if remaining.get(key):
+                remaining[key] -= 1
+                keep.append(False)
+            else:
+                keep.append(True)
+        if all(keep):
+            return
+        if not any(keep):
+            os.remove(path)
+            return
+        table = pq.read_table(path, schema=self.schema).filter(pa.array(keep))
+        self._write_table(table, path)
+
+    def _drop_removed(self):
+        # 閉じたファイルから取り除く行を消す（書きかけのファイルを閉じる前に呼ぶ）
+        if self._keys is None:
+            self._keys = {}
+            for path in self._part_files():
+                keys = pq.read_table(path, columns=['application_number', 'publication_number'])
+                self._keys[path] = Counter(zip(keys.column('application_number').to_pylist(),
+                                               keys.column('publication_number').to_pylist()))
+        for path, keys in list(self._keys.items()):
+            removed = {key: keys.pop(key) for key in self._removed if key in keys}
+            if removed:
+                self._filter(path, removed)
+                if not keys:
+                    del self._keys[path]
+        self._removed = set()
+
+    def flush(self):
+        # 書きかけのファイルはそのままにして、ここまでの行を .journal に記録し、取り除いた行を消す
+        if self._removed:
+            self._drop_removed()
+        for month in list(self._buffers):
+            self._writer(month)
+        for month, (part, _) in list(self._writers.items()):
+            if month in self._dropped or os.path.getsize(part) >= self.part_bytes:
+                self._rotate(month)
+            else:
+                self._journal(month)
+
+    def close(self):
+        if self._removed:
+            self._drop_removed()
+        for month in list(self._buffers):
+            self._writer(month)
+        for month in list(self._writers):
+            self._rotate(month)
+
+
+def read_dataset(directory, columns=None, filter=None):
+    """
+    ParquetSink で書き出したディレクトリを読む関数
+
+    出力先にはマニフェストなど Parquet 以外のファイルもあるため、それらは読み飛ばす。
+
+    Args:
+        directory (str): 出力先のディレクトリ
+        columns (list): 読む列（None の場合はすべて。publication_month も指定できる）
+        filter: pyarrow.dataset の条件式（例: ds.field('publication_month') == '2024-01'）
+
+    Returns:
+        pyarrow.Table
+    """
+    dataset = ds.dataset(directory, format='parquet', partitioning='hive', exclude_invalid_files=True)
+    return dataset.to_table(columns=columns, filter=filter)
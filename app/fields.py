@@ -0,0 +1,568 @@
+import re
+from collections import namedtuple
+from xml.etree.ElementTree import iterparse, parse, XMLPullParser, ParseError
+from metrics import timed
+
+# 名前空間の定義
+NAMESPACES = {
+    'xsd': 'http://www.w3.org/2001/XMLSchema',
+    'jppat': 'http://www.jpo.go.jp/standards/XMLSchema/ST96/JPPatent',
+    'com': 'http://www.wipo.int/standards/XMLSchema/ST96/Common',
+    'pat': 'http://www.wipo.int/standards/XMLSchema/ST96/Patent',
+    'jpcom': 'http://www.jpo.go.jp/standards/XMLSchema/ST96/JPCommon',
+    'xsi': 'http://www.w3.org/2001/XMLSchema-instance',
+}
+
+# 公報種別とCSV名の取得に使うパス
+DESIGNATION_XPATH = './/pat:PlainLanguageDesignationText'
+APPLICATION_NUMBER_XPATH = './/com:ApplicationNumber/com:ApplicationNumberText'
+
+# 処理対象の公報種別
+ACCEPTED_DESIGNATIONS = ("公開特許公報(A)", "公表特許公報(A)")
+
+# 公報種別を探すときに読む先頭部分の上限（書誌事項は文書の先頭にある）
+HEADER_LIMIT = 256 * 1024
+
+# 解析の実装（xml_to_csv の backend）
+#   etree: 標準ライブラリの ElementTree と1回走査の照合（既定）
+#   lxml : lxml とコンパイルした XPath（lxmlfields.LxmlExtractor を参照。lxml が必要）
+BACKENDS = ('etree', 'lxml')
+DEFAULT_BACKEND = 'etree'
+
+# 出願人・代理人・発明者の最大件数（既存のデータベースの列数）
+PARTY_SLOTS = 12
+
+# CSVの1列分の定義
+#   name      : 列名
+#   xpath     : 値を取り出すパス（Noneの場合は value をそのまま使う）
+#   join_text : 空でなければ子孫のテキストをこの文字列で連結する
+#   transform : 取り出した文字列に適用する関数
+#   value     : 固定値
+Field = namedtuple('Field', 'name xpath join_text transform value')
+Field.__new__.__defaults__ = (None, "", None, None)
+
+# PDFページ数の列（XMLからは取得しない）
+PAGE_COUNT = 'page_count'
+
+
+def _no_hyphen(text):
+    return text.replace("-", "")
+
+
+# 出願人・代理人・発明者の1件分（sequence は役割ごとの文書内の順番で1から始まる）
+Party = namedtuple('Party', 'role sequence identifier name address')
+
+
+class FieldError(Exception):
+    """
+    列の値を取り出せなかったことを表す例外
+
+    field は列名（当事者の場合は役割、列の無い取得対象の場合はパス）。元の例外は __cause__ に入る。
+    """
+
+    def __init__(self, field, error):
+        super().__init__(f"{field}: {type(error).__name__}: {error}")
+        self.field = field
+
+_PARTY_NAME = 'jpcom:Contact/com:Name/com:EntityName'
+_PARTY_ADDRESS = 'jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'
+
+# 役割 -> (当事者の要素のパス, 識別番号・氏名・住所の相対パス（無い項目は None）)
+PARTY_ROLES = {
+    'applicant': ('.//jppat:Applicant', 'com:PartyIdentifier', _PARTY_NAME, _PARTY_ADDRESS),
+    'agent': ('.//jppat:RegisteredPractitioner', 'pat:RegisteredPractitionerRegistrationNumber', _PARTY_NAME, None),
+    'inventor': ('.//jppat:InventorBag/jppat:Inventor', None, _PARTY_NAME, _PARTY_ADDRESS),
+}
+
+# 旧来の12件分の列名 -> (役割, 順番, Party の項目名)
+PARTY_COLUMNS = {}
+
+
+def _party_fields():
+    # 値は XML から直接ではなく Party の記録から作る（FieldExtractor.row を参照）
+    fields = []
+    for role, items in (
+        ('applicant', (('id', 'identifier'), ('name', 'name'), ('address', 'address'))),
+        ('agent', (('number', 'identifier'), ('name', 'name'))),
+        ('inventor', (('name', 'name'), ('address', 'address'))),
+    ):
+        for n in range(1, PARTY_SLOTS + 1):
+            for suffix, attr in items:
+                name = f'{role}{n}_{suffix}'
+                PARTY_COLUMNS[name] = (role, n, attr)
+                fields.append(Field(name))
+    return fields
+
+
+# CSVの列定義（列の順番はそのままCSVの列順になる）
+FIELDS = [
+    Field('kind_jp', value="Z"),  # 既存のデータベースと帳尻合わせをするため
+    Field('kind_st16', value="Y"),  # 既存のデータベースと帳尻合わせをするため
+    Field('kind', value="種別なし"),  # 既存のデータベースと帳尻合わせをするため
+    Field('publication_number', './/pat:PublicationNumber'),
+    Field('publication_date', './/com:PublicationDate', transform=_no_hyphen),
+    Field('application_number', './/com:ApplicationNumber/com:ApplicationNumberText'),
+    Field('filing_date', './/jppat:ApplicationIdentification/pat:FilingDate', transform=_no_hyphen),
+    Field('invention_title', './/pat:InventionTitle'),
+    Field('ipc', './/jppat:IPCClassification/pat:MainClassification'),
+    Field('claim_count', './/jppat:ClaimTotalQuantitySet/pat:ClaimTotalQuantity'),
+    # PDFページ数
+    Field(PAGE_COUNT),
+    #FI ここはappendでスペース入れないとスペース入れてくれない
+    Field('fi', './/jppat:UnexaminedPatentPublicationBibliographicData/jppat:NationalClassification', "      "),
+    #テーマコード
+    Field('theme_code', './/jppat:ThemeCodeInformationBag/jppat:ThemeCodeInformation'),
+    # Fターム（一部Fタームの記載の無い公開特許公報（A) がある)
+    Field('fterm', './/jppat:FtermInformationBag/jppat:FtermInformation'),
+] + _party_fields() + [
+    #要約【課題】＋【解決手段】＋【選択図】
+    Field('abstract', './/pat:Abstract/com:P', "    "),
+    # 請求項（すべて）
+    Field('claims', './/pat:Claims/pat:Claim/pat:ClaimText', "    "),
+    # 技術分野（すべて）
+    Field('technical_field', './/jppat:Description/pat:TechnicalField/com:P', "    "),
+    # 背景技術（すべて）
+    Field('background_art', './/jppat:Description/pat:BackgroundArt/com:P', "    "),
+    # 特許文献（すべて）
+    Field('patent_citation', './/com:CitationBag/com:PatentCitationBag/com:P/com:PatentCitation/com:PatentCitationText', "    "),
+    # 非特許文献（すべて）
+    Field('npl_citation', './/com:CitationBag/com:NPLCitationBag/com:P/com:NPLCitation/com:NPLCitationText', "    "),
+    # 発明が解決しようとする課題
+    Field('technical_problem', './/pat:InventionSummary/pat:TechnicalProblem/com:P', "    "),
+    # 発明を解決するための手段
+    Field('technical_solution', './/pat:InventionSummary/pat:TechnicalSolution/com:P', "    "),
+    # 発明の効果
+    Field('advantageous_effects', './/pat:InventionSummary/pat:AdvantageousEffects/com:P', "    "),
+    # 発明を実施するための形態
+    Field('embodiment', './/pat:EmbodimentDescription/com:P', "    "),
+    # 産業利用上の可能性
+    Field('industrial_applicability', './/pat:IndustrialApplicability/com:P', "    "),
+    # 図面の簡単な説明
+    Field('drawing_description', './/pat:DrawingDescription/com:P/com:FigureReference', "    "),
+]
+
+COLUMNS = [f.name for f in FIELDS]
+
+
+def party_columns(parties):
+    """
+    Party の記録から旧来の12件分の列の値を作る関数
+
+    Args:
+        parties (list): Party のリスト
+
+    Returns:
+        dict: 列名 -> 値（13件目以降は含まない）
+    """
+    by_role = {}
+    for party in parties:
+        by_role.setdefault(party.role, []).append(party)
+    values = {}
+    for name, (role, n, attr) in PARTY_COLUMNS.items():
+        entries = by_role.get(role, ())
+        values[name] = (getattr(entries[n - 1], attr) or "") if n <= len(entries) else ""
+    return values
+
+
+def parties_from_row(row):
+    """
+    CSVの1行の12件分の列から Party の記録を作る関数（値が1つも無い枠は除く）
+
+    Args:
+        row (list): CSVの1行
+
+    Returns:
+        list: Party のリスト
+    """
+    slots = {}
+    for i, name in enumerate(COLUMNS):
+        if name in PARTY_COLUMNS:
+            role, n, attr = PARTY_COLUMNS[name]
+            slots.setdefault((role, n), {})[attr] = row[i]
+    parties = []
+    for role in PARTY_ROLES:
+        sequence = 0
+        for n in range(1, PARTY_SLOTS + 1):
+            values = slots[(role, n)]
+            if any(values.values()):
+                sequence += 1
+                parties.append(Party(role, sequence, values.get('identifier'),
+                                     values.get('name'), values.get('address')))
+    return parties
+
+_STEP = re.compile(r'^(?:(\w+):)?(\w+)(?:\[(\d+)\])?$')
+
+
+def compile_xpath(xpath, namespaces=NAMESPACES):
+    """
+    './/a:B[n]/c:D' 形式のパスを (タグ, 位置) の組のタプルに変換する関数
+
+    Args:
+        xpath (str): ElementTree の find に渡していたパス
+        namespaces (dict): 接頭辞と名前空間URIの対応
+
+    Returns:
+        tuple: ('{uri}B', n) のような組のタプル（位置指定がない場合は None）
+    """
+    if not xpath.startswith('.//'):
+        raise ValueError(f"Unsupported path: {xpath}")
+    steps = []
+    for step in xpath[3:].split('/'):
+        m = _STEP.match(step)
+        if m is None:
+            raise ValueError(f"Unsupported path step: {step} in {xpath}")
+        prefix, local, index = m.groups()
+        tag = f'{{{namespaces[prefix]}}}{local}' if prefix else local
+        steps.append((tag, int(index) if index else None))
+    return tuple(steps)
+
+
+def element_text(element, join_text=""):
+    # 旧 safe_get_text と同じ規則で要素の文字列を取り出す
+    if join_text:
+        return join_text.join(element.itertext()).replace('\n', '').strip()
+    return element.text.strip() if element.text else ""
+
+
+def read_designation(source, limit=HEADER_LIMIT, chunk_size=16 * 1024):
+    """
+    文書の先頭だけを読んで公報種別を取得する関数
+
+    木全体は作らず、PlainLanguageDesignationText が閉じた時点で読むのをやめる。
+
+    Args:
+        source: XMLファイルのパスまたはバイナリのファイルオブジェクト
+        limit (int): 読み込むバイト数の上限
+        chunk_size (int): 1回に読み込むバイト数
+
+    Returns:
+        str: 公報種別（文書中に無い場合は ""）
+            上限までに見つからない場合や読み取れない場合は None
+    """
+    tag, _ = compile_xpath(DESIGNATION_XPATH)[-1]
+    parser = XMLPullParser(events=('start', 'end'))
+    depth = 0
+    own = not hasattr(source, 'read')
+    f = open(source, 'rb') if own else source
+    try:
+        read = 0
+        while read < limit:
+            chunk = f.read(min(chunk_size, limit - read))
+            if not chunk:
+                parser.close()
+                return ""
+            read += len(chunk)
+            parser.feed(chunk)
+            for event, elem in parser.read_events():
+                if event == 'start':
+                    depth += 1
+                    continue
+                depth -= 1
+                # ルート自身は対象外（find('.//...') と同じ）
+                if elem.tag == tag and depth > 0:
+                    return elem.text.strip() if elem.text else ""
+                # 読み終えた部分は捨てる
+                elem.clear()
+        return None
+    except ParseError:
+        return None
+    finally:
+        if own:
+            f.close()
+
+
+class FieldExtractor:
+    """
+    列定義を1回の走査で全列を取り出せる形にコンパイルしたもの
+
+    各パスを末尾のタグで索引しておき、木を1回だけ走査しながら
+    祖先のタグと兄弟内の位置を照合する。ElementTree の find と同じく
+    文書順で最初に一致した要素の値を採用する。
+    出願人・代理人・発明者は件数の上限なく Party の記録として取り出す。
+    timings に dict を入れると、値の取り出しにかかった時間を列の種類
+    （extract.bibliographic: 書誌、extract.text: 本文、extract.parties: 当事者）ごとに足す。
+    """
+
+    def __init__(self, fields=FIELDS, namespaces=NAMESPACES, party_roles=PARTY_ROLES):
+        self.fields = list(fields)
+        self.namespaces = namespaces
+
+        # 取得対象（パスと連結文字列の組）を重複なく並べる
+        self.targets = []
+        index = {}
+        for f in self.fields:
+            if f.xpath is not None and (f.xpath, f.join_text) not in index:
+                index[(f.xpath, f.join_text)] = len(self.targets)
+                self.targets.append((f.xpath, f.join_text))
+        for xpath in (DESIGNATION_XPATH, APPLICATION_NUMBER_XPATH):
+            if (xpath, None) not in index:
+                index[(xpath, None)] = len(self.targets)
+                self.targets.append((xpath, None))
+        self.designation_slot = index[(DESIGNATION_XPATH, None)]
+        self.application_number_slot = index[(APPLICATION_NUMBER_XPATH, None)]
+        self.field_slots = [
+            index[(f.xpath, f.join_text)] if f.xpath is not None else None
+            for f in self.fields
+        ]
+        # 対象ごとの列名（エラーの表示に使う。列の無い対象はパス）
+        self.slot_names = [xpath for xpath, _ in self.targets]
+        for f, slot in zip(self.fields, self.field_slots):
+            if slot is not None:
+                names = self.slot_names[slot]
+                self.slot_names[slot] = f.name if names == f.xpath else f"{names},{f.name}"
+
+        # 末尾のタグ -> [(対象番号, 末尾の位置, 祖先側のステップ（近い順）)]
+        self.by_tag = {}
+        self.indexed_tags = set()
+        # 子孫のテキストまで必要な対象の末尾のタグ（ストリーム処理で使う）
+        self.joined_tags = set()
+        for slot, (xpath, join_text) in enumerate(self.targets):
+            steps = compile_xpath(xpath, namespaces)
+            for tag, pos in steps:
+                if pos is not None:
+                    self.indexed_tags.add(tag)
+            tag, pos = steps[-1]
+            self.by_tag.setdefault(tag, []).append((slot, pos, steps[-2::-1]))
+            if join_text:
+                self.joined_tags.add(tag)
+
+        # 当事者の要素の末尾のタグ -> [(役割, 祖先側のステップ, 項目の相対パス)]
+        # party_spec は当事者の定義を表す値（parsecache で当事者の記録のキーにする）
+        self.party_spec = tuple(sorted(party_roles.items()))
+        self.party_slot = len(self.targets)
+        self.party_tags = {}
+        for role, (xpath, *items) in party_roles.items():
+            steps = compile_xpath(xpath, namespaces)
+            tag, _ = steps[-1]
+            self.party_tags.setdefault(tag, []).append((role, steps[-2::-1], items))
+            # 項目を読むまで部分木を残しておく
+            self.joined_tags.add(tag)
+        self.visit_tags = set(self.by_tag) | set(self.party_tags)
+
+        # 計測する場合の対象ごとの列の種類（子孫のテキストを連結する対象は本文とする）
+        self.timings = None
+        self.slot_groups = [
+            "extract.text" if join_text else "extract.bibliographic" for _, join_text in self.targets
+        ]
+
+    def _value(self, slot, element):
+        # 取り出せない場合は空文字列にせず、列名を付けて知らせる（文書は quarantine に回る）
+        _, join_text = self.targets[slot]
+        try:
+            if join_text is None:
+                # findtext と同じく前後の空白は残す
+                return element.text or ""
+            return element_text(element, join_text)
+        except Exception as e:
+            raise FieldError(self.slot_names[slot], e) from e
+
+    def _matches(self, path, pos, n, ancestors):
+        if pos is not None and pos != n:
+            return False
+        depth = len(path) - 1
+        if depth < len(ancestors):
+            return False
+        for i, (tag, p) in enumerate(ancestors, 1):
+            t, k = path[-1 - i]
+            if t != tag or (p is not None and p != k):
+                return False
+        return True
+
+    def visit(self, element, path, results):
+        """
+        要素1つ分の照合を行う（path の末尾は element 自身）
+
+        Args:
+            element: 照合する要素（テキストを読める状態であること）
+            path (list): ルートを除いた祖先から element までの (タグ, 位置) のリスト
+            results (list): _new_results で作った取得結果（未取得は None）
+        """
+        if self.timings is not None:
+            return self._timed_visit(element, path, results)
+        tag, n = path[-1]
+        for slot, pos, ancestors in self.by_tag.get(tag, ()):
+            if results[slot] is None and self._matches(path, pos, n, ancestors):
+                results[slot] = self._value(slot, element)
+        for role, ancestors, items in self.party_tags.get(tag, ()):
+            if self._matches(path, None, n, ancestors):
+                self._add_party(element, role, items, results)
+
+    def _timed_visit(self, element, path, results):
+        # visit と同じ照合を、値の取り出しの時間を測りながら行う
+        timings = self.timings
+        tag, n = path[-1]
+        for slot, pos, ancestors in self.by_tag.get(tag, ()):
+            if results[slot] is None and self._matches(path, pos, n, ancestors):
+                with timed(timings, self.slot_groups[slot]):
+                    results[slot] = self._value(slot, element)
+        for role, ancestors, items in self.party_tags.get(tag, ()):
+            if self._matches(path, None, n, ancestors):
+                with timed(timings, "extract.parties"):
+                    self._add_party(element, role, items, results)
+
+    def _add_party(self, element, role, items, results):
+        # 当事者1人分の項目を読み、Party として追加する
+        parties = results[self.party_slot]
+        sequence = sum(1 for p in parties if p.role == role) + 1
+        values = []
+        try:
+            for item in items:
+                found = element.find(item, self.namespaces) if item else None
+                values.append(element_text(found) if found is not None else ("" if item else None))
+        except Exception as e:
+            raise FieldError(role, e) from e
+        parties.append(Party(role, sequence, *values))
+
+    def parse(self, source):
+        """
+        XMLを読んで木を作り、ルート要素を返す関数（scan に渡す）
+
+        Args:
+            source: XMLファイルのパスまたはバイナリのファイルオブジェクト
+        """
+        return parse(source).getroot()
+
+    def _new_results(self):
+        # 対象ごとの値と、最後に Party のリスト
+        return [None] * len(self.targets) + [[]]
+
+    def scan(self, root):
+        """
+        木を1回走査して全対象の値を取り出す関数
+
+        Args:
+            root: 文書のルート要素
+
+        Returns:
+            list: 対象ごとの値（見つからなかった対象は None）と Party のリスト
+        """
+        results = self._new_results()
+        visit_tags = self.visit_tags
+        indexed = self.indexed_tags
+        path = []
+
+        def walk(parent):
+            counts = {}
+            for child in parent:
+                tag = child.tag
+                if tag in indexed:
+                    n = counts[tag] = counts.get(tag, 0) + 1
+                else:
+                    n = None
+                path.append((tag, n))
+                if tag in visit_tags:
+                    self.visit(child, path, results)
+                if len(child):
+                    walk(child)
+                path.pop()
+
+        walk(root)
+        return results
+
+    def scan_stream(self, source):
+        """
+        XMLを逐次読み込みながら全対象の値を取り出す関数
+
+        要素が閉じた時点で照合し、値を取り出し終えた部分木はすぐに捨てるため、
+        文書全体の木を保持しない。メモリ使用量はおおよそ最大の段落1つ分で済む。
+        同じ対象に入れ子で一致する要素がない限り scan と同じ結果になる。
+
+        Args:
+            source: XMLファイルのパスまたはバイナリのファイルオブジェクト
+
+        Returns:
+            list: 対象ごとの値（見つからなかった対象は None）と Party のリスト
+        """
+        results = self._new_results()
+        visit_tags = self.visit_tags
+        indexed = self.indexed_tags
+        joined = self.joined_tags
+        path = []
+        parents = []   # 開いている要素
+        counts = []    # 開いている要素ごとの子タグの出現数
+        held = 0       # 開いている要素のうち、子孫のテキストが必要なものの数
+
+        for event, elem in iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                if parents:
+                    tag = elem.tag
+                    if tag in indexed:
+                        c = counts[-1]
+                        n = c[tag] = c.get(tag, 0) + 1
+                    else:
+                        n = None
+                    path.append((tag, n))
+                    if tag in joined:
+                        held += 1
+                parents.append(elem)
+                counts.append({})
+                continue
+
+            parents.pop()
+            counts.pop()
+            if not parents:
+                break
+            tag = elem.tag
+            if tag in visit_tags:
+                self.visit(elem, path, results)
+            if tag in joined:
+                held -= 1
+            path.pop()
+            if not held:
+                # 処理済みの部分木を親から切り離す
+                del parents[-1][:]
+
+        return results
+
+    def designation(self, results):
+        return results[self.designation_slot] and results[self.designation_slot].strip() or ""
+
+    def application_number(self, results):
+        return results[self.application_number_slot] or ""
+
+    def parties(self, results):
+        return results[self.party_slot]
+
+    def row(self, results, page_count):
+        """
+        取得結果からCSVの1行を組み立てる関数
+
+        Args:
+            results (list): scan の戻り値
+            page_count (int): PDFのページ数
+
+        Returns:
+            list: CSVの1行
+        """
+        data = []
+        party_values = party_columns(self.parties(results))
+        for f, slot in zip(self.fields, self.field_slots):
+            if f.name == PAGE_COUNT:
+                data.append(page_count)
+            elif f.name in party_values:
+                data.append(party_values[f.name])
+            elif slot is None:
+                data.append(f.value)
+            else:
+                text = results[slot] or ""
+                if f.transform:
+                    try:
+                        text = f.transform(text)
+                    except Exception as e:
+                        raise FieldError(f.name, e) from e
+                data.append(text)
+        return data
+
+
+def make_extractor(fields=FIELDS, namespaces=NAMESPACES, party_roles=PARTY_ROLES, backend=DEFAULT_BACKEND):
+    """
+    解析の実装（BACKENDS のいずれか）の FieldExtractor を作る関数
+
+    どの実装も同じ列定義から同じ値を取り出す（bench/bench_backends.py で確かめる）。
+    """
+    if backend == 'etree':
+        return FieldExtractor(fields, namespaces, party_roles)
+    if backend == 'lxml':
+        from lxmlfields import LxmlExtractor
+        return LxmlExtractor(fields, namespaces, party_roles)
+    raise ValueError(f"Unknown backend: {backend}")
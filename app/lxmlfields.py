@@ -0,0 +1,159 @@
+from fields import FIELDS, NAMESPACES, PARTY_ROLES, FieldError, FieldExtractor, Party, element_text
+from metrics import timed
+
+try:
+    from lxml import etree
+except ImportError:  # 既定の etree の実装だけを使う場合は不要
+    etree = None
+
+# fields.FieldExtractor と同じ値を lxml で取り出す実装（xml_to_csv の backend='lxml'）
+# 木の作成と、取得対象の末尾のタグを持つ要素の列挙は libxml2 が行い、Python では
+# 祖先のタグの照合と値の文字列の組み立てだけを行う。
+# 位置指定（B[n]）を含むパスと当事者の項目は、プロセスごとに1回だけ XPath にコンパイルする。
+# （パスごとに XPath で木全体を検索すると、取得対象の数だけ木を走査するため遅い）
+
+
+class LxmlExtractor(FieldExtractor):
+    """
+    列定義を lxml で取り出せる形にコンパイルしたもの
+
+    ElementTree の find と同じく文書順で最初に一致した要素の値を採用し、
+    出願人・代理人・発明者は文書順に取り出す（FieldExtractor と同じ結果になる）。
+    コメントと処理命令は ElementTree と同じく読み捨てる。
+    逐次読み込み（scan_stream）は FieldExtractor と同じ実装を使う。
+    lxml が必要（pip install lxml）。
+    """
+
+    def __init__(self, fields=FIELDS, namespaces=NAMESPACES, party_roles=PARTY_ROLES):
+        if etree is None:
+            raise ImportError("lxml の実装には lxml が必要です (pip install lxml)")
+        super().__init__(fields, namespaces, party_roles)
+        # 内部のDTDで定義された実体だけを展開する（ElementTree と同じ。外部のファイルは読まない）
+        self.parser = etree.XMLParser(remove_comments=True, remove_pis=True, huge_tree=True,
+                                      resolve_entities='internal')
+
+        # 位置指定を含むパスは XPath で照合する
+        # それ以外は 末尾のタグ -> 親のタグ -> [(親より上の祖先のタグ（近い順）, 対象番号)] で照合する
+        # （親のタグで先に絞り込み、段落のように数の多い要素の照合を1回の辞書の参照で済ませる。
+        #   パスが1段だけの対象は親を問わないため、親のタグと祖先のタグを None とする）
+        self.xpaths = []
+        self.by_last_tag = {}
+        for tag, entries in self.by_tag.items():
+            for slot, pos, ancestors in entries:
+                if pos is None and all(p is None for _, p in ancestors):
+                    self._add_matcher(self.by_last_tag, tag, ancestors, slot)
+                else:
+                    xpath, _ = self.targets[slot]
+                    self.xpaths.append((slot, etree.XPath(f"({xpath})[1]", namespaces=namespaces)))
+
+        # 当事者も同じ形で照合する（値は (役割, 項目の XPath（無い項目は None））
+        self.party_by_tag = {}
+        for tag, entries in self.party_tags.items():
+            for role, ancestors, items in entries:
+                if any(p is not None for _, p in ancestors):
+                    raise ValueError(f"Unsupported party path for lxml: {party_roles[role][0]}")
+                compiled = [etree.XPath(f"({item})[1]", namespaces=namespaces) if item else None for item in items]
+                self._add_matcher(self.party_by_tag, tag, ancestors, (role, compiled))
+        self.iter_tags = tuple(set(self.by_last_tag) | set(self.party_by_tag))
+
+    @staticmethod
+    def _add_matcher(index, tag, ancestors, value):
+        tags = tuple(t for t, _ in ancestors)
+        if tags:
+            index.setdefault(tag, {}).setdefault(tags[0], []).append((tags[1:], value))
+        else:
+            index.setdefault(tag, {}).setdefault(None, []).append((None, value))
+
+    def parse(self, source):
+        return etree.parse(source, self.parser).getroot()
+
+    @staticmethod
+    def _candidates(index, tag, parent):
+        # 親のタグが一致する照合と、親のタグを問わない照合
+        by_parent = index.get(tag)
+        if by_parent is None:
+            return ()
+        any_parent = by_parent.get(None, ())
+        same_parent = by_parent.get(parent.tag, ())
+        return same_parent + any_parent if any_parent and same_parent else same_parent or any_parent
+
+    @staticmethod
+    def _ancestors_match(parent, ancestors):
+        # 親より上の祖先のタグを近い順に照合する（ルート自身は対象外。find('.//...') と同じ）
+        # ancestors が None の場合（パスが1段だけ）は、ルート以外のどの要素とも一致する
+        if ancestors is None:
+            return True
+        node = parent
+        for tag in ancestors:
+            node = node.getparent()
+            if node is None or node.tag != tag:
+                return False
+        return node.getparent() is not None
+
+    def scan(self, root):
+        """
+        木から全対象の値を取り出す関数（FieldExtractor.scan と同じ戻り値）
+
+        Args:
+            root: lxml で作った文書のルート要素（parse の戻り値）
+        """
+        if self.timings is not None:
+            return self._timed_scan(root)
+        results = self._new_results()
+        by_last_tag = self.by_last_tag
+        party_by_tag = self.party_by_tag
+        candidates = self._candidates
+        matches = self._ancestors_match
+        for element in root.iter(*self.iter_tags):
+            tag = element.tag
+            parent = element.getparent()
+            if parent is None:
+                continue
+            for ancestors, slot in candidates(by_last_tag, tag, parent):
+                if results[slot] is None and matches(parent, ancestors):
+                    results[slot] = self._value(slot, element)
+            for ancestors, (role, items) in candidates(party_by_tag, tag, parent):
+                if matches(parent, ancestors):
+                    self._add_lxml_party(element, role, items, results)
+        for slot, xpath in self.xpaths:
+            found = xpath(root)
+            if found:
+                results[slot] = self._value(slot, found[0])
+        return results
+
+    def _timed_scan(self, root):
+        # scan と同じ照合を、値の取り出しの時間を測りながら行う
+        timings = self.timings
+        results = self._new_results()
+        for element in root.iter(*self.iter_tags):
+            tag = element.tag
+            parent = element.getparent()
+            if parent is None:
+                continue
+            for ancestors, slot in self._candidates(self.by_last_tag, tag, parent):
+                if results[slot] is None and self._ancestors_match(parent, ancestors):
+                    with timed(timings, self.slot_groups[slot]):
+                        results[slot] = self._value(slot, element)
+            for ancestors, (role, items) in self._candidates(self.party_by_tag, tag, parent):
+                if self._ancestors_match(parent, ancestors):
+                    with timed(timings, "extract.parties"):
+                        self._add_lxml_party(element, role, items, results)
+        for slot, xpath in self.xpaths:
+            with timed(timings, self.slot_groups[slot]):
+                found = xpath(root)
+                if found:
+                    results[slot] = self._value(slot, found[0])
+        return results
+
+    def _add_lxml_party(self, element, role, items, results):
+        # 当事者1人分の項目を読み、Party として追加する（FieldExtractor._add_party と同じ値）
+        parties = results[self.party_slot]
+        sequence = sum(1 for p in parties if p.role == role) + 1
+        values = []
+        try:
+            for item in items:
+                found = item(element) if item is not None else None
+                values.append(element_text(found[0]) if found else ("" if item is not None else None))
+        except Exception as e:
+            raise FieldError(role, e) from e
+        parties.append(Party(role, sequence, *values))
@@ -0,0 +1,151 @@
+import os
+import json
+import sqlite3
+import hashlib
+from pathlib import Path
+
+from sources import pdf_signature
+
+# 処理済みのファイルを記録し、再実行時に変更のないファイルを読み飛ばすためのマニフェスト
+
+MANIFEST_NAME = 'manifest.sqlite'
+
+
+def _key(path):
+    # 相対パスと絶対パスのどちらで実行しても同じ記録を使う
+    return os.path.abspath(os.fspath(path))
+
+
+def _signature(path):
+    # (キー, サイズ, 更新の目印)。ZIPの中のファイルは自身で持っている値を使う
+    if hasattr(path, 'signature'):
+        return path.signature()
+    key = _key(path)
+    st = os.stat(key)
+    return key, st.st_size, st.st_mtime_ns
+
+
+def _key_of(path):
+    return path.signature()[0] if hasattr(path, 'signature') else _key(path)
+
+
+def _pdf_stamp(path):
+    # XMLと同じ場所のPDFの目印（sources.pdf_signature）を記録できる文字列にする（PDFが1つでない場合は ''）
+    signature = pdf_signature(path if hasattr(path, 'signature') else Path(_key(path)))
+    return '' if signature is None else json.dumps(list(signature), ensure_ascii=False)
+
+
+def file_digest(path, chunk_size=1 << 20):
+    # ファイルの内容のハッシュ（SHA-1）
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Manifest:
+    """
+    入力XMLごとのサイズ・更新日時・ハッシュ・同じ場所のPDFの目印と、そこから作った行の場所を記録するもの
+
+    記録は出力ディレクトリの SQLite ファイルに保存する。
+    """
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            " path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT,"
+            " status TEXT, csv_name TEXT, publication_number TEXT, pdf TEXT)"
+        )
+        if 'pdf' not in [r[1] for r in self.db.execute("PRAGMA table_info(sources)")]:
+            # PDFの目印を記録していなかったマニフェスト（次に変更なしと判定したときに目印を記録する）
+            self.db.execute("ALTER TABLE sources ADD COLUMN pdf TEXT")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS loaded_csv ("
+            " path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER)"
+        )
+        self.db.commit()
+        self._pending = {}
+
+    @classmethod
+    def in_directory(cls, directory):
+        os.makedirs(directory, exist_ok=True)
+        return cls(os.path.join(directory, MANIFEST_NAME))
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def previous(self, path):
+        """
+        前回 path から作った行の場所を返す関数
+
+        Returns:
+            tuple: (CSV名, 公開番号)（記録が無い場合は None）
+        """
+        row = self.db.execute(
+            "SELECT csv_name, publication_number FROM sources WHERE path = ? AND status = 'ok'",
+            (_key_of(path),)).fetchone()
+        return row
+
+    def needs_processing(self, path):
+        """
+        path を処理し直す必要があるかを返す関数
+
+        サイズと更新日時が同じ場合は読まずに変更なしとみなす。
+        異なる場合だけ内容のハッシュを比べる。
+        XMLが同じでも、同じ場所のPDFが差し替えられた場合（ページ数が変わりうる）は処理し直す。
+        """
+        key, size, stamp = _signature(path)
+        pdf = _pdf_stamp(path)
+        row = self.db.execute(
+            "SELECT size, mtime_ns, digest, pdf FROM sources WHERE path = ?", (key,)).fetchone()
+        # PDFの目印が無い古い記録は、今のPDFを前回と同じものとみなす
+        same_pdf = row is not None and row[3] in (None, pdf)
+        if same_pdf and row[0] == size and row[1] == stamp:
+            if row[3] is None:
+                self.db.execute("UPDATE sources SET pdf = ? WHERE path = ?", (pdf, key))
+            return False
+        digest = path.digest() if hasattr(path, 'digest') else file_digest(key)
+        if same_pdf and row[2] == digest:
+            # 内容は同じなので更新日時だけ記録し直す
+            self.db.execute(
+                "UPDATE sources SET size = ?, mtime_ns = ?, pdf = ? WHERE path = ?",
+                (size, stamp, pdf, key))
+            return False
+        self._pending[key] = (size, stamp, digest, pdf)
+        return True
+
+    def record(self, path, status, csv_name=None, publication_number=None):
+        # 処理結果を記録する（エラーは記録しないので次回もう一度処理される）
+        key = _key_of(path)
+        stat = self._pending.pop(key, None)
+        if status == "error" or stat is None:
+            return
+        size, stamp, digest, pdf = stat
+        self.db.execute(
+            "INSERT OR REPLACE INTO sources (path, size, mtime_ns, digest, status, csv_name, publication_number, pdf)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, size, stamp, digest, status, csv_name, publication_number, pdf))
+
+    def csv_changed(self, path):
+        # 前回データベースへ投入してから CSV が変わったか
+        key = _key(path)
+        st = os.stat(key)
+        row = self.db.execute(
+            "SELECT size, mtime_ns FROM loaded_csv WHERE path = ?", (key,)).fetchone()
+        return row is None or row != (st.st_size, st.st_mtime_ns)
+
+    def mark_csv_loaded(self, paths):
+        for path in paths:
+            key = _key(path)
+            st = os.stat(key)
+            self.db.execute(
+                "INSERT OR REPLACE INTO loaded_csv VALUES (?, ?, ?)",
+                (key, st.st_size, st.st_mtime_ns))
+        self.db.commit()
+
+    def commit(self):
+        self.db.commit()
@@ -0,0 +1,310 @@
+import os
+import json
+import time
+import bisect
+import cProfile
+import tracemalloc
+import contextlib
+from collections import namedtuple
+
+# 処理の段階ごとの時間・件数と、文書の大きさ・1件あたりの処理時間の分布を集める。
+# Metrics を渡さない場合（既定）は何も測らず、段階の計測は何もしない共通のオブジェクトで済ませる。
+# 解析はワーカープロセスで行うため、ワーカーは1件ごとの計測結果を返し、親プロセスでまとめる。
+
+# 1件あたりの処理時間の区切り（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# 文書の大きさの区切り（バイト）
+SIZE_BUCKETS = tuple(2**n for n in range(12, 31, 2))  # 4KB ～ 1GB
+
+PROMETHEUS_PREFIX = 'patent_parser'
+
+# ワーカーに渡す標本の取り方
+#   every       : この件数ごとに1件を標本にする（0 の場合は取らない）
+#   profile_dir : 標本の cProfile の結果（<文書名>.prof）を書き出すディレクトリ（None の場合は取らない）
+#   trace_memory: True の場合は標本の tracemalloc のピークを測る
+Sampling = namedtuple('Sampling', 'every profile_dir trace_memory')
+
+_NULL = contextlib.nullcontext()
+
+
+class _Timer:
+    __slots__ = ('timings', 'name', 'start')
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.timings[self.name] = self.timings.get(self.name, 0.0) + time.perf_counter() - self.start
+
+
+def timed(timings, name):
+    """
+    with timed(timings, '段階名'): の間の時間を timings に足す（timings が None の場合は何もしない）
+    """
+    if timings is None:
+        return _NULL
+    return _Timer(timings, name)
+
+
+class Histogram:
+    """
+    区切りごとの件数を数える分布（Prometheus の histogram と同じ累積しない形で持つ）
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        # 区切りの上端で近似する（最後の区切りを超える場合は最大値）
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'buckets': list(self.buckets), 'counts': self.counts, 'sum': self.sum,
+                'count': self.count, 'max': self.max}
+
+
+def _source_size(source):
+    # ZIPの中のファイルは展開後の大きさ
+    if hasattr(source, 'size'):
+        return source.size
+    try:
+        return os.path.getsize(source)
+    except OSError:
+        return 0
+
+
+def run_document(item, process, sampling):
+    """
+    1件を計測しながら処理する関数（ワーカープロセスから呼ばれる）
+
+    Args:
+        item (tuple): (入力中の番号, XMLファイル)
+        process (callable): process(XMLファイル, timings=dict) で結果を返す関数
+        sampling (Sampling): 標本の取り方
+
+    Returns:
+        tuple: (process の戻り値, 計測結果の dict)
+    """
+    index, source = item
+    timings = {}
+    sample = bool(sampling.every) and index % sampling.every == 0
+    profile = cProfile.Profile() if sample and sampling.profile_dir else None
+    trace = sample and sampling.trace_memory and not tracemalloc.is_tracing()
+    if trace:
+        tracemalloc.start()
+    if profile is not None:
+        profile.enable()
+    start = time.perf_counter()
+    try:
+        result = process(source, timings=timings)
+    finally:
+        latency = time.perf_counter() - start
+        if profile is not None:
+            profile.disable()
+        peak = None
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    if profile is not None:
+        os.makedirs(sampling.profile_dir, exist_ok=True)
+        name = getattr(source, 'stem', None) or os.path.splitext(os.path.basename(os.fspath(source)))[0]
+        profile.dump_stats(os.path.join(sampling.profile_dir, f"{index:06d}_{name}.prof"))
+    return result, {'timings': timings, 'latency': latency, 'size': _source_size(source),
+                    'status': result[0], 'peak_memory': peak}
+
+
+class Metrics:
+    """
+    1回の実行の計測結果
+
+    段階の時間（timer/add_time）、件数（count）、分布（observe）、現在の値（gauge）を集め、
+    finish() で集計を表示し、指定があれば JSON と Prometheus の textfile 形式で書き出す。
+    ワーカーの段階の時間は全ワーカーの合計のため、経過時間より長くなることがある。
+
+    Args:
+        json_path (str): 集計を書き出す JSON ファイル
+        prometheus_path (str): 集計を書き出す Prometheus の textfile（node_exporter の textfile collector 向け）
+        sample_every (int): この件数ごとに1件を標本にする（0 の場合は取らない）
+        profile_dir (str): 標本の cProfile の結果を書き出すディレクトリ
+        trace_memory (bool): True の場合は標本の tracemalloc のピークを測る
+    """
+
+    enabled = True
+
+    def __init__(self, json_path=None, prometheus_path=None, sample_every=0, profile_dir=None, trace_memory=False):
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.sampling = Sampling(sample_every, profile_dir, trace_memory)
+        self.timings = {}
+        self.calls = {}
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {
+            'document_latency_seconds': Histogram(LATENCY_BUCKETS),
+            'document_size_bytes': Histogram(SIZE_BUCKETS),
+        }
+        self.started = time.perf_counter()
+
+    def timer(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        return _Timer(self.timings, name)
+
+    def add_time(self, name, seconds, calls=1):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + calls
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        # 待ち行列の長さのように増減する値（最後に設定した値だけを持つ）
+        self.gauges[name] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(buckets)
+        histogram.observe(value)
+
+    def add_document(self, sample):
+        # run_document の計測結果を足す
+        for name, seconds in sample['timings'].items():
+            self.add_time(name, seconds)
+        self.add_time('document', sample['latency'])
+        self.histograms['document_latency_seconds'].observe(sample['latency'])
+        self.histograms['document_size_bytes'].observe(sample['size'])
+        if sample['peak_memory'] is not None:
+            self.observe('sample_peak_memory_bytes', sample['peak_memory'], SIZE_BUCKETS)
+
+    def to_dict(self):
+        return {
+            'wall_seconds': time.perf_counter() - self.started,
+            'timings': {name: {'seconds': s, 'calls': self.calls.get(name, 0)} for name, s in self.timings.items()},
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+            'histograms': {name: h.to_dict() for name, h in self.histograms.items() if h.count},
+        }
+
+    def report(self):
+        data = self.to_dict()
+        wall = data['wall_seconds']
+        documents = self.histograms['document_latency_seconds'].count
+        print(f"--- metrics: {wall:.2f} s, {documents} documents"
+              + (f" ({documents / wall:.1f} docs/s)" if wall and documents else "") + " ---")
+        if self.counters:
+            print("  " + ", ".join(f"{name}: {n}" for name, n in sorted(self.counters.items())))
+        if self.gauges:
+            print("  " + ", ".join(f"{name}: {v:g}" for name, v in sorted(self.gauges.items())))
+        print(f"  {'stage':<34} {'total s':>9} {'calls':>8} {'mean ms':>9}")
+        for name, item in sorted(data['timings'].items(), key=lambda kv: -kv[1]['seconds']):
+            calls = item['calls'] or 1
+            print(f"  {name:<34} {item['seconds']:>9.3f} {item['calls']:>8} {item['seconds'] / calls * 1000:>9.3f}")
+        for name, h in self.histograms.items():
+            if not h.count:
+                continue
+            print(f"  {name}: p50 <= {h.quantile(0.5):g}, p90 <= {h.quantile(0.9):g}, "
+                  f"p99 <= {h.quantile(0.99):g}, max {h.max:g}")
+
+    def write_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+    def write_prometheus(self, path):
+        # 書きかけのファイルを読まれないように一時ファイルから置き換える
+        p = PROMETHEUS_PREFIX
+        lines = [f"# TYPE {p}_stage_seconds_total counter", f"# TYPE {p}_stage_calls_total counter"]
+        for name, seconds in sorted(self.timings.items()):
+            lines.append(f'{p}_stage_seconds_total{{stage="{name}"}} {seconds:.6f}')
+            lines.append(f'{p}_stage_calls_total{{stage="{name}"}} {self.calls.get(name, 0)}')
+        lines.append(f"# TYPE {p}_events_total counter")
+        for name, n in sorted(self.counters.items()):
+            lines.append(f'{p}_events_total{{name="{name}"}} {n}')
+        for name, value in sorted(self.gauges.items()):
+            lines.append(f"# TYPE {p}_{name} gauge")
+            lines.append(f"{p}_{name} {value}")
+        for name, h in sorted(self.histograms.items()):
+            if not h.count:
+                continue
+            lines.append(f"# TYPE {p}_{name} histogram")
+            cumulative = 0
+            for bound, n in zip(h.buckets, h.counts):
+                cumulative += n
+                lines.append(f'{p}_{name}_bucket{{le="{bound:g}"}} {cumulative}')
+            lines.append(f'{p}_{name}_bucket{{le="+Inf"}} {h.count}')
+            lines.append(f"{p}_{name}_sum {h.sum:g}")
+            lines.append(f"{p}_{name}_count {h.count}")
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, path)
+
+    def write(self):
+        # 指定があれば集計をファイルに書き出す（常駐する処理では途中でも書き出す）
+        if self.json_path:
+            self.write_json(self.json_path)
+        if self.prometheus_path:
+            self.write_prometheus(self.prometheus_path)
+
+    def finish(self):
+        # 集計を表示し、指定があればファイルに書き出す
+        self.report()
+        self.write()
+
+
+class _NullMetrics:
+    """
+    何も測らない Metrics（計測しない場合に使う）
+    """
+
+    enabled = False
+    sampling = Sampling(0, None, False)
+
+    def timer(self, name):
+        return _NULL
+
+    def add_time(self, name, seconds, calls=1):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def gauge(self, name, value):
+        pass
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS):
+        pass
+
+    def add_document(self, sample):
+        pass
+
+    def write(self):
+        pass
+
+    def finish(self):
+        pass
+
+
+NULL_METRICS = _NullMetrics()
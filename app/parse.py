@@ -1,16 +1,39 @@
 import sys
 import glob
 import os
+import time
 import codecs
 import csv
-from xml.etree.ElementTree import parse
+import collections
+import signal
+import functools
+import multiprocessing
 from pathlib import Path
-import PyPDF2
+from pdfpages import list_pdfs, page_count
+from manifest import MANIFEST_NAME, Manifest
+from sources import ZipMember, close_archives, is_zip, iter_sources, open_source, pdf_signature, zip_pdf_page_count
+from sinks import PUBLICATION_NUMBER_COLUMN, PerApplicationSink, ShardedSink, TeeSink, remove_rows
+from fields import (FIELDS, COLUMNS, NAMESPACES, ACCEPTED_DESIGNATIONS, DEFAULT_BACKEND, PARTY_ROLES, Field, Party,
+                    make_extractor, read_designation)
+from metrics import NULL_METRICS, run_document, timed
+from parsecache import CACHE_BYTES, ParseCache, new_entry, source_key
+from quarantine import QUARANTINE_DIR, Quarantine, document_error
+
+# 本文の列は非常に長いため、CSVを読み直すときの上限を引き上げておく
+csv.field_size_limit(2**31 - 1)
+
+# 途中経過を保存する間隔（件数と秒数のどちらかに達したら保存する）
+CHECKPOINT_DOCS = 1000
+CHECKPOINT_SECONDS = 60
 
 def get_pdf_page_count(directory):
     """
     指定されたディレクトリ内の単一のPDFファイルのページ数を取得する関数
 
+    ディレクトリの一覧とページ数はキャッシュされるため、同じディレクトリを
+    何度指定しても読み直さない。ページ数は trailer とページツリーの /Count から
+    求め、読み取れない場合だけ PyPDF2 で解析する。
+
     Args:
         directory (str): PDFファイルが格納されているディレクトリのパス
 
@@ -18,7 +41,7 @@ def get_pdf_page_count(directory):
         int: PDFのページ数 (PDFが見つからない場合は0)
     """
     # ディレクトリ内のファイルリストを取得
-    files = [f for f in os.listdir(directory) if f.lower().endswith('.pdf')]
+    files = list_pdfs(directory)
 
     # PDFファイルが1つでない場合は0を返す
     if len(files) != 1:
@@ -29,223 +52,535 @@ def get_pdf_page_count(directory):
     pdf_path = os.path.join(directory, files[0])
 
     try:
-        # PDFファイルを開く
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            # ページ数を取得
-            page_count = len(pdf_reader.pages)
-            return page_count
+        return page_count(pdf_path)
 
     except Exception as e:
         print(f"PDFファイルの読み取り中にエラーが発生しました: {e}")
         return 0
 
-def xml_to_csv(ipt, opt):
-    p = Path(ipt)
-    xml_path = list(p.glob('**/*.xml'))
-    os.makedirs(opt, exist_ok=True)
-    os.chdir(opt)
-
-    # 名前空間の定義
-    namespaces = {
-        'xsd': 'http://www.w3.org/2001/XMLSchema',
-        'jppat': 'http://www.jpo.go.jp/standards/XMLSchema/ST96/JPPatent',
-        'com': 'http://www.wipo.int/standards/XMLSchema/ST96/Common',
-        'pat': 'http://www.wipo.int/standards/XMLSchema/ST96/Patent',
-        'jpcom': 'http://www.jpo.go.jp/standards/XMLSchema/ST96/JPCommon',
-        'xsi': 'http://www.w3.org/2001/XMLSchema-instance',
-    }
-
-    for xml_file in xml_path:
-        try:
-            print(f"Processing file: {xml_file}")
-            
-            tree = parse(xml_file)
-            elem = tree.getroot()
-
-            # データ抽出関数
-            def safe_get_text(xpath, join_text=""):
-                try:
-                    element = elem.find(xpath, namespaces=namespaces)
-                    if element is not None:
-                        if join_text:
-                            return join_text.join(element.itertext()).replace('\n', '').strip()
-                        return element.text.strip() if element.text else ""
-                    return ""
-                except Exception as e:
-                    print(f"Error extracting {xpath}: {str(e)}")
-                    return ""
-
-            # 公報種別の取得
-            publication_status = safe_get_text('.//pat:PlainLanguageDesignationText')
-            
-            # 公開特許公報(A)または公表特許公報(A)の場合のみ処理を続行
-            if publication_status in ["公開特許公報(A)", "公表特許公報(A)"]:
-                # CSV名の決定
-                csv_name = elem.findtext('.//com:ApplicationNumber/com:ApplicationNumberText', namespaces=namespaces)
-                if not csv_name:
-                    csv_name = xml_file.stem
-                
-                csv_path = Path(opt) / f"{csv_name}.csv"
-                
-                # PDFページ数の取得（XMLと同じディレクトリを想定）
+
+# ワーカープロセスごとに1回だけ列定義をコンパイルする（解析の実装 -> FieldExtractor）
+_extractors = {}
+# キャッシュに無い取得対象だけを取り出す列定義（(取得対象, 当事者も取り出すか, 解析の実装) -> FieldExtractor）
+_partial_extractors = {}
+# ワーカープロセスごとに開く解析結果のキャッシュ（(ディレクトリ, プロセスID) -> ParseCache）
+_caches = {}
+
+
+def _get_extractor(backend=DEFAULT_BACKEND):
+    extractor = _extractors.get(backend)
+    if extractor is None:
+        extractor = _extractors[backend] = make_extractor(FIELDS, NAMESPACES, backend=backend)
+    return extractor
+
+
+def _get_partial_extractor(targets, parties, backend=DEFAULT_BACKEND):
+    key = (targets, parties, backend)
+    extractor = _partial_extractors.get(key)
+    if extractor is None:
+        # 公報種別と出願番号の取得対象は FieldExtractor が必ず加える
+        fields = [Field(f"target{i}", xpath, join_text)
+                  for i, (xpath, join_text) in enumerate(targets) if join_text is not None]
+        extractor = _partial_extractors[key] = make_extractor(
+            fields, NAMESPACES, PARTY_ROLES if parties else {}, backend)
+    return extractor
+
+
+def _get_cache(directory):
+    # フォークしたプロセスでは親の接続を使わない（SQLite の接続はプロセス間で共有できない）
+    key = (directory, os.getpid())
+    cache = _caches.get(key)
+    if cache is None:
+        cache = _caches[key] = ParseCache.in_directory(directory)
+    return cache
+
+
+def _close_caches():
+    for key in [k for k in _caches if k[1] == os.getpid()]:
+        _caches.pop(key).close()
+
+
+def _scan(extractor, xml_file, streaming, timings):
+    # XMLを読み、extractor の取得対象を取り出す
+    extractor.timings = timings
+    with open_source(xml_file) as f:
+        if streaming:
+            # 大きな文書でもメモリ使用量を抑える（読み込みと取り出しを同時に行う）
+            with timed(timings, 'extract'):
+                return extractor.scan_stream(f)
+        with timed(timings, 'parse'):
+            elem = extractor.parse(f)
+
+        # 全列を1回の走査で取り出す
+        with timed(timings, 'extract'):
+            return extractor.scan(elem)
+
+
+def _scan_cached(extractor, entry, xml_file, streaming, timings, backend):
+    """
+    キャッシュの値を使い、足りない取得対象（と当事者）だけをXMLから取り出す関数
+
+    Returns:
+        tuple: (extractor.scan と同じ形の取得結果, entry に値を足したかどうか)
+    """
+    fields = entry['fields']
+    missing = tuple(t for t in extractor.targets if t not in fields)
+    parties_missing = extractor.party_spec not in entry['parties']
+    if missing or parties_missing:
+        if len(missing) == len(extractor.targets) and parties_missing:
+            partial = extractor
+        else:
+            partial = _get_partial_extractor(missing, parties_missing, backend)
+        found = _scan(partial, xml_file, streaming, timings)
+        fields.update(zip(partial.targets, found))
+        if parties_missing:
+            entry['parties'][extractor.party_spec] = [tuple(p) for p in partial.parties(found)]
+    results = [fields[t] for t in extractor.targets]
+    results.append([Party(*p) for p in entry['parties'][extractor.party_spec]])
+    return results, bool(missing or parties_missing)
+
+
+def process_xml(xml_file, streaming=False, accepted=ACCEPTED_DESIGNATIONS, timings=None, cache=None,
+                backend=DEFAULT_BACKEND):
+    """
+    XMLファイル1件を解析してCSVの1行を作る関数（ワーカープロセスからも呼ばれる）
+
+    Args:
+        xml_file: XMLファイルのパス（Path）またはZIPの中のXML（ZipMember）
+        streaming (bool): True の場合は木全体を作らずに逐次読み込みで抽出する
+        accepted (tuple): 処理対象とする公報種別
+        timings (dict): 指定した場合は段階（designation, parse, extract, extract.<列の種類>, pdf,
+            cache.hit, cache.miss, cache.put）ごとの秒数を足す（metrics.run_document を参照）
+        cache (str): 指定した場合はこのディレクトリの解析結果のキャッシュ（parsecache.ParseCache）を使う。
+            内容が同じXMLは読み直さず、列定義に足りない取得対象だけを取り出す
+        backend (str): 解析の実装（fields.BACKENDS を参照。どの実装でも同じ行になる）
+
+    Returns:
+        tuple: (状態, XMLファイル, 詳細, 行, 当事者)
+            状態が "ok" の場合、詳細はCSV名、行はCSVの1行、当事者は fields.Party のリスト
+            状態が "skip" の場合、詳細は公報種別
+            状態が "error" の場合、詳細は quarantine.DocumentError（失敗した段階・列・例外。str() はエラーメッセージ）
+    """
+    stage = 'cache'
+    try:
+        entry = None
+        changed = False
+        if cache is not None:
+            cache = _get_cache(cache)
+            key = source_key(xml_file)
+            start = time.perf_counter()
+            entry = cache.get(key)
+            if timings is not None:
+                stage = 'cache.miss' if entry is None else 'cache.hit'
+                timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+            if entry is None:
+                entry = new_entry()
+
+        def remember():
+            # 値を足した場合だけキャッシュに書き込む
+            if changed:
+                with timed(timings, 'cache.put'):
+                    cache.put(key, entry)
+
+        # 先頭部分だけで公報種別を確認し、対象外の文書は解析しない
+        stage = 'designation'
+        if entry is not None and entry['designation'] is not None:
+            publication_status = entry['designation']
+        else:
+            with timed(timings, 'designation'), open_source(xml_file) as f:
+                publication_status = read_designation(f)
+            if entry is not None and publication_status is not None:
+                entry['designation'] = publication_status
+                changed = True
+        if publication_status is not None and publication_status not in accepted:
+            remember()
+            return ("skip", xml_file, publication_status, None, None)
+
+        stage = 'parse'
+        extractor = _get_extractor(backend)
+        if entry is None:
+            results = _scan(extractor, xml_file, streaming, timings)
+        else:
+            results, added = _scan_cached(extractor, entry, xml_file, streaming, timings, backend)
+            changed = changed or added
+
+        # 公報種別の取得
+        publication_status = extractor.designation(results)
+
+        # 公開特許公報(A)または公表特許公報(A)の場合のみ処理を続行
+        if publication_status not in accepted:
+            remember()
+            return ("skip", xml_file, publication_status, None, None)
+
+        # CSV名の決定
+        csv_name = extractor.application_number(results)
+        if not csv_name:
+            csv_name = xml_file.stem
+
+        # PDFページ数の取得（XMLと同じディレクトリを想定）
+        stage = 'pdf'
+        with timed(timings, 'pdf'):
+            signature = pdf_signature(xml_file) if entry is not None else None
+            if signature is not None and entry['pdf'] is not None and entry['pdf'][0] == signature:
+                page_count = entry['pdf'][1]
+            elif isinstance(xml_file, ZipMember):
+                page_count = zip_pdf_page_count(xml_file)
+            else:
                 pdf_directory = xml_file.parent
                 page_count = get_pdf_page_count(pdf_directory)
-                
-                with open(csv_path, 'a', encoding='utf-8', newline='') as csv_file:
-                    writer = csv.writer(csv_file)
-
-                    # データ抽出（すべて相対パスに修正）
-                    data = [
-                        "Z",  # 既存のデータベースと帳尻合わせをするため
-                        "Y",  # 既存のデータベースと帳尻合わせをするため
-                        "種別なし",  # 既存のデータベースと帳尻合わせをするため
-                        safe_get_text('.//pat:PublicationNumber'),
-                        safe_get_text('.//com:PublicationDate').replace("-", ""),
-                        safe_get_text('.//com:ApplicationNumber/com:ApplicationNumberText'),
-                        safe_get_text('.//jppat:ApplicationIdentification/pat:FilingDate').replace("-", ""),
-                        safe_get_text('.//pat:InventionTitle'),
-                        safe_get_text('.//jppat:IPCClassification/pat:MainClassification'),
-                        safe_get_text('.//jppat:ClaimTotalQuantitySet/pat:ClaimTotalQuantity'),
-                        
-                        # PDFページ数を追加
-                        page_count,
-                        
-                        # 以下、既存のコードを続ける
-                        #FI ここはappendでスペース入れないとスペース入れてくれない
-                        safe_get_text('.//jppat:UnexaminedPatentPublicationBibliographicData/jppat:NationalClassification', "      "),
-                        #テーマコード
-                        safe_get_text('.//jppat:ThemeCodeInformationBag/jppat:ThemeCodeInformation', ""),
-                        # Fターム（一部Fタームの記載の無い公開特許公報（A) があるのでエラーを吐き出す)
-                        safe_get_text('.//jppat:FtermInformationBag/jppat:FtermInformation', ""),
-                        
-                        # 出願人情報
-                        safe_get_text('.//jppat:Applicant[1]/com:PartyIdentifier'),                        
-                        safe_get_text('.//jppat:Applicant[1]/jpcom:Contact/com:Name/com:EntityName'),  
-                        safe_get_text('.//jppat:Applicant[1]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:Applicant[2]/com:PartyIdentifier'),                        
-                        safe_get_text('.//jppat:Applicant[2]/jpcom:Contact/com:Name/com:EntityName'),  
-                        safe_get_text('.//jppat:Applicant[2]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:Applicant[3]/com:PartyIdentifier'),                        
-                        safe_get_text('.//jppat:Applicant[3]/jpcom:Contact/com:Name/com:EntityName'),  
-                        safe_get_text('.//jppat:Applicant[3]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:Applicant[4]/com:PartyIdentifier'),                        
-                        safe_get_text('.//jppat:Applicant[4]/jpcom:Contact/com:Name/com:EntityName'),  
-                        safe_get_text('.//jppat:Applicant[4]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:Applicant[5]/com:PartyIdentifier'),                        
-                        safe_get_text('.//jppat:Applicant[5]/jpcom:Contact/com:Name/com:EntityName'),  
-                        safe_get_text('.//jppat:Applicant[5]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:Applicant[6]/com:PartyIdentifier'),                        
-                        safe_get_text('.//jppat:Applicant[6]/jpcom:Contact/com:Name/com:EntityName'),  
-                        safe_get_text('.//jppat:Applicant[6]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:Applicant[7]/com:PartyIdentifier'),                        
-                        safe_get_text('.//jppat:Applicant[7]/jpcom:Contact/com:Name/com:EntityName'),  
-                        safe_get_text('.//jppat:Applicant[7]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:Applicant[8]/com:PartyIdentifier'),                        
-                        safe_get_text('.//jppat:Applicant[8]/jpcom:Contact/com:Name/com:EntityName'),  
-                        safe_get_text('.//jppat:Applicant[8]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:Applicant[9]/com:PartyIdentifier'),                        
-                        safe_get_text('.//jppat:Applicant[9]/jpcom:Contact/com:Name/com:EntityName'),  
-                        safe_get_text('.//jppat:Applicant[9]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:Applicant[10]/com:PartyIdentifier'),                        
-                        safe_get_text('.//jppat:Applicant[10]/jpcom:Contact/com:Name/com:EntityName'),  
-                        safe_get_text('.//jppat:Applicant[10]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:Applicant[11]/com:PartyIdentifier'),                        
-                        safe_get_text('.//jppat:Applicant[11]/jpcom:Contact/com:Name/com:EntityName'),  
-                        safe_get_text('.//jppat:Applicant[11]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:Applicant[12]/com:PartyIdentifier'),                        
-                        safe_get_text('.//jppat:Applicant[12]/jpcom:Contact/com:Name/com:EntityName'),  
-                        safe_get_text('.//jppat:Applicant[12]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-
-                        # 代理人情報
-                        safe_get_text('.//jppat:RegisteredPractitioner[1]/pat:RegisteredPractitionerRegistrationNumber'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[1]/jpcom:Contact/com:Name/com:EntityName'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[2]/pat:RegisteredPractitionerRegistrationNumber'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[2]/jpcom:Contact/com:Name/com:EntityName'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[3]/pat:RegisteredPractitionerRegistrationNumber'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[3]/jpcom:Contact/com:Name/com:EntityName'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[4]/pat:RegisteredPractitionerRegistrationNumber'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[4]/jpcom:Contact/com:Name/com:EntityName'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[5]/pat:RegisteredPractitionerRegistrationNumber'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[5]/jpcom:Contact/com:Name/com:EntityName'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[6]/pat:RegisteredPractitionerRegistrationNumber'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[6]/jpcom:Contact/com:Name/com:EntityName'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[7]/pat:RegisteredPractitionerRegistrationNumber'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[7]/jpcom:Contact/com:Name/com:EntityName'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[8]/pat:RegisteredPractitionerRegistrationNumber'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[8]/jpcom:Contact/com:Name/com:EntityName'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[9]/pat:RegisteredPractitionerRegistrationNumber'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[9]/jpcom:Contact/com:Name/com:EntityName'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[10]/pat:RegisteredPractitionerRegistrationNumber'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[10]/jpcom:Contact/com:Name/com:EntityName'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[11]/pat:RegisteredPractitionerRegistrationNumber'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[11]/jpcom:Contact/com:Name/com:EntityName'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[12]/pat:RegisteredPractitionerRegistrationNumber'),
-                        safe_get_text('.//jppat:RegisteredPractitioner[12]/jpcom:Contact/com:Name/com:EntityName'),
-                        
-                        # 発明者情報
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[1]/jpcom:Contact/com:Name/com:EntityName'),                        
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[1]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[2]/jpcom:Contact/com:Name/com:EntityName'),                        
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[2]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[3]/jpcom:Contact/com:Name/com:EntityName'),                        
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[3]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[4]/jpcom:Contact/com:Name/com:EntityName'),                        
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[4]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[5]/jpcom:Contact/com:Name/com:EntityName'),                        
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[5]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[6]/jpcom:Contact/com:Name/com:EntityName'),                        
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[6]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[7]/jpcom:Contact/com:Name/com:EntityName'),                        
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[7]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[8]/jpcom:Contact/com:Name/com:EntityName'),                        
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[8]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[9]/jpcom:Contact/com:Name/com:EntityName'),                        
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[9]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[10]/jpcom:Contact/com:Name/com:EntityName'),                        
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[10]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[11]/jpcom:Contact/com:Name/com:EntityName'),                        
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[11]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[12]/jpcom:Contact/com:Name/com:EntityName'),                        
-                        safe_get_text('.//jppat:InventorBag/jppat:Inventor[12]/jpcom:Contact/com:PostalAddressBag/com:PostalAddress/com:PostalAddressText'),
-
-                        #要約【課題】＋【解決手段】＋【選択図】
-                        safe_get_text('.//pat:Abstract/com:P', "    "),
-                        # 請求項（すべて）
-                        safe_get_text('.//pat:Claims/pat:Claim/pat:ClaimText', "    "),
-                        # 技術分野（すべて）
-                        safe_get_text('.//jppat:Description/pat:TechnicalField/com:P', "    "),
-                        # 背景技術（すべて）
-                        safe_get_text('.//jppat:Description/pat:BackgroundArt/com:P', "    "),
-                        # 特許文献（すべて）
-                        safe_get_text('.//com:CitationBag/com:PatentCitationBag/com:P/com:PatentCitation/com:PatentCitationText', "    "),
-                        # 非特許文献（すべて）
-                        safe_get_text('.//com:CitationBag/com:NPLCitationBag/com:P/com:NPLCitation/com:NPLCitationText', "    "),
-                        # 発明が解決しようとする課題
-                        safe_get_text('.//pat:InventionSummary/pat:TechnicalProblem/com:P', "    "),
-                        # 発明を解決するための手段
-                        safe_get_text('.//pat:InventionSummary/pat:TechnicalSolution/com:P', "    "),
-                        # 発明の効果
-                        safe_get_text('.//pat:InventionSummary/pat:AdvantageousEffects/com:P', "    "),
-                        # 発明を実施するための形態
-                        safe_get_text('.//pat:EmbodimentDescription/com:P', "    "),
-                        # 産業利用上の可能性
-                        safe_get_text('.//pat:IndustrialApplicability/com:P', "    "),
-                        # 図面の簡単な説明
-                        safe_get_text('.//pat:DrawingDescription/com:P/com:FigureReference', "    ")
-                    ]
-
-                    writer.writerow(data)
-                    print(f"Successfully processed {xml_file}")
-            else:
-                print(f"Skipping {xml_file} - Publication status: {publication_status}")
+        if signature is not None and entry['pdf'] != (signature, page_count):
+            entry['pdf'] = (signature, page_count)
+            changed = True
+        remember()
+
+        # 列の並びは fields.FIELDS を参照
+        stage = 'row'
+        return ("ok", xml_file, csv_name, extractor.row(results, page_count), extractor.parties(results))
 
+    except Exception as e:
+        return ("error", xml_file, document_error(e, stage), None, None)
+
+
+def write_result(sink, result, replace=False, quarantine=None):
+    # CSVへの書き込みは親プロセスだけが行う（戻り値は最終的な状態）
+    # sink（sinks.py の書き出し先）が None の場合はCSVを書かずに結果の表示だけを行う
+    # replace が True の場合は同じ公開番号の行を置き換える（追記しない）
+    # quarantine（quarantine.Quarantine）を指定した場合はエラーの文書を隔離し、処理できた文書は隔離を解く
+    status, xml_file, detail, data, parties = result
+    print(f"Processing file: {xml_file}")
+    if status == "ok":
+        try:
+            if sink is not None:
+                if replace:
+                    sink.remove(detail, data[PUBLICATION_NUMBER_COLUMN])
+                sink.write(detail, data, parties)
+            print(f"Successfully processed {xml_file}")
         except Exception as e:
             print(f"Error processing {xml_file}: {str(e)}")
-            continue
+            if quarantine is not None:
+                quarantine.add_document(xml_file, document_error(e, 'write'))
+            return "error"
+    elif status == "skip":
+        print(f"Skipping {xml_file} - Publication status: {detail}")
+    else:
+        print(f"Error processing {xml_file}: {detail}")
+        if quarantine is not None:
+            quarantine.add_document(xml_file, detail)
+        return status
+    if quarantine is not None:
+        quarantine.resolve_document(xml_file)
+    return status
+
+
+def _init_worker():
+    # 呼び出し元（batch.py）の SIGTERM の処理を引き継がない（プールは SIGTERM でワーカーを止める）
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # 端末の Ctrl-C はプロセスグループ全体に届くため、ワーカーは無視して呼び出し元の止め方に任せる
+    # （処理中のワーカーが先に終了すると、プールはその文書の結果を待ち続ける）
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def iter_results(xml_path, workers=None, streaming=False, accepted=ACCEPTED_DESIGNATIONS, metrics=NULL_METRICS,
+                 cache=None, backend=DEFAULT_BACKEND, pool=None):
+    """
+    XMLファイルを解析し、process_xml の結果を入力順に返すジェネレーター
+
+    Args:
+        xml_path (list): XMLファイルのパスのリスト
+        workers (int): 解析に使うプロセス数（None の場合はCPU数、1 以下の場合は
+            プロセスを使わず逐次処理する。デバッグ時は 1 を指定する）
+        streaming (bool): True の場合は逐次読み込みで抽出する（非常に大きなXML向け）
+        accepted (tuple): 処理対象とする公報種別
+        metrics (metrics.Metrics): 指定した場合は1件ごとの段階の時間・大きさ・処理時間を集める
+        cache (str): 解析結果のキャッシュのディレクトリ（process_xml を参照）
+        backend (str): 解析の実装（fields.BACKENDS を参照）
+        pool (multiprocessing.Pool): 指定した場合は新しくプロセスを作らずにこのプールで解析し、終了時も閉じない
+            （常駐する処理でワーカーを使い回す場合。initializer には _init_worker を指定する）
+
+    Yields:
+        tuple: process_xml の戻り値
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    process = functools.partial(process_xml, streaming=streaming, accepted=tuple(accepted), cache=cache,
+                                backend=backend)
+    items = xml_path
+    if metrics.enabled:
+        # ワーカーで計測し、計測結果は親プロセスでまとめる
+        process = functools.partial(run_document, process=process, sampling=metrics.sampling)
+        items = list(enumerate(xml_path))
+
+    def collect(outcomes):
+        if not metrics.enabled:
+            yield from outcomes
+            return
+        for result, sample in outcomes:
+            metrics.add_document(sample)
+            yield result
+
+    if pool is None and (workers <= 1 or len(xml_path) <= 1):
+        # 逐次処理（後でプロセスをフォークしても引き継がないよう、キャッシュはここで閉じる）
+        try:
+            yield from collect(process(item) for item in items)
+        finally:
+            _close_caches()
+            close_archives()
+        return
+
+    # 解析はプロセスプールで並列に行い、結果は入力順に受け取る
+    chunksize = max(1, min(64, len(xml_path) // (workers * 4)))
+    if pool is not None:
+        yield from collect(pool.imap(process, items, chunksize))
+        return
+    with multiprocessing.Pool(workers, initializer=_init_worker) as pool:
+        yield from collect(pool.imap(process, items, chunksize))
+
+
+def xml_to_csv(ipt, opt, workers=None, streaming=False, accepted=ACCEPTED_DESIGNATIONS,
+               incremental=True, extract=False, sharded=False, parquet=False, text_index=False,
+               code_index=False, progress=None, cancel=None, metrics=None,
+               checkpoint=CHECKPOINT_DOCS, checkpoint_seconds=CHECKPOINT_SECONDS, cache=None, cache_bytes=CACHE_BYTES,
+               backend=DEFAULT_BACKEND, pool=None, quarantine=True, store=False):
+    """
+    ディレクトリまたはZIPファイル内のXMLファイルを解析してCSVに変換する関数
+
+    Args:
+        ipt (str): XMLファイルを探すディレクトリ（サブディレクトリも含む）、またはZIPファイル
+            （ZIPの中のXMLとPDFは展開せずに直接読む。入れ子のZIPも読む）
+        opt (str): CSVの出力先ディレクトリ
+        workers (int): 解析に使うプロセス数（iter_results を参照）
+        streaming (bool): True の場合は逐次読み込みで抽出する（非常に大きなXML向け）
+        accepted (tuple): 処理対象とする公報種別
+        incremental (bool): True の場合は出力先のマニフェスト（manifest.sqlite）を使い、
+            前回から変わっていないXMLを読み飛ばす。変わったXMLの行は追記ではなく置き換える
+            （False の場合は、出力先に前回の書き出しがあるときだけ同じ公開番号の行を置き換える）
+        extract (bool): True の場合は従来どおりZIPを opt/extracted に展開してから解析する
+        sharded (bool): True の場合は出願番号ごとのCSVではなく、まとめたCSV（shard-00000.csv, ...）と
+            索引（shards.index）に書き出す（sinks.ShardedSink を参照）
+        parquet (bool): True の場合はCSVではなく公開月ごとの Parquet ファイルに書き出す
+            （columnar.ParquetSink を参照。pyarrow が必要）
+        text_index (bool): True の場合は本文の項目の全文検索用の索引（textindex.sqlite）も作る
+            （textindex.TextIndex を参照）
+        code_index (bool): True の場合は分類・テーマコード・Fタームのコードの辞書と
+            コード -> 公報の索引（codes.sqlite）も作る（codes.CodeIndex を参照）
+        progress (callable): 指定した場合は開始時と1件処理するごとに
+            progress(処理済みの件数, 処理する件数, 状態ごとの件数) を呼ぶ（解析と同じスレッドから呼ばれる）
+        cancel (threading.Event): セットされると処理中の1件を書き終えた時点で止める
+            （残りのワーカーは終了する。書き終えた分はマニフェストに記録されるため、次回は続きから処理する）
+        metrics (metrics.Metrics): 指定した場合は段階ごとの時間と件数を集め、終了時に集計を表示する
+        checkpoint (int): incremental の場合に途中経過を保存する件数の間隔
+        checkpoint_seconds (float): incremental の場合に途中経過を保存する秒数の間隔
+            （保存では書き出し先の flush() の後にマニフェストを確定する。処理が強制終了されても、
+            次回は最後に保存した時点より後の文書から処理し直す）
+        cache (str): 指定した場合は解析結果のキャッシュ（parse_cache.sqlite）をこのディレクトリに置き、
+            内容が前に解析したXMLと同じ文書はXMLとPDFを読み直さない。列定義を変えた場合は
+            足りない列だけを取り出す（出力形式だけを変えて解析し直す場合や、incremental=False の場合に使う）
+        cache_bytes (int): キャッシュの大きさの上限（超えた分は最後に使ってから長いものから消す）
+        backend (str): 解析の実装。"etree"（既定。標準ライブラリ）または "lxml"（lxml が必要。
+            lxmlfields.LxmlExtractor を参照）。どちらでも同じ行になる
+        pool (multiprocessing.Pool): 指定した場合はこのプールのワーカーで解析する（iter_results を参照）。
+            cancel で止めた場合、プールに渡し終えた残りの文書は解析されるが結果は使わない
+        quarantine (bool): True の場合は処理できなかった文書を、XMLとPDFの写し・例外・失敗した段階と列と一緒に
+            出力先の quarantine/ に隔離する（quarantine.Quarantine を参照。redrive で隔離した文書だけを処理し直す）。
+            隔離していた文書を処理できた場合は隔離を解く
+        store (bool): True の場合は公開番号・出願番号・日付・IPCの主分類・出願人で引ける
+            公報の保存先（publications.sqlite）も作る（store.PublicationStore を参照）
+
+    Returns:
+        dict: 状態ごとの件数（"ok": 変換, "skip": 対象外, "error": エラー,
+            "unchanged": 前回から変更なし, "cancelled": 中止したため処理しなかった件数）
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+    # マニフェストを使わない場合は、出力先に前回の行があるときだけ同じ公開番号の行を置き換える
+    replace = not incremental and has_output(opt)
+    os.makedirs(opt, exist_ok=True)
+    if extract and is_zip(ipt):
+        from unzip import extract_zip
+        extracted = os.path.join(opt, "extracted")
+        with metrics.timer('extract_zip'):
+            # 一括ダウンロードのZIPは中にZIPを含むため、中のZIPも展開する
+            extract_zip(ipt, extracted, nested=True)
+        ipt = extracted
+    with metrics.timer('list_sources'):
+        xml_path = iter_sources(ipt)
+
+    counts = collections.Counter(ok=0, skip=0, error=0, unchanged=0, cancelled=0)
+    manifest = Manifest.in_directory(opt) if incremental else None
+    if manifest is not None:
+        with metrics.timer('manifest.check'):
+            todo = [f for f in xml_path if manifest.needs_processing(f)]
+        counts["unchanged"] = len(xml_path) - len(todo)
+        xml_path = todo
+
+    sink = _open_sink(opt, sharded, parquet, text_index, code_index, store)
+    quarantine = Quarantine.in_directory(opt) if quarantine else None
+    if cache is not None:
+        cache = os.path.abspath(cache)
+    # 解析の実装の名前が違う場合や lxml が無い場合は、ワーカーではなくここで止める
+    make_extractor([], backend=backend)
+    results = iter_results(xml_path, workers, streaming, accepted, metrics, cache, backend, pool)
+    done = 0
+    saved = time.monotonic()
+    if progress is not None:
+        progress(done, len(xml_path), dict(counts))
+    try:
+        for result in results:
+            done += 1
+            with metrics.timer('write'):
+                if manifest is None:
+                    counts[write_result(sink, result, replace=replace, quarantine=quarantine)] += 1
+                else:
+                    counts[_write_recorded(sink, manifest, result, quarantine)] += 1
+            if manifest is not None and (done % checkpoint == 0
+                                         or time.monotonic() - saved >= checkpoint_seconds):
+                with metrics.timer('checkpoint'):
+                    # 書き出し先を先に保存し、マニフェストが書き出し先より先に進まないようにする
+                    sink.flush()
+                    manifest.commit()
+                    _evict_cache(cache, cache_bytes)
+                saved = time.monotonic()
+            if progress is not None:
+                progress(done, len(xml_path), dict(counts))
+            if cancel is not None and cancel.is_set():
+                counts["cancelled"] = len(xml_path) - done
+                break
+    finally:
+        # 途中で止めた場合もワーカーを終了させる
+        results.close()
+        with metrics.timer('close'):
+            sink.close()
+            if manifest is not None:
+                manifest.close()
+            if quarantine is not None:
+                quarantine.close()
+            _evict_cache(cache, cache_bytes)
+            # 入力のアーカイブと入れ子のZIPの一時ファイルを閉じる（常駐する処理で開いたままにしない）
+            close_archives()
+
+    if metrics.enabled:
+        for status, n in counts.items():
+            metrics.count(f"documents.{status}", n)
+        metrics.finish()
+    print(f"Accepted: {counts['ok']}, Skipped: {counts['skip']}, Errors: {counts['error']}, "
+          f"Unchanged: {counts['unchanged']}"
+          + (f", Cancelled: {counts['cancelled']}" if counts['cancelled'] else ""))
+    if quarantine is not None and counts['error']:
+        print(f"Quarantined: {counts['error']} documents in {quarantine.directory}")
+    return dict(counts)
+
+
+def redrive(opt, workers=None, streaming=False, accepted=ACCEPTED_DESIGNATIONS, sharded=False, parquet=False,
+            text_index=False, code_index=False, metrics=None, backend=DEFAULT_BACKEND, store=False):
+    """
+    出力先の quarantine/ に隔離した文書だけを処理し直す関数
+
+    隔離したときの写し（写しが無い場合は元のファイル）を解析し、処理できた文書は行を置き換えて書き出して
+    隔離を解く。まだ処理できない文書は新しいエラーで記録し直す（試行回数が増える）。
+    書き出し先の形式（sharded, parquet, text_index, code_index, store）は隔離したときの xml_to_csv と同じにする。
+
+    Args:
+        opt (str): xml_to_csv の出力先
+        その他: xml_to_csv を参照
+
+    Returns:
+        dict: 状態ごとの件数（"ok", "skip", "error"）
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+    counts = collections.Counter(ok=0, skip=0, error=0)
+    quarantine = Quarantine.in_directory(opt)
+    xml_path = quarantine.documents()
+    print(f"Quarantined documents: {len(xml_path)}")
+    if not xml_path:
+        return dict(counts)
+    make_extractor([], backend=backend)
+    # 前回の行を置き換えるのは、マニフェストに前回の行の記録がある文書だけ（マニフェストが無い出力先ではすべて）
+    manifest = Manifest.in_directory(opt) if os.path.exists(os.path.join(opt, MANIFEST_NAME)) else None
+    sink = _open_sink(opt, sharded, parquet, text_index, code_index, store)
+    results = iter_results(xml_path, workers, streaming, accepted, metrics, backend=backend)
+    try:
+        for result in results:
+            replace = manifest is None or manifest.previous(quarantine.source(result[1])) is not None
+            with metrics.timer('write'):
+                counts[write_result(sink, result, replace=replace, quarantine=quarantine)] += 1
+    finally:
+        results.close()
+        sink.close()
+        quarantine.close()
+        if manifest is not None:
+            manifest.close()
+        close_archives()
+    if metrics.enabled:
+        for status, n in counts.items():
+            metrics.count(f"documents.{status}", n)
+        metrics.finish()
+    print(f"Redriven: {counts['ok']}, Skipped: {counts['skip']}, Still failing: {counts['error']}")
+    return dict(counts)
+
+
+def has_output(opt):
+    # 出力先に前回書き出したものがあるか（展開したZIPと隔離した文書は除く）
+    return os.path.isdir(opt) and any(name not in ("extracted", QUARANTINE_DIR) for name in os.listdir(opt))
+
+
+def _open_sink(opt, sharded, parquet, text_index, code_index, store=False):
+    # xml_to_csv の出力形式の書き出し先を開く
+    if parquet:
+        from columnar import ParquetSink
+        sink = ParquetSink(opt)
+    elif sharded:
+        sink = ShardedSink(opt)
+    else:
+        sink = PerApplicationSink(opt)
+    if text_index:
+        from textindex import TextIndex
+        sink = TeeSink(sink, TextIndex.in_directory(opt))
+    if code_index:
+        from codes import CodeIndex
+        sink = TeeSink(sink, CodeIndex.in_directory(opt))
+    if store:
+        from store import PublicationStore
+        sink = TeeSink(sink, PublicationStore.in_directory(opt))
+    return sink
+
+
+def _evict_cache(cache, cache_bytes):
+    # キャッシュが上限を超えていれば古いものから消す（ワーカーとは別の接続で短時間だけ開く）
+    if cache is None:
+        return
+    parse_cache = ParseCache.in_directory(cache, max_bytes=cache_bytes)
+    try:
+        evicted = parse_cache.evict()
+    finally:
+        parse_cache.close()
+    if evicted:
+        print(f"Parse cache: evicted {evicted} entries")
+
+
+def _write_recorded(sink, manifest, result, quarantine=None):
+    # 結果を書き出し、マニフェストに記録する（戻り値は最終的な状態）
+    status, xml_file, csv_name, data, _ = result
+    publication_number = data[PUBLICATION_NUMBER_COLUMN] if status == "ok" else None
+    previous = manifest.previous(xml_file)
+    if status != "error" and previous and previous != (csv_name, publication_number):
+        # 前回の行が別のCSVや別の公開番号にある場合は先に取り除く
+        sink.remove(previous[0], previous[1])
+    # 初めて処理する文書は前回の行が無いため、置き換えずに書き足す
+    status = write_result(sink, result, replace=previous is not None, quarantine=quarantine)
+    if status == "ok":
+        manifest.record(xml_file, status, csv_name, publication_number)
+    else:
+        manifest.record(xml_file, status)
+    return status
+
 
 if __name__ == "__main__":
-    ipt = sys.argv[1] if len(sys.argv) > 1 else R"" # Zip解凍後のファイル
-    opt = sys.argv[2] if len(sys.argv) > 2 else R"" # csv変換後のファイル
-    
+    # 複数の入力・プロセス数・出力形式を指定する場合は batch.py を使う（python batch.py parse -h）
+    if len(sys.argv) < 3:
+        sys.exit("使い方: python app/parse.py <XMLのディレクトリまたはZIPファイル> <CSVの出力先>")
+    ipt = sys.argv[1] # ZIPファイルまたはZip解凍後のファイル
+    opt = sys.argv[2] # csv変換後のファイル
+
     xml_to_csv(ipt, opt)
\ No newline at end of file
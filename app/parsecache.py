@@ -0,0 +1,120 @@
+import os
+import time
+import zlib
+import pickle
+import sqlite3
+from manifest import file_digest
+
+# 解析結果のキャッシュ（列の追加・変更の後に同じアーカイブを解析し直す場合に、XMLとPDFを読み直さない）
+# キーは入力の内容（ZIPの中のファイルは名前・サイズ・CRC、通常のファイルは SHA-1）と EXTRACTOR_VERSION。
+# 値は公報種別・取得対象（パスと連結文字列の組）ごとの値・当事者の記録・PDFのページ数を pickle して圧縮したもの。
+# 列定義を変えた場合も、取得対象が同じ値はそのまま使い、足りない取得対象だけを取り出し直す。
+# 大きさが max_bytes を超えたら、最後に使ってから長いものから消す。
+
+CACHE_NAME = 'parse_cache.sqlite'
+CACHE_BYTES = 2 * 2**30
+
+# 値の取り出し方（fields.py の照合や文字列の作り方）を変えた場合に上げる（すべての値を取り出し直す）
+EXTRACTOR_VERSION = 1
+
+# 最後に使った時刻をこの秒数より細かくは更新しない（読むたびに書き込まないため）
+TOUCH_SECONDS = 60
+
+# 消すときは max_bytes のこの割合まで減らす
+EVICT_TO = 0.9
+
+
+def source_key(source):
+    """
+    入力の内容を表すキーを返す関数
+
+    ZIPの中のファイルはアーカイブが持つ名前・サイズ・CRC を使い（読まずに済む）、
+    通常のファイルは内容の SHA-1 を使う。
+    """
+    if hasattr(source, 'crc'):
+        name = source.name.rsplit('/', 1)[-1]
+        content = f"{name}:{source.size}:{source.crc:08x}"
+    else:
+        content = f"sha1:{file_digest(source)}"
+    return f"v{EXTRACTOR_VERSION}:{content}"
+
+
+def new_entry():
+    # designation: 公報種別（read_designation の値。分からなかった場合は None）
+    # fields     : 取得対象 (パス, 連結文字列) -> 値
+    # parties    : 当事者の定義（FieldExtractor.party_spec） -> 当事者の記録（タプルのリスト）
+    # pdf        : (PDFの目印, ページ数)（PDFが差し替えられた場合は数え直す）
+    return {'designation': None, 'fields': {}, 'parties': {}, 'pdf': None}
+
+
+class ParseCache:
+    """
+    解析結果のキャッシュ（SQLite）
+
+    複数のワーカープロセスから同時に読み書きできる（WAL）。
+    キャッシュは失っても困らないため、書き込みのたびにディスクへの同期は待たない。
+    """
+
+    def __init__(self, path, max_bytes=CACHE_BYTES):
+        self.path = os.fspath(path)
+        self.max_bytes = max_bytes
+        self.db = sqlite3.connect(self.path, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=OFF")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, data BLOB, size INTEGER, used INTEGER)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+        self.db.commit()
+
+    @classmethod
+    def in_directory(cls, directory, **kwargs):
+        os.makedirs(directory, exist_ok=True)
+        return cls(os.path.join(directory, CACHE_NAME), **kwargs)
+
+    def get(self, key):
+        """
+        キーの値を返す関数（無い場合は None）
+        """
+        row = self.db.execute("SELECT data, used FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = int(time.time())
+        if now - row[1] >= TOUCH_SECONDS:
+            self.db.execute("UPDATE entries SET used = ? WHERE key = ?", (now, key))
+            self.db.commit()
+        return pickle.loads(zlib.decompress(row[0]))
+
+    def put(self, key, entry):
+        data = zlib.compress(pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        self.db.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, data, len(data), int(time.time())))
+        self.db.commit()
+
+    def size(self):
+        return self.db.execute("SELECT coalesce(sum(size), 0) FROM entries").fetchone()[0]
+
+    def evict(self):
+        """
+        大きさが max_bytes を超えている場合に、最後に使ってから長いものから消す関数
+
+        Returns:
+            int: 消した件数
+        """
+        size = self.size()
+        if size <= self.max_bytes:
+            return 0
+        excess = size - int(self.max_bytes * EVICT_TO)
+        keys = []
+        for key, size in self.db.execute("SELECT key, size FROM entries ORDER BY used, key"):
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self.db.executemany("DELETE FROM entries WHERE key = ?", keys)
+        self.db.commit()
+        return len(keys)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
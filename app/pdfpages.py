@@ -0,0 +1,324 @@
+import os
+import re
+import zlib
+import functools
+import PyPDF2
+
+# PDFの末尾（trailer）とページツリーのルートの /Count だけを読んでページ数を求める。
+# 読み取れない形式の場合は PyPDF2 で全体を解析する。
+
+_TAIL_SIZE = 4096
+_OBJ_READ = 4096
+_OBJ_READ_MAX = 1 << 22
+
+_STARTXREF = re.compile(rb'startxref\s+(\d+)')
+_ROOT = re.compile(rb'/Root\s+(\d+)\s+(\d+)\s+R')
+_PREV = re.compile(rb'/Prev\s+(\d+)')
+_PAGES = re.compile(rb'/Pages\s+(\d+)\s+(\d+)\s+R')
+_COUNT = re.compile(rb'/Count\s+(\d+)(?!\d)(?!\s+\d+\s+R)')
+_OBJ_HEADER = re.compile(rb'\s*(\d+)\s+(\d+)\s+obj')
+_SUBSECTION = re.compile(rb'(\d+)\s+(\d+)\s*[\r\n]+')
+_ENTRY = re.compile(rb'(\d{10}) (\d{5}) ([nf])')
+_LENGTH = re.compile(rb'/Length\s+(\d+)(?!\d)(?!\s+\d+\s+R)')
+_W = re.compile(rb'/W\s*\[\s*(\d+)\s+(\d+)\s+(\d+)\s*\]')
+_INDEX = re.compile(rb'/Index\s*\[([\d\s]+)\]')
+_SIZE = re.compile(rb'/Size\s+(\d+)')
+_PREDICTOR = re.compile(rb'/Predictor\s+(\d+)')
+_COLUMNS = re.compile(rb'/Columns\s+(\d+)')
+_FIRST = re.compile(rb'/First\s+(\d+)')
+_N = re.compile(rb'/N\s+(\d+)')
+
+
+class UnsupportedPDF(Exception):
+    """軽量な読み取りでは扱えないPDF（PyPDF2 で読み直す）"""
+
+
+def _read_at(f, offset, size):
+    f.seek(offset)
+    return f.read(size)
+
+
+def _stream_data(f, offset, head):
+    # 辞書の後ろにある stream ... endstream の中身を取り出す
+    start = head.find(b'stream')
+    if start < 0:
+        raise UnsupportedPDF("stream not found")
+    start += len(b'stream')
+    if head[start:start + 2] == b'\r\n':
+        start += 2
+    elif head[start:start + 1] in (b'\n', b'\r'):
+        start += 1
+    dictionary = head[:start]
+    m = _LENGTH.search(dictionary)
+    if m:
+        data = _read_at(f, offset + start, int(m.group(1)))
+    else:
+        # /Length が間接参照の場合は endstream まで読む
+        rest = _read_at(f, offset + start, 1 << 24)
+        end = rest.find(b'endstream')
+        if end < 0:
+            raise UnsupportedPDF("endstream not found")
+        data = rest[:end]
+    if b'/Filter' in dictionary:
+        if b'/FlateDecode' not in dictionary:
+            raise UnsupportedPDF("unsupported filter")
+        data = zlib.decompress(data)
+    return dictionary, data
+
+
+def _unpredict(dictionary, data):
+    # PNG予測子（xrefストリームでよく使われる）を元に戻す
+    m = _PREDICTOR.search(dictionary)
+    predictor = int(m.group(1)) if m else 1
+    if predictor == 1:
+        return data
+    if predictor < 10:
+        raise UnsupportedPDF("unsupported predictor")
+    m = _COLUMNS.search(dictionary)
+    columns = int(m.group(1)) if m else 1
+    rows = []
+    prev = bytearray(columns)
+    for i in range(0, len(data), columns + 1):
+        kind = data[i]
+        row = bytearray(data[i + 1:i + 1 + columns])
+        if kind == 0:
+            pass
+        elif kind == 2:
+            for j in range(len(row)):
+                row[j] = (row[j] + prev[j]) & 0xFF
+        elif kind == 1:
+            for j in range(1, len(row)):
+                row[j] = (row[j] + row[j - 1]) & 0xFF
+        else:
+            raise UnsupportedPDF("unsupported PNG filter")
+        rows.append(bytes(row))
+        prev = row
+    return b''.join(rows)
+
+
+def _read_xref_section(f, offset, xref):
+    """
+    offset にある相互参照表（またはxrefストリーム）を読み、未登録の番号だけ xref に追加する
+
+    Returns:
+        bytes: trailer 辞書（xrefストリームの場合はストリームの辞書）
+    """
+    head = _read_at(f, offset, _OBJ_READ)
+    if head.startswith(b'xref'):
+        pos = 4
+        buf = head
+        while True:
+            while pos < len(buf) and buf[pos:pos + 1] in b' \t\r\n':
+                pos += 1
+            if buf.startswith(b'trailer', pos):
+                break
+            m = _SUBSECTION.match(buf, pos)
+            if m is None:
+                raise UnsupportedPDF("broken xref table")
+            first, count = int(m.group(1)), int(m.group(2))
+            pos = m.end()
+            need = pos + count * 20 + 64
+            if need > len(buf):
+                buf = _read_at(f, offset, need + _OBJ_READ)
+            for i in range(count):
+                e = _ENTRY.match(buf, pos)
+                if e is None:
+                    raise UnsupportedPDF("broken xref entry")
+                if e.group(3) == b'n':
+                    xref.setdefault(first + i, (1, int(e.group(1)), 0))
+                pos = e.end()
+                while pos < len(buf) and buf[pos:pos + 1] in b' \r\n':
+                    pos += 1
+        trailer = _read_at(f, offset + pos, _OBJ_READ)
+        end = trailer.find(b'startxref')
+        return trailer[:end] if end > 0 else trailer
+
+    m = _OBJ_HEADER.match(head)
+    if m is None:
+        raise UnsupportedPDF("xref not found")
+    dictionary, data = _stream_data(f, offset, head)
+    if b'/XRef' not in dictionary:
+        raise UnsupportedPDF("xref not found")
+    w = _W.search(dictionary)
+    if w is None:
+        raise UnsupportedPDF("xref stream without /W")
+    widths = [int(x) for x in w.groups()]
+    m = _INDEX.search(dictionary)
+    if m:
+        numbers = [int(x) for x in m.group(1).split()]
+    else:
+        numbers = [0, int(_SIZE.search(dictionary).group(1))]
+    data = _unpredict(dictionary, data)
+    pos = 0
+    for first, count in zip(numbers[0::2], numbers[1::2]):
+        for num in range(first, first + count):
+            fields = []
+            for width in widths:
+                fields.append(int.from_bytes(data[pos:pos + width], 'big'))
+                pos += width
+            kind = fields[0] if widths[0] else 1
+            if kind in (1, 2):
+                xref.setdefault(num, (kind, fields[1], fields[2]))
+            elif kind == 0:
+                xref.setdefault(num, None)
+    return dictionary
+
+
+def _object_body(f, xref, num):
+    # 間接オブジェクト num の中身（辞書部分）を返す
+    entry = xref.get(num)
+    if entry is None:
+        raise UnsupportedPDF(f"object {num} not in xref")
+    kind, a, b = entry
+    if kind == 1:
+        head = _read_at(f, a, _OBJ_READ)
+        m = _OBJ_HEADER.match(head)
+        if m is None or int(m.group(1)) != num:
+            raise UnsupportedPDF(f"object {num} not at offset")
+        # /Kids が長いページツリーなどは endobj が見つかるまで読み足す
+        size = _OBJ_READ
+        while b'endobj' not in head and len(head) == size and size < _OBJ_READ_MAX:
+            size *= 4
+            head = _read_at(f, a, size)
+        body = head[m.end():]
+        end = body.find(b'endobj')
+        return body if end < 0 else body[:end]
+
+    # オブジェクトストリームの中にある場合
+    stream = xref.get(a)
+    if stream is None or stream[0] != 1:
+        raise UnsupportedPDF(f"object stream {a} not found")
+    head = _read_at(f, stream[1], _OBJ_READ)
+    dictionary, data = _stream_data(f, stream[1], head)
+    first = int(_FIRST.search(dictionary).group(1))
+    n = int(_N.search(dictionary).group(1))
+    pairs = [int(x) for x in data[:first].split()[:n * 2]]
+    offsets = dict(zip(pairs[0::2], pairs[1::2]))
+    if num not in offsets:
+        raise UnsupportedPDF(f"object {num} not in object stream {a}")
+    start = first + offsets[num]
+    later = [first + o for o in offsets.values() if first + o > start]
+    return data[start:min(later) if later else len(data)]
+
+
+def fast_page_count(path):
+    """
+    trailer とページツリーのルートの /Count だけを読んでページ数を返す関数
+
+    Args:
+        path: PDFファイルのパス、または任意の位置から読めるバイナリのファイルオブジェクト
+
+    Returns:
+        int: ページ数
+
+    Raises:
+        UnsupportedPDF: この方法では読み取れない場合
+    """
+    if hasattr(path, 'read'):
+        return _fast_page_count(path)
+    with open(path, 'rb') as f:
+        return _fast_page_count(f)
+
+
+def _fast_page_count(f):
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    tail = _read_at(f, max(0, size - _TAIL_SIZE), _TAIL_SIZE)
+    m = None
+    for m in _STARTXREF.finditer(tail):
+        pass
+    if m is None:
+        raise UnsupportedPDF("startxref not found")
+
+    # 増分更新がある場合は /Prev をたどる（新しい方が優先）
+    xref = {}
+    root = None
+    offset = int(m.group(1))
+    seen = set()
+    while offset is not None and offset not in seen:
+        seen.add(offset)
+        trailer = _read_xref_section(f, offset, xref)
+        if root is None:
+            r = _ROOT.search(trailer)
+            root = int(r.group(1)) if r else None
+        p = _PREV.search(trailer)
+        offset = int(p.group(1)) if p else None
+    if root is None:
+        raise UnsupportedPDF("/Root not found")
+
+    catalog = _object_body(f, xref, root)
+    m = _PAGES.search(catalog)
+    if m is None:
+        raise UnsupportedPDF("/Pages not found")
+    pages = _object_body(f, xref, int(m.group(1)))
+    m = _COUNT.search(pages)
+    if m is None:
+        raise UnsupportedPDF("/Count not found")
+    return int(m.group(1))
+
+
+def _pypdf2_page_count(path):
+    if hasattr(path, 'read'):
+        path.seek(0)
+        return len(PyPDF2.PdfReader(path).pages)
+    with open(path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return len(pdf_reader.pages)
+
+
+def stream_page_count(f):
+    """
+    ファイルオブジェクトのPDFのページ数を返す関数（キャッシュはしない）
+
+    Args:
+        f: 任意の位置から読めるバイナリのファイルオブジェクト
+
+    Returns:
+        int: ページ数
+    """
+    try:
+        return fast_page_count(f)
+    except Exception:
+        return _pypdf2_page_count(f)
+
+
+@functools.lru_cache(maxsize=4096)
+def _cached_page_count(path, size, mtime_ns):
+    try:
+        return fast_page_count(path)
+    except Exception:
+        # 壊れている・特殊な形式のPDFは PyPDF2 で読む
+        return _pypdf2_page_count(path)
+
+
+def page_count(path):
+    """
+    PDFのページ数を返す関数（パス・サイズ・更新日時が同じなら前回の結果を使う）
+
+    Args:
+        path (str): PDFファイルのパス
+
+    Returns:
+        int: ページ数
+    """
+    st = os.stat(path)
+    return _cached_page_count(os.fspath(path), st.st_size, st.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=4096)
+def _cached_listing(directory, mtime_ns):
+    return tuple(f for f in os.listdir(directory) if f.lower().endswith('.pdf'))
+
+
+def list_pdfs(directory):
+    """
+    ディレクトリ内のPDFファイル名を返す関数（ディレクトリが変わらない限り1回だけ読む）
+
+    Args:
+        directory (str): ディレクトリのパス
+
+    Returns:
+        tuple: PDFファイル名
+    """
+    directory = os.fspath(directory)
+    return _cached_listing(directory, os.stat(directory).st_mtime_ns)
@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import threading
+import traceback
+from collections import namedtuple
+from pathlib import Path
+
+from sources import copy_document
+
+# 処理できなかった文書と、データベースに投入できなかった行の隔離場所（出力先の quarantine/）
+# 文書は XML と同じフォルダーのPDFの写しを documents/<番号>/ に置き、例外と失敗した段階・列を記録する。
+# 行は CSVの1行と当事者の記録を JSON で記録する。
+# 隔離した文書と行は本処理を止めずに記録だけして先に進み、後で redrive（python batch.py redrive）で処理し直す。
+# 何も隔離しなかった場合はディレクトリを作らない。
+
+QUARANTINE_DIR = 'quarantine'
+QUARANTINE_NAME = 'quarantine.sqlite'
+DOCUMENTS_DIR = 'documents'
+
+
+class DocumentError(namedtuple('DocumentError', 'stage field error message traceback')):
+    """
+    文書を処理できなかった理由（process_xml の戻り値の詳細。ワーカーから受け渡せるよう文字列だけを持つ）
+
+    stage は失敗した段階（designation, parse, pdf, row, write など）、field は失敗した列名（分からない場合は None）、
+    error は例外の型名。str() は従来のエラーメッセージと同じ。
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return self.message
+
+
+def document_error(e, stage):
+    # except 節の中で呼ぶ（トレースバックを文字列にして持つ）
+    return DocumentError(stage, getattr(e, 'field', None), type(e).__name__, str(e), traceback.format_exc())
+
+
+class Quarantine:
+    """
+    隔離した文書と行の記録（SQLite）
+
+    同じ文書（入力の場所が同じもの）や同じ公開番号の行をもう一度隔離した場合は、
+    エラーを新しいものに置き換えて試行回数（attempts）を増やす。公開番号が空の行は公開番号を NULL として記録し、
+    内容がまったく同じ行だけを同じ行として扱う（公開番号が空の別々の行を上書きしない）。
+    行の記録は parallel_load の複数のスレッドから呼ばれるため、書き込みはロックで順に行う。
+    """
+
+    def __init__(self, directory):
+        self.directory = os.fspath(directory)
+        self.path = os.path.join(self.directory, QUARANTINE_NAME)
+        self.lock = threading.Lock()
+        self._db = None
+        # 隔離中の文書の入力の場所（初めて使うときに読み込む）と、写し -> 元の入力の場所
+        self._sources = None
+        self._copies = {}
+
+    @classmethod
+    def in_directory(cls, directory):
+        return cls(os.path.join(directory, QUARANTINE_DIR))
+
+    @property
+    def db(self):
+        if self._db is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                " id INTEGER PRIMARY KEY, source TEXT UNIQUE, copy TEXT, stage TEXT, field TEXT,"
+                " error TEXT, message TEXT, traceback TEXT, attempts INTEGER, first_seen REAL, last_seen REAL)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS rows ("
+                " id INTEGER PRIMARY KEY, publication_number TEXT UNIQUE, row TEXT, parties TEXT,"
+                " table_name TEXT, field TEXT, error TEXT, message TEXT, attempts INTEGER,"
+                " first_seen REAL, last_seen REAL)")
+            self._db.commit()
+        return self._db
+
+    def exists(self):
+        return self._db is not None or os.path.exists(self.path)
+
+    def close(self):
+        if self._db is not None:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def _source_key(self, source):
+        # redrive で処理し直した写しは元の入力の場所として記録する
+        key = str(source)
+        return self._copies.get(key, key)
+
+    def source(self, path):
+        # documents() で返した写しの元の入力の場所（写しでなければ path の文字列）
+        return self._source_key(path)
+
+    def add_document(self, source, error):
+        """
+        文書を隔離する関数
+
+        Args:
+            source: XMLの場所（Path または sources.ZipMember）
+            error: DocumentError（文字列の場合はメッセージだけを記録する）
+        """
+        if not isinstance(error, DocumentError):
+            error = DocumentError(None, None, None, str(error), None)
+        key = self._source_key(source)
+        now = time.time()
+        with self.lock:
+            db = self.db
+            row = db.execute("SELECT id FROM documents WHERE source = ?", (key,)).fetchone()
+            if row is not None:
+                db.execute(
+                    "UPDATE documents SET stage = ?, field = ?, error = ?, message = ?, traceback = ?,"
+                    " attempts = attempts + 1, last_seen = ? WHERE id = ?", tuple(error) + (now, row[0]))
+            else:
+                cur = db.execute(
+                    "INSERT INTO documents (source, stage, field, error, message, traceback, attempts,"
+                    " first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?)", (key,) + tuple(error) + (now, now))
+                copy = self._copy(source, cur.lastrowid)
+                if copy is not None:
+                    db.execute("UPDATE documents SET copy = ? WHERE id = ?", (copy, cur.lastrowid))
+            db.commit()
+            if self._sources is not None:
+                self._sources.add(key)
+
+    def _copy(self, source, document_id):
+        # XMLを読めない場合などは写しを作らない（redrive では元の入力を読む）
+        destination = os.path.join(self.directory, DOCUMENTS_DIR, str(document_id))
+        try:
+            return os.path.relpath(copy_document(source, destination), self.directory)
+        except Exception as e:
+            print(f"Could not copy {source} to the quarantine: {e}")
+            shutil.rmtree(destination, ignore_errors=True)
+            return None
+
+    def resolve_document(self, source):
+        """
+        処理できた文書が隔離されていれば記録と写しを消す関数
+
+        隔離中の文書の一覧は最初に1回だけ読むため、隔離していない文書では SQLite を読まない。
+        """
+        key = self._source_key(source)
+        with self.lock:
+            if self._sources is None:
+                self._sources = set() if not self.exists() else {
+                    r[0] for r in self.db.execute("SELECT source FROM documents")}
+            if key not in self._sources:
+                return
+            row = self.db.execute("SELECT id, copy FROM documents WHERE source = ?", (key,)).fetchone()
+            self.db.execute("DELETE FROM documents WHERE source = ?", (key,))
+            self.db.commit()
+            self._sources.discard(key)
+        if row is not None and row[1] is not None:
+            shutil.rmtree(os.path.join(self.directory, DOCUMENTS_DIR, str(row[0])), ignore_errors=True)
+
+    def documents(self):
+        """
+        隔離中の文書を処理し直すための入力のリストを返す関数
+
+        写しがある文書は写しの Path、無い文書は元の入力が通常のファイルとして残っている場合だけその Path を返す
+        （ZIPの中の文書で写しが無いものは処理し直せないため含めない）。
+        返した写しを add_document / resolve_document に渡すと、元の入力の記録として扱う。
+
+        Returns:
+            list: Path のリスト
+        """
+        if not self.exists():
+            return []
+        paths = []
+        for source, copy in self.db.execute("SELECT source, copy FROM documents ORDER BY id").fetchall():
+            if copy is not None:
+                path = Path(self.directory) / copy
+                self._copies[str(path)] = source
+                paths.append(path)
+            elif os.path.isfile(source):
+                paths.append(Path(source))
+            else:
+                print(f"Cannot redrive {source}: no copy in the quarantine")
+        return paths
+
+    def add_row(self, row, parties, error, table=None, field=None):
+        """
+        データベースに投入できなかった行を隔離する関数
+
+        Args:
+            row (list): CSVの1行
+            parties (list): fields.Party のリスト（CSVから投入する場合は None）
+            error (Exception): 投入時の例外
+            table (str): 失敗したテーブル（分かる場合）
+            field (str): 失敗した列（分かる場合）
+        """
+        now = time.time()
+        publication_number = str(row[3]) if len(row) > 3 and row[3] else None
+        values = (json.dumps(list(row), ensure_ascii=False),
+                  None if parties is None else json.dumps([list(p) for p in parties], ensure_ascii=False),
+                  table, field, type(error).__name__, str(error).strip())
+        if publication_number is not None:
+            where, key = "publication_number = ?", publication_number
+        else:
+            where, key = "publication_number IS NULL AND row = ?", values[0]
+        with self.lock:
+            db = self.db
+            updated = db.execute(
+                "UPDATE rows SET row = ?, parties = ?, table_name = ?, field = ?, error = ?, message = ?,"
+                f" attempts = attempts + 1, last_seen = ? WHERE {where}",
+                values + (now, key)).rowcount
+            if not updated:
+                db.execute(
+                    "INSERT INTO rows (publication_number, row, parties, table_name, field, error, message,"
+                    " attempts, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?, ?)",
+                    (publication_number,) + values + (now, now))
+            db.commit()
+
+    def rows(self):
+        """
+        隔離中の行を返す関数
+
+        Returns:
+            list: (番号, CSVの1行, 当事者の記録（list または None）) のリスト
+        """
+        if not self.exists():
+            return []
+        return [(row_id, json.loads(row), None if parties is None else json.loads(parties))
+                for row_id, row, parties in self.db.execute("SELECT id, row, parties FROM rows ORDER BY id")]
+
+    def resolve_row(self, row_id):
+        with self.lock:
+            self.db.execute("DELETE FROM rows WHERE id = ?", (row_id,))
+            self.db.commit()
+
+    def counts(self):
+        # (隔離中の文書の数, 隔離中の行の数)
+        if not self.exists():
+            return 0, 0
+        return tuple(self.db.execute(f"SELECT count(*) FROM {t}").fetchone()[0] for t in ('documents', 'rows'))
@@ -0,0 +1,322 @@
+import os
+import io
+import csv
+import shutil
+import bisect
+import itertools
+from fields import COLUMNS
+
+# 変換した行の書き出し先。
+# PerApplicationSink: 従来どおり出願番号ごとのCSV（<出願番号>.csv）に1行ずつ追記する
+# ShardedSink: 大きなCSV（shard-00000.csv, ...）にまとめて書き、出願番号 -> ファイルと位置の索引を作る
+# 書き出し先は write/remove/flush/close を持つ。flush() は途中経過の保存（チェックポイント）で、
+# それまでに書いた行を、処理が途中で止まっても読める状態でディスクに残す。
+
+# 公開番号の列（CSVの行を置き換えるときのキー）
+PUBLICATION_NUMBER_COLUMN = COLUMNS.index('publication_number')
+
+SHARD_INDEX_NAME = 'shards.index'
+SHARD_ROWS = 50000
+SHARD_BYTES = 256 * 2**20
+SHARD_BUFFER = 4 * 2**20
+_COPY_CHUNK = 1 << 20
+
+
+def remove_rows(csv_path, publication_number):
+    """
+    CSVファイルから指定した公開番号の行を取り除く関数
+
+    Args:
+        csv_path (Path): CSVファイルのパス
+        publication_number (str): 取り除く行の公開番号
+    """
+    if not os.path.exists(csv_path):
+        return
+    with open(csv_path, encoding='utf-8', newline='') as csv_file:
+        content = csv_file.read()
+    if publication_number not in content:
+        return
+    rows = [row for row in csv.reader(content.splitlines(keepends=True))
+            if row[PUBLICATION_NUMBER_COLUMN] != publication_number]
+    if not rows:
+        os.remove(csv_path)
+        return
+    with open(csv_path, 'w', encoding='utf-8', newline='') as csv_file:
+        csv.writer(csv_file).writerows(rows)
+
+
+class PerApplicationSink:
+    """
+    出願番号ごとのCSVファイルに1行ずつ追記する書き出し先（従来の出力）
+    """
+
+    def __init__(self, directory):
+        self.directory = os.fspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, csv_name):
+        return os.path.join(self.directory, f"{csv_name}.csv")
+
+    def write(self, csv_name, row, parties=None):
+        # CSVには12件分の列だけを書く（parties は使わない）
+        with open(self.path(csv_name), 'a', encoding='utf-8', newline='') as csv_file:
+            csv.writer(csv_file).writerow(row)
+
+    def remove(self, csv_name, publication_number):
+        remove_rows(self.path(csv_name), publication_number)
+
+    def flush(self):
+        # 1行ごとにファイルを閉じているため何もしない
+        pass
+
+    def close(self):
+        pass
+
+
+class TeeSink:
+    """
+    同じ行を複数の書き出し先に渡す書き出し先（CSVと全文検索の索引を同時に作る場合など）
+    """
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def write(self, csv_name, row, parties=None):
+        for sink in self.sinks:
+            sink.write(csv_name, row, parties)
+
+    def remove(self, csv_name, publication_number):
+        for sink in self.sinks:
+            sink.remove(csv_name, publication_number)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+def read_shard_index(directory):
+    """
+    ShardedSink の索引を読む関数
+
+    Returns:
+        list: (出願番号, 公開番号, ファイル名, 位置, バイト数) のリスト
+    """
+    path = os.path.join(directory, SHARD_INDEX_NAME)
+    if not os.path.exists(path):
+        return []
+    entries = []
+    with open(path, encoding='utf-8', newline='') as f:
+        # 追記の途中で強制終了した場合、最後の書きかけの行は読まない
+        lines = (line for line in f if line.endswith('\n'))
+        for app, pub, name, offset, length in csv.reader(lines, delimiter='\t'):
+            entries.append((app, pub, name, int(offset), int(length)))
+    return entries
+
+
+def read_shard_row(directory, entry):
+    # 索引の1件から元の行を読み出す
+    _, _, name, offset, length = entry
+    with open(os.path.join(directory, name), 'rb') as f:
+        f.seek(offset)
+        data = f.read(length).decode('utf-8')
+    return next(csv.reader(io.StringIO(data, newline='')))
+
+
+class ShardedSink:
+    """
+    行を大きなCSVファイルにまとめて書く書き出し先
+
+    ファイルは行数 max_rows またはサイズ max_bytes を超えると次の番号に切り替える。
+    各行の出願番号・公開番号・ファイル名・バイト位置・バイト数は索引（shards.index）に記録する。
+    索引には flush()・close() ごとにその間に書いた行を書き足す。
+    行の書式は PerApplicationSink と同じため、CSVとしてそのまま読み込める。
+    置き換えで取り除いた行は flush()・close() でまとめてファイルから消す（このときだけ索引を書き直す）。
+    """
+
+    def __init__(self, directory, max_rows=SHARD_ROWS, max_bytes=SHARD_BYTES, buffer_size=SHARD_BUFFER):
+        self.directory = os.fspath(directory)
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.buffer_size = buffer_size
+        os.makedirs(self.directory, exist_ok=True)
+
+        # (出願番号, 公開番号) -> [[ファイル名, 位置, バイト数], ...]
+        self._entries = {}
+        self._rows = {}
+        ends = {}
+        self._trim_index()
+        for app, pub, name, offset, length in read_shard_index(self.directory):
+            self._entries.setdefault((app, pub), []).append([name, offset, length])
+            self._rows[name] = self._rows.get(name, 0) + 1
+            ends[name] = max(ends.get(name, 0), offset + length)
+        self._recover(ends)
+        self._removed = {}
+        self._added = []  # 索引にまだ書いていない (出願番号, 公開番号, [ファイル名, 位置, バイト数])
+        self._number = 0
+        self._file = None
+        self._name = None
+        self._size = 0
+
+        # 前回の最後のファイルに空きがあればそこへ追記する
+        if self._rows:
+            last = max(self._rows)
+            self._number = int(last[len('shard-'):-len('.csv')])
+            path = os.path.join(self.directory, last)
+            if os.path.exists(path) and self._has_room(last, os.path.getsize(path)):
+                self._open(last)
+            else:
+                self._number += 1
+
+    def _trim_index(self):
+        # 索引の追記の途中で強制終了した場合、最後の書きかけの行を切り捨てる
+        path = os.path.join(self.directory, SHARD_INDEX_NAME)
+        if not os.path.exists(path):
+            return
+        with open(path, 'r+b') as f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(size - _COPY_CHUNK, 0))
+            tail = f.read()
+            if tail and not tail.endswith(b'\n'):
+                f.truncate(size - len(tail) + tail.rfind(b'\n') + 1)
+
+    def _recover(self, ends):
+        # 前回が途中で強制終了した場合、索引に無い行（最後の flush() より後に書いた行）を切り捨てる
+        for name in os.listdir(self.directory):
+            if not (name.startswith('shard-') and name.endswith('.csv')):
+                continue
+            path = os.path.join(self.directory, name)
+            end = ends.get(name, 0)
+            if not end:
+                os.remove(path)
+            elif os.path.getsize(path) > end:
+                with open(path, 'r+b') as f:
+                    f.truncate(end)
+
+    def _has_room(self, name, size):
+        return self._rows.get(name, 0) < self.max_rows and size < self.max_bytes
+
+    def _open(self, name):
+        path = os.path.join(self.directory, name)
+        self._file = open(path, 'ab', buffering=self.buffer_size)
+        self._name = name
+        self._size = self._file.tell()
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+            self._number += 1
+        self._open(f"shard-{self._number:05d}.csv")
+
+    def write(self, csv_name, row, parties=None):
+        buf = io.StringIO()
+        csv.writer(buf).writerow(row)
+        data = buf.getvalue().encode('utf-8')
+        if self._file is None or not self._has_room(self._name, self._size):
+            self._rotate()
+        key = (csv_name, row[PUBLICATION_NUMBER_COLUMN])
+        entry = [self._name, self._size, len(data)]
+        self._entries.setdefault(key, []).append(entry)
+        self._added.append((key, entry))
+        self._file.write(data)
+        self._size += len(data)
+        self._rows[self._name] = self._rows.get(self._name, 0) + 1
+
+    def remove(self, csv_name, publication_number):
+        for name, offset, length in self._entries.pop((csv_name, publication_number), ()):
+            self._removed.setdefault(name, []).append((offset, length))
+            self._rows[name] -= 1
+
+    def _compact(self, name, removed):
+        # 取り除いた行のバイト範囲を飛ばしてファイルを書き直し、後ろの行の位置をずらす
+        path = os.path.join(self.directory, name)
+        removed.sort()
+        if self._rows.get(name, 0) <= 0:
+            os.remove(path)
+            return
+        tmp = path + '.tmp'
+        with open(path, 'rb') as src, open(tmp, 'wb') as dst:
+            pos = 0
+            for offset, length in removed:
+                src.seek(pos)
+                _copy(src, dst, offset - pos)
+                pos = offset + length
+            src.seek(pos)
+            shutil.copyfileobj(src, dst, _COPY_CHUNK)
+        os.replace(tmp, path)
+
+        # entry より前にある取り除いた行のバイト数だけ位置を前に詰める
+        starts = [offset for offset, _ in removed]
+        shifts = list(itertools.accumulate(length for _, length in removed))
+        for entries in self._entries.values():
+            for entry in entries:
+                if entry[0] == name:
+                    i = bisect.bisect_left(starts, entry[1])
+                    if i:
+                        entry[1] -= shifts[i - 1]
+
+    def flush(self):
+        # 書いた行をファイルに書き出して索引に書き足す（取り除いた行がある場合は、ファイルを閉じて
+        # 取り除いた行を消し、索引を書き直してから同じファイルに追記する）
+        if not self._removed:
+            if self._file is not None:
+                self._file.flush()
+            self._append_index()
+            return
+        name = self._name
+        self._close_file()
+        if name is None:
+            return
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path) and self._has_room(name, os.path.getsize(path)):
+            self._open(name)
+        else:
+            self._number += 1
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._name = None
+        if not self._removed:
+            self._append_index()
+            return
+        for name, removed in self._removed.items():
+            self._compact(name, removed)
+        self._removed = {}
+        self._added = []
+
+        tmp = os.path.join(self.directory, SHARD_INDEX_NAME + '.tmp')
+        with open(tmp, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f, delimiter='\t')
+            for (app, pub), entries in self._entries.items():
+                for name, offset, length in entries:
+                    writer.writerow((app, pub, name, offset, length))
+        os.replace(tmp, os.path.join(self.directory, SHARD_INDEX_NAME))
+
+    def _append_index(self):
+        # 前回の flush() の後に書いた行の索引を1回の書き込みで書き足す
+        if not self._added:
+            return
+        buf = io.StringIO()
+        writer = csv.writer(buf, delimiter='\t')
+        for (app, pub), (name, offset, length) in self._added:
+            writer.writerow((app, pub, name, offset, length))
+        with open(os.path.join(self.directory, SHARD_INDEX_NAME), 'a', encoding='utf-8', newline='') as f:
+            f.write(buf.getvalue())
+        self._added = []
+
+    def close(self):
+        self._close_file()
+
+
+def _copy(src, dst, size):
+    while size > 0:
+        chunk = src.read(min(size, _COPY_CHUNK))
+        if not chunk:
+            break
+        dst.write(chunk)
+        size -= len(chunk)
@@ -0,0 +1,263 @@
+import io
+import os
+import zipfile
+import functools
+import shutil
+import tempfile
+import posixpath
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+
+from pdfpages import list_pdfs, stream_page_count
+
+# 解析対象のXMLの場所（通常のファイルまたはZIPアーカイブの中のファイル）を扱う。
+# ZIPの中のファイルはディスクに展開せず、アーカイブから直接読む。
+# 入れ子のZIPは一時ファイルに書き出して開く（メモリに持たない）。
+# 開いたアーカイブはプロセスごとに覚えておき、別の外側のアーカイブを読み始めたら閉じる
+# （常駐するワーカーが前のアーカイブを開いたままにしない）。
+
+# プロセスごとに開いたままにしておくアーカイブの数の上限
+ARCHIVE_HANDLES = 8
+_SPOOL_CHUNK = 1 << 20
+
+
+class ZipMember(namedtuple('ZipMember', 'archives name size crc')):
+    """
+    ZIPアーカイブの中のファイル
+
+    archives はアーカイブのパスと、入れ子のZIPの場合はその中のZIPの名前を外側から順に並べたタプル。
+    プロセス間で受け渡せるよう、開いたファイルは持たない。
+    """
+    __slots__ = ()
+
+    @property
+    def stem(self):
+        return posixpath.splitext(posixpath.basename(self.name))[0]
+
+    @property
+    def directory(self):
+        return posixpath.dirname(self.name)
+
+    def signature(self):
+        # マニフェストで使う (キー, サイズ, 更新の目印)
+        return (str(self), self.size, self.crc)
+
+    def digest(self):
+        return f"crc32:{self.crc:08x}"
+
+    def __str__(self):
+        return "!/".join((os.fspath(self.archives[0]),) + tuple(self.archives[1:]) + (self.name,))
+
+
+def is_zip(path):
+    return os.path.isfile(path) and str(path).lower().endswith('.zip')
+
+
+def _zip_members(zf, archives):
+    for info in zf.infolist():
+        if info.is_dir():
+            continue
+        lower = info.filename.lower()
+        if lower.endswith('.xml'):
+            yield ZipMember(archives, info.filename, info.file_size, info.CRC)
+        elif lower.endswith('.zip'):
+            with _spool(zf, info.filename) as tmp, zipfile.ZipFile(tmp) as inner:
+                yield from _zip_members(inner, archives + (info.filename,))
+
+
+def _spool(zf, name):
+    # 入れ子のZIPを一時ファイルに書き出す（閉じると消える）
+    tmp = tempfile.TemporaryFile()
+    try:
+        with zf.open(name) as src:
+            shutil.copyfileobj(src, tmp, _SPOOL_CHUNK)
+        tmp.seek(0)
+    except BaseException:
+        tmp.close()
+        raise
+    return tmp
+
+
+def iter_sources(ipt):
+    """
+    入力に含まれるXMLを列挙する関数
+
+    Args:
+        ipt (str): XMLを探すディレクトリ、またはZIPファイル（入れ子のZIPも読む）
+
+    Returns:
+        list: Path または ZipMember のリスト
+    """
+    if is_zip(ipt):
+        with zipfile.ZipFile(ipt) as zf:
+            return list(_zip_members(zf, (os.path.abspath(ipt),)))
+    return list(Path(ipt).glob('**/*.xml'))
+
+
+# このプロセスで開いているアーカイブ（archives -> (ZipFile, 入れ子のZIPの一時ファイル または None)）
+_archives = OrderedDict()
+# _archives を開いたプロセスと外側のアーカイブ（pid, パス, サイズ, 更新日時）
+_archive_owner = None
+# アーカイブ -> フォルダーごとのPDFの一覧
+_pdf_indexes = {}
+
+
+def _open_archive(archives):
+    """
+    アーカイブを開く関数（開いたものは ARCHIVE_HANDLES 個まで使い回す）
+
+    別の外側のアーカイブを開く場合、外側のアーカイブが書き換えられた場合、fork した別のプロセスの場合は
+    それまでに開いたものをすべて閉じてから開き直す（ファイル位置を他のプロセスと共有しない）。
+    """
+    global _archive_owner
+    st = os.stat(archives[0])
+    owner = (os.getpid(), archives[0], st.st_size, st.st_mtime_ns)
+    if owner != _archive_owner:
+        close_archives()
+        _archive_owner = owner
+    entry = _archives.get(archives)
+    if entry is not None:
+        _archives.move_to_end(archives)
+        return entry[0]
+    if len(archives) == 1:
+        entry = (zipfile.ZipFile(archives[0]), None)
+    else:
+        tmp = _spool(_open_archive(archives[:-1]), archives[-1])
+        entry = (zipfile.ZipFile(tmp), tmp)
+    _archives[archives] = entry
+    while len(_archives) > ARCHIVE_HANDLES:
+        _close_entry(_archives.popitem(last=False)[1])
+    return entry[0]
+
+
+def _close_entry(entry):
+    zf, tmp = entry
+    zf.close()
+    if tmp is not None:
+        tmp.close()
+
+
+def close_archives():
+    """
+    このプロセスで開いているアーカイブと一時ファイルをすべて閉じる関数（アーカイブを処理し終えたときに呼ぶ）
+    """
+    global _archive_owner
+    # fork する前に開いたものは、このプロセスの分のファイル記述子だけが閉じる（親のプロセスには影響しない）
+    while _archives:
+        _close_entry(_archives.popitem()[1])
+    _pdf_indexes.clear()
+    _archive_owner = None
+
+
+def open_source(src):
+    """
+    XMLをバイナリのファイルオブジェクトとして開く関数
+
+    Args:
+        src: Path または ZipMember
+
+    Returns:
+        バイナリのファイルオブジェクト
+    """
+    if isinstance(src, ZipMember):
+        return _open_archive(src.archives).open(src.name)
+    return open(src, 'rb')
+
+
+def _zip_pdf_index(archives):
+    # アーカイブ内のフォルダー -> PDFの一覧（開いたアーカイブごとに1回だけ作る）
+    archive = _open_archive(archives)
+    index = _pdf_indexes.get(archives)
+    if index is None:
+        index = _pdf_indexes[archives] = {}
+        for info in archive.infolist():
+            if info.filename.lower().endswith('.pdf'):
+                index.setdefault(posixpath.dirname(info.filename), []).append(info)
+    return index
+
+
+@functools.lru_cache(maxsize=4096)
+def _zip_page_count(archives, name, size, crc):
+    # 圧縮されたメンバーは任意の位置から読めないため、メモリに展開してから数える
+    # （ページ数だけを覚える。キーにCRCを含むため、PDFが差し替えられた場合は数え直す）
+    data = _open_archive(archives).read(name)
+    return stream_page_count(io.BytesIO(data))
+
+
+def zip_pdf_signature(src):
+    """
+    ZIPの中で、XMLと同じフォルダーにある単一のPDFの (名前, サイズ, CRC) を返す関数
+
+    PDFを読まずに差し替えを見分けるために使う（PDFが1つでない場合は None）。
+    """
+    files = _zip_pdf_index(src.archives).get(src.directory, [])
+    if len(files) != 1:
+        return None
+    info = files[0]
+    return (info.filename, info.file_size, info.CRC)
+
+
+def pdf_signature(src):
+    """
+    XMLと同じディレクトリにある単一のPDFの目印を返す関数（PDFを読まずに差し替えを見分ける）
+
+    Returns:
+        tuple: ZIPの中は (名前, サイズ, CRC)、ディレクトリでは (名前, サイズ, 更新日時)
+            （PDFが1つでない場合は None）
+    """
+    if isinstance(src, ZipMember):
+        return zip_pdf_signature(src)
+    files = list_pdfs(src.parent)
+    if len(files) != 1:
+        return None
+    st = os.stat(os.path.join(src.parent, files[0]))
+    return (files[0], st.st_size, st.st_mtime_ns)
+
+
+def zip_pdf_page_count(src):
+    """
+    ZIPの中で、XMLと同じフォルダーにある単一のPDFのページ数を取得する関数
+
+    Args:
+        src (ZipMember): XMLの場所
+
+    Returns:
+        int: PDFのページ数 (PDFが見つからない場合は0)
+    """
+    files = _zip_pdf_index(src.archives).get(src.directory, [])
+
+    if len(files) != 1:
+        print(f"エラー: ディレクトリ {src.directory} には1つのPDFファイルが必要です。現在のファイル数: {len(files)}")
+        return 0
+
+    info = files[0]
+    try:
+        return _zip_page_count(src.archives, info.filename, info.file_size, info.CRC)
+    except Exception as e:
+        print(f"PDFファイルの読み取り中にエラーが発生しました: {e}")
+        return 0
+
+
+def copy_document(src, destination):
+    """
+    XMLと、同じフォルダーにあるPDFを destination にコピーする関数（quarantine で写しを残すために使う）
+
+    Args:
+        src: Path または ZipMember
+        destination (str): コピー先のディレクトリ
+
+    Returns:
+        str: コピーしたXMLのパス
+    """
+    os.makedirs(destination, exist_ok=True)
+    if isinstance(src, ZipMember):
+        archive = _open_archive(src.archives)
+        pdfs = _zip_pdf_index(src.archives).get(src.directory, [])
+        for name in [src.name] + [info.filename for info in pdfs]:
+            with archive.open(name) as f, open(os.path.join(destination, posixpath.basename(name)), 'wb') as out:
+                shutil.copyfileobj(f, out)
+        return os.path.join(destination, posixpath.basename(src.name))
+    src = Path(src)
+    for path in [src] + [p for p in src.parent.iterdir() if p.suffix.lower() == '.pdf']:
+        shutil.copyfile(path, os.path.join(destination, path.name))
+    return os.path.join(destination, src.name)
@@ -0,0 +1,292 @@
+import os
+import sys
+import json
+import time
+import zlib
+import datetime
+import sqlite3
+from collections import namedtuple
+from fields import COLUMNS, Party, parties_from_row
+from codes import SCHEMES
+
+# 変換した公報を手元で引くための索引付きの保存先（SQLite。PostgreSQL に投入しなくても使える）
+# 行（110列）と当事者の記録は公報ごとに1つの圧縮したJSONとして持ち、
+# 公開番号・出願番号・公開日・出願日・IPCの主分類・出願人の識別番号で引けるように索引を作る。
+# 読み出しは SQLite の mmap で行い、公開番号で1件を引く場合は B-tree を1回たどって1つの値を展開するだけで済む。
+
+STORE_NAME = 'publications.sqlite'
+
+# この文書数ごとに保存する
+COMMIT_DOCS = 1000
+# 読み出しで mmap する大きさの上限（ファイルがこれより大きい場合は超えた分を通常の読み込みで読む）
+MMAP_BYTES = 8 * 2**30
+# get_many で1回の SQL に入れる公開番号の数
+BATCH_KEYS = 500
+
+_PUBLICATION_NUMBER = COLUMNS.index('publication_number')
+_APPLICATION_NUMBER = COLUMNS.index('application_number')
+_PUBLICATION_DATE = COLUMNS.index('publication_date')
+_FILING_DATE = COLUMNS.index('filing_date')
+_IPC = COLUMNS.index('ipc')
+
+# 範囲で引ける列
+DATE_COLUMNS = ('publication_date', 'filing_date')
+
+# 1件の公報（row: CSVの1行（COLUMNS の順）、parties: fields.Party のリスト）
+Record = namedtuple('Record', 'row parties')
+
+
+def main_ipc(text):
+    # IPCの主分類の列の値を 'H01L21/00' の形にする（codes.py の IPC と同じ形。値が無い場合は None）
+    codes = SCHEMES['ipc'](text or "")
+    return codes[0] if codes else None
+
+
+def _date(value):
+    # 'YYYYMMDD' の文字列（CSVの日付と同じ形）にする
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.strftime('%Y%m%d')
+    return str(value).replace('-', '')
+
+
+def _encode(row, parties):
+    parties = [list(p) for p in parties] if parties is not None else None
+    return zlib.compress(json.dumps([list(row), parties], ensure_ascii=False).encode('utf-8'), 1)
+
+
+def _decode(blob):
+    row, parties = json.loads(zlib.decompress(blob))
+    return Record(row, None if parties is None else [Party(*p) for p in parties])
+
+
+class PublicationStore:
+    """
+    公報の保存先と読み出しの関数
+
+    add() で公報を追加し（同じ公開番号が既にあれば置き換える）、discard() で取り除く。
+    公開番号で引く保存先のため、公開番号が空の行は追加しない（CSV などの書き出し先にはすべて残る）。
+    sinks.py の書き出し先と同じ write/remove/flush/close を持つため、解析しながら作れる
+    （xml_to_csv の store=True）。WAL を使うため、解析中でも別のプロセス・接続から読める
+    （読めるのは最後に flush() した時点までの公報）。
+
+    読み出しの関数は Record（行と当事者の記録）を返す。行の値は CSV に書いたものと同じ（全ページ数などは数値のまま）。
+    当事者の記録は解析したときの Party で、CSV から追加した場合などで無いときは行の12件分の列から作る。
+    """
+
+    def __init__(self, path, readonly=False, commit_docs=COMMIT_DOCS, mmap_bytes=MMAP_BYTES):
+        self.path = os.fspath(path)
+        self.commit_docs = commit_docs
+        self.readonly = readonly
+        if readonly:
+            self.db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS publications ("
+                " publication_number TEXT PRIMARY KEY, application_number TEXT, publication_date TEXT,"
+                " filing_date TEXT, ipc TEXT, data BLOB)")
+            for column in ('application_number', 'publication_date', 'filing_date', 'ipc'):
+                self.db.execute(
+                    f"CREATE INDEX IF NOT EXISTS publications_{column} ON publications ({column}, publication_number)")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS applicants ("
+                " identifier TEXT, publication_number TEXT,"
+                " PRIMARY KEY (identifier, publication_number)) WITHOUT ROWID")
+            self.db.commit()
+        self.db.execute(f"PRAGMA mmap_size={int(mmap_bytes)}")
+        self._pending = 0
+
+    @classmethod
+    def in_directory(cls, directory, readonly=False, **kwargs):
+        if not readonly:
+            os.makedirs(directory, exist_ok=True)
+        return cls(os.path.join(directory, STORE_NAME), readonly=readonly, **kwargs)
+
+    def add(self, row, parties=None):
+        """
+        公報を追加する関数
+
+        Args:
+            row (list): CSVの1行
+            parties (list): fields.Party のリスト（None の場合は行の12件分の列から作る）
+
+        Returns:
+            bool: 追加した場合は True（公開番号が空の行は追加せずに False）
+        """
+        publication_number = row[_PUBLICATION_NUMBER]
+        if not publication_number:
+            return False
+        self.discard(publication_number)
+        if parties is None:
+            parties = parties_from_row(row)
+        self.db.execute(
+            "INSERT INTO publications VALUES (?, ?, ?, ?, ?, ?)",
+            (publication_number, row[_APPLICATION_NUMBER], row[_PUBLICATION_DATE], row[_FILING_DATE],
+             main_ipc(row[_IPC]), _encode(row, parties)))
+        identifiers = {p.identifier for p in parties if p.role == 'applicant' and p.identifier}
+        self.db.executemany(
+            "INSERT INTO applicants VALUES (?, ?)",
+            ((identifier, publication_number) for identifier in identifiers))
+        self._pending += 1
+        if self._pending >= self.commit_docs:
+            self.commit()
+        return True
+
+    def discard(self, publication_number):
+        # 出願人の索引は記録してある当事者から消す（新しい公報の場合は主キーを1回引くだけで済む）
+        record = self.get(publication_number)
+        if record is None:
+            return
+        self.db.executemany(
+            "DELETE FROM applicants WHERE identifier = ? AND publication_number = ?",
+            ((p.identifier, publication_number) for p in record.parties if p.role == 'applicant' and p.identifier))
+        self.db.execute("DELETE FROM publications WHERE publication_number = ?", (publication_number,))
+
+    def commit(self):
+        self.db.commit()
+        self._pending = 0
+
+    def get(self, publication_number):
+        """
+        公開番号で1件を引く関数
+
+        Returns:
+            Record: 公報（無い場合は None）
+        """
+        row = self.db.execute(
+            "SELECT data FROM publications WHERE publication_number = ?", (publication_number,)).fetchone()
+        return None if row is None else _decode(row[0])
+
+    def get_many(self, publication_numbers):
+        """
+        複数の公開番号をまとめて引く関数（BATCH_KEYS 件ずつ1回の SQL で読む）
+
+        Returns:
+            list: 渡した順の Record のリスト（無い公開番号は None）
+        """
+        publication_numbers = list(publication_numbers)
+        found = {}
+        for i in range(0, len(publication_numbers), BATCH_KEYS):
+            keys = publication_numbers[i:i + BATCH_KEYS]
+            found.update(self.db.execute(
+                f"SELECT publication_number, data FROM publications"
+                f" WHERE publication_number IN ({','.join('?' * len(keys))})", keys))
+        return [_decode(found[n]) if n in found else None for n in publication_numbers]
+
+    def by_application(self, application_number):
+        """
+        出願番号の公報を返す関数（同じ出願の公開・公表などは公開番号の順）
+        """
+        return self._records(
+            "SELECT data FROM publications WHERE application_number = ? ORDER BY publication_number",
+            (application_number,))
+
+    def by_ipc(self, code, prefix=False):
+        """
+        IPCの主分類で公報を返す関数
+
+        Args:
+            code (str): 'H01L21/00' の形の分類（codes.py の IPC と同じ形）
+            prefix (bool): True の場合は code で始まる分類をすべて対象にする（例: 'H01L'）
+
+        Returns:
+            iterator: 分類・公開番号の順の Record
+        """
+        if prefix:
+            return self._records(
+                "SELECT data FROM publications WHERE ipc >= ? AND ipc < ? ORDER BY ipc, publication_number",
+                (code, code + '\U0010ffff'))
+        return self._records(
+            "SELECT data FROM publications WHERE ipc = ? ORDER BY publication_number", (code,))
+
+    def by_applicant(self, identifier):
+        """
+        出願人の識別番号で公報を返す関数（公開番号の順）
+        """
+        return self._records(
+            "SELECT p.data FROM applicants a JOIN publications p ON p.publication_number = a.publication_number"
+            " WHERE a.identifier = ? ORDER BY a.publication_number", (identifier,))
+
+    def between(self, column, start=None, end=None, limit=None, numbers=False):
+        """
+        公開日または出願日の範囲で公報を返す関数
+
+        Args:
+            column (str): 'publication_date' または 'filing_date'
+            start, end: 範囲の始まりと終わり（両端を含む。'YYYYMMDD' の文字列または datetime.date。
+                None の場合はその側を限らない）
+            limit (int): 返す件数の上限
+            numbers (bool): True の場合は Record ではなく公開番号を返す（索引だけを読む）
+
+        Returns:
+            iterator: 日付・公開番号の順の Record（または公開番号）
+        """
+        if column not in DATE_COLUMNS:
+            raise ValueError(f"Unknown date column: {column}")
+        conditions, params = [], []
+        if start is not None:
+            conditions.append(f"{column} >= ?")
+            params.append(_date(start))
+        if end is not None:
+            conditions.append(f"{column} <= ?")
+            params.append(_date(end))
+        sql = (f"SELECT {'publication_number' if numbers else 'data'} FROM publications"
+               + (" WHERE " + " AND ".join(conditions) if conditions else "")
+               + f" ORDER BY {column}, publication_number")
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        if numbers:
+            return (r[0] for r in self.db.execute(sql, params))
+        return self._records(sql, params)
+
+    def _records(self, sql, params):
+        # 結果を1件ずつ展開して返す（大きな範囲でも全件をメモリに持たない）
+        return (_decode(r[0]) for r in self.db.execute(sql, params))
+
+    def __len__(self):
+        return self.db.execute("SELECT count(*) FROM publications").fetchone()[0]
+
+    # sinks.py の書き出し先と同じ使い方
+    def write(self, csv_name, row, parties=None):
+        self.add(row, parties)
+
+    def remove(self, csv_name, publication_number):
+        self.discard(publication_number)
+
+    def flush(self):
+        self.commit()
+
+    def close(self):
+        if not self.readonly:
+            self.commit()
+        self.db.close()
+
+
+# コマンドで引く項目 -> 関数
+LOOKUPS = {
+    'publication': lambda store, value: [r for r in [store.get(value)] if r is not None],
+    'application': PublicationStore.by_application,
+    'ipc': lambda store, value: store.by_ipc(value.rstrip('*'), prefix=value.endswith('*')),
+    'applicant': PublicationStore.by_applicant,
+}
+
+
+if __name__ == "__main__":
+    # 使い方: python app/store.py <出力先ディレクトリ> <項目> <値> [範囲の終わり]
+    #   項目: publication, application, ipc（末尾が * なら前方一致）, applicant, publication_date, filing_date
+    store = PublicationStore.in_directory(sys.argv[1], readonly=True)
+    key, value = sys.argv[2], sys.argv[3]
+    start = time.perf_counter()
+    if key in DATE_COLUMNS:
+        found = list(store.between(key, value, sys.argv[4] if len(sys.argv) > 4 else value))
+    else:
+        found = list(LOOKUPS[key](store, value))
+    elapsed = time.perf_counter() - start
+    for record in found:
+        row = record.row
+        print(row[_PUBLICATION_NUMBER], row[_PUBLICATION_DATE], row[_APPLICATION_NUMBER], row[_FILING_DATE],
+              row[_IPC], row[COLUMNS.index('invention_title')])
+    print(f"{len(found)} 件 ({elapsed * 1000:.1f} ms)")
+    store.close()
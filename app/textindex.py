@@ -0,0 +1,401 @@
+import os
+import sys
+import time
+import zlib
+import heapq
+import bisect
+import operator
+import itertools
+import sqlite3
+import unicodedata
+from array import array
+from fields import COLUMNS
+
+# 本文の各項目に対する全文検索用の転置索引（外部の検索サービスは使わない）
+# 文字の2-gram（隣り合う2文字）ごとに、項目別に「文書番号と出現位置」の一覧を持つ。
+# 索引は追記のたびに新しいセグメントとして SQLite に保存する。同じ段のセグメントが MERGE_SEGMENTS 個に
+# なるたびに1つにまとめて1つ上の段にし（取り除いた文書の索引はこのときに消す）、optimize() ではすべてを1つにまとめる。
+
+INDEX_NAME = 'textindex.sqlite'
+
+# 索引を作る項目（CSVの列名）
+SECTIONS = (
+    'invention_title', 'abstract', 'claims', 'technical_field', 'background_art', 'patent_citation', 'npl_citation',
+    'technical_problem', 'technical_solution', 'advantageous_effects', 'embodiment',
+    'industrial_applicability', 'drawing_description',
+)
+_SECTION_COLUMNS = [COLUMNS.index(name) for name in SECTIONS]
+_PUBLICATION_NUMBER = COLUMNS.index('publication_number')
+
+# この文書数ごとにセグメントを書き出す
+FLUSH_DOCS = 500
+# 同じ段のセグメントがこの数になったら1つにまとめる
+MERGE_SEGMENTS = 10
+# 文章の末尾の1文字も検索できるように付ける終端文字
+_END = '\x00'
+
+
+def normalize(text):
+    # 全角・半角と大文字・小文字の違いをなくす
+    return unicodedata.normalize('NFKC', text).lower()
+
+
+def bigrams(text):
+    """
+    文字列を (2-gram, 位置) に分解する関数（空白だけの2-gramは除く）
+    """
+    text = normalize(text) + _END
+    for i in range(len(text) - 1):
+        gram = text[i:i + 2]
+        if not gram.isspace():
+            yield gram, i
+
+
+def _encode(postings):
+    # {文書番号: 位置の配列} -> 圧縮したバイト列
+    docs = array('I', sorted(postings))
+    offsets = array('I')
+    positions = array('I')
+    for doc in docs:
+        offsets.append(len(positions))
+        positions.extend(postings[doc])
+    offsets.append(len(positions))
+    return _pack(docs, offsets, positions)
+
+
+def _pack(docs, offsets, positions):
+    # [文書数, 文書番号..., 位置の開始..., 位置の終わり, 位置...] の uint32 配列を圧縮する
+    header = array('I', [len(docs)])
+    return zlib.compress(header.tobytes() + docs.tobytes() + offsets.tobytes() + positions.tobytes(), 1)
+
+
+def _decode(blob):
+    # _encode の逆（文書番号の配列、位置の開始の配列、位置の配列）
+    values = array('I')
+    values.frombytes(zlib.decompress(blob))
+    n = values[0]
+    return values[1:n + 1], values[n + 1:2 * n + 2], values[2 * n + 2:]
+
+
+def _merge_postings(blobs, dead):
+    """
+    セグメントの順に並べた圧縮済みの一覧を1つにまとめる関数（dead の文書は落とす）
+
+    Returns:
+        tuple: (文書数, 圧縮したバイト列)
+    """
+    docs, offsets, positions = array('I'), array('I'), array('I')
+    for blob in blobs:
+        seg_docs, seg_offsets, seg_positions = _decode(blob)
+        if dead.isdisjoint(seg_docs):
+            # 取り除いた文書が無ければ位置の開始をずらしてそのまま繋げる
+            base = len(positions) - seg_offsets[0]
+            docs.extend(seg_docs)
+            offsets.extend(o + base for o in seg_offsets[:-1])
+            positions.extend(seg_positions)
+            continue
+        for i, doc in enumerate(seg_docs):
+            if doc not in dead:
+                docs.append(doc)
+                offsets.append(len(positions))
+                positions.extend(seg_positions[seg_offsets[i]:seg_offsets[i + 1]])
+    offsets.append(len(positions))
+    return len(docs), _pack(docs, offsets, positions)
+
+
+def _positions(segments, firsts, doc):
+    # セグメントの中から文書 doc の位置の配列を探す
+    # （文書番号はセグメントの中でもセグメントの間でも昇順に並んでいる。firsts は各セグメントの先頭の文書番号）
+    k = bisect.bisect_right(firsts, doc) - 1
+    if k < 0:
+        return ()
+    docs, offsets, positions = segments[k]
+    i = bisect.bisect_left(docs, doc)
+    if i < len(docs) and docs[i] == doc:
+        return positions[offsets[i]:offsets[i + 1]]
+    return ()
+
+
+def _contains(positions, value):
+    i = bisect.bisect_left(positions, value)
+    return i < len(positions) and positions[i] == value
+
+
+class TextIndex:
+    """
+    本文の項目ごとの 2-gram 転置索引
+
+    add() で文書を追加し（同じ公開番号が既にあれば置き換える）、discard() で取り除く。
+    セグメントは段ごとに管理し、同じ段が merge_segments 個になると flush() の中でまとめる
+    （まとめる量は段が上がるごとに merge_segments 倍になるため、書き直す回数は文書数の対数で済む）。
+    search() は文字列をそのまま含む文書の公開番号と、含んでいた項目を返す。
+    sinks.py の書き出し先と同じ write/remove/close を持つため、解析しながら索引を作れる。
+    """
+
+    def __init__(self, path, flush_docs=FLUSH_DOCS, merge_segments=MERGE_SEGMENTS):
+        self.path = os.fspath(path)
+        self.flush_docs = flush_docs
+        self.merge_segments = max(2, merge_segments)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " doc_id INTEGER PRIMARY KEY AUTOINCREMENT, publication_number TEXT, live INTEGER)")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS docs_publication_number ON docs (publication_number, live)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            " gram TEXT, section INTEGER, segment INTEGER, doc_count INTEGER, data BLOB,"
+            " PRIMARY KEY (gram, section, segment)) WITHOUT ROWID")
+        # まとめるときにセグメントを1つずつ 2-gram の順に読むための索引
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS postings_segment ON postings (segment, gram, section)")
+        # セグメント -> 段（段はセグメント番号の順に広義単調減少になる）
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS segments (segment INTEGER PRIMARY KEY, level INTEGER)")
+        if self.db.execute("SELECT 1 FROM segments LIMIT 1").fetchone() is None:
+            # 段を記録していない索引はすべてのセグメントを一番下の段にする
+            self.db.execute("INSERT INTO segments SELECT DISTINCT segment, 0 FROM postings")
+        self.db.commit()
+        row = self.db.execute("SELECT max(segment) FROM segments").fetchone()
+        self._segment = (row[0] or 0) + 1
+        # (2-gram, 項目番号) -> {文書番号: 位置の配列}
+        self._buffer = {}
+        self._buffered_docs = 0
+
+    @classmethod
+    def in_directory(cls, directory, **kwargs):
+        os.makedirs(directory, exist_ok=True)
+        return cls(os.path.join(directory, INDEX_NAME), **kwargs)
+
+    def add(self, publication_number, sections):
+        """
+        文書を索引に追加する関数
+
+        Args:
+            publication_number (str): 公開番号
+            sections (dict): 項目名 -> 本文
+        """
+        self.discard(publication_number)
+        doc = self.db.execute(
+            "INSERT INTO docs (publication_number, live) VALUES (?, 1)", (publication_number,)).lastrowid
+        buffer = self._buffer
+        for section, name in enumerate(SECTIONS):
+            text = sections.get(name)
+            if not text:
+                continue
+            for gram, pos in bigrams(text):
+                key = (gram, section)
+                postings = buffer.get(key)
+                if postings is None:
+                    postings = buffer[key] = {}
+                positions = postings.get(doc)
+                if positions is None:
+                    positions = postings[doc] = array('I')
+                positions.append(pos)
+        self._buffered_docs += 1
+        if self._buffered_docs >= self.flush_docs:
+            self.flush()
+
+    def discard(self, publication_number):
+        # 取り除いた文書の索引は検索時に読み飛ばし、そのセグメントをまとめるときに消す
+        self.db.execute(
+            "UPDATE docs SET live = 0 WHERE publication_number = ? AND live = 1", (publication_number,))
+
+    def flush(self):
+        # 追加した文書の索引を新しいセグメントとして書き出す
+        if self._buffer:
+            self.db.executemany(
+                "INSERT INTO postings VALUES (?, ?, ?, ?, ?)",
+                ((gram, section, self._segment, len(postings), _encode(postings))
+                 for (gram, section), postings in self._buffer.items()))
+            self.db.execute("INSERT INTO segments VALUES (?, 0)", (self._segment,))
+            self._segment += 1
+            self._buffer = {}
+            self._buffered_docs = 0
+            self._merge_levels()
+        self.db.commit()
+
+    def _merge_levels(self):
+        # 下の段から順に、merge_segments 個になった段を1つにまとめて1つ上の段にする
+        level = 0
+        while True:
+            segments = [r[0] for r in self.db.execute(
+                "SELECT segment FROM segments WHERE level = ? ORDER BY segment", (level,))]
+            if len(segments) < self.merge_segments:
+                return
+            level += 1
+            self._merge(segments, level)
+
+    def _merge(self, segments, level):
+        """
+        番号の連続したセグメントを、先頭の番号の1つのセグメントにまとめる関数
+
+        セグメントごとに (2-gram, 項目) の順で読み、同じ (2-gram, 項目) の一覧だけをメモリに置いてまとめる。
+        取り除いた文書の索引はここで消す。
+        """
+        dead = {r[0] for r in self.db.execute("SELECT doc_id FROM docs WHERE live = 0")}
+        self.db.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS merged (gram TEXT, section INTEGER, doc_count INTEGER, data BLOB)")
+        cursors = [self.db.execute(
+            "SELECT gram, section, segment, data, doc_count FROM postings WHERE segment = ? ORDER BY gram, section",
+            (segment,)) for segment in segments]
+        rows = heapq.merge(*cursors, key=operator.itemgetter(0, 1, 2))
+
+        def merged():
+            for (gram, section), group in itertools.groupby(rows, key=operator.itemgetter(0, 1)):
+                group = list(group)
+                if len(group) == 1 and not dead:
+                    # 1つのセグメントにしか無い一覧は展開せずにそのまま使う
+                    yield gram, section, group[0][4], group[0][3]
+                    continue
+                doc_count, data = _merge_postings([r[3] for r in group], dead)
+                if doc_count:
+                    yield gram, section, doc_count, data
+
+        self.db.executemany("INSERT INTO temp.merged VALUES (?, ?, ?, ?)", merged())
+        marks = ",".join("?" * len(segments))
+        self.db.execute(f"DELETE FROM postings WHERE segment IN ({marks})", segments)
+        self.db.execute(f"DELETE FROM segments WHERE segment IN ({marks})", segments)
+        self.db.execute(
+            "INSERT INTO postings SELECT gram, section, ?, doc_count, data FROM temp.merged", (segments[0],))
+        self.db.execute("INSERT INTO segments VALUES (?, ?)", (segments[0], level))
+        self.db.execute("DELETE FROM temp.merged")
+
+    def optimize(self):
+        """
+        すべてのセグメントを1つにまとめ、取り除いた文書の索引を消す関数
+        """
+        self.flush()
+        segments = [r[0] for r in self.db.execute("SELECT segment FROM segments ORDER BY segment")]
+        if segments:
+            level = self.db.execute("SELECT max(level) FROM segments").fetchone()[0]
+            self._merge(segments, level + 1)
+        # 取り除いた文書の索引はもうどのセグメントにも残っていない
+        self.db.execute("DELETE FROM docs WHERE live = 0")
+        self.db.commit()
+        self.db.execute("VACUUM")
+
+    def _segments(self, gram, section):
+        # 1つの 2-gram の全セグメントを読む（セグメントごとの文書番号・位置の開始・位置の配列）
+        rows = self.db.execute(
+            "SELECT data FROM postings WHERE gram = ? AND section = ? ORDER BY segment", (gram, section))
+        return [_decode(data) for (data,) in rows]
+
+    def _prefix_docs(self, char, section):
+        # 1文字の検索: その文字で始まる 2-gram を含む文書
+        docs = set()
+        rows = self.db.execute(
+            "SELECT data FROM postings WHERE gram >= ? AND gram < ? AND section = ?",
+            (char, char + '\U0010ffff', section))
+        for (data,) in rows:
+            docs.update(_decode(data)[0])
+        return docs
+
+    def _search_section(self, query, section):
+        if len(query) == 1:
+            return self._prefix_docs(query, section)
+        # 重ならない 2-gram（と末尾の 2-gram）だけで全文字を確認できる
+        offsets = list(range(0, len(query) - 1, 2))
+        if offsets[-1] != len(query) - 2:
+            offsets.append(len(query) - 2)
+        grams = [(query[i:i + 2], i) for i in offsets]
+        if any(gram.isspace() for gram, _ in grams):
+            # 空白だけの 2-gram は索引に無いため、残りの 2-gram をすべて使う
+            grams = [(query[i:i + 2], i) for i in range(len(query) - 1) if not query[i:i + 2].isspace()]
+
+        # 文書番号だけで絞り込む（文書数の少ない 2-gram から）
+        lists = []
+        for gram, offset in grams:
+            segments = [segment for segment in self._segments(gram, section) if segment[0]]
+            docs = set()
+            for segment in segments:
+                docs.update(segment[0])
+            if not docs:
+                return set()
+            lists.append((docs, segments, [segment[0][0] for segment in segments], offset))
+        lists.sort(key=lambda item: len(item[0]))
+        candidates = set.intersection(*(docs for docs, _, _, _ in lists))
+
+        # 出現位置が並んでいる文書だけを残す（文書数の少ない 2-gram の位置から確かめる）
+        hits = set()
+        for doc in candidates:
+            starts = None
+            for _, segments, firsts, offset in lists:
+                positions = _positions(segments, firsts, doc)
+                if starts is None:
+                    starts = set(map(operator.sub, positions, itertools.repeat(offset)))
+                elif len(starts) < 8:
+                    starts = {p for p in starts if _contains(positions, p + offset)}
+                else:
+                    starts.intersection_update(map(operator.sub, positions, itertools.repeat(offset)))
+                if not starts:
+                    break
+            if starts:
+                hits.add(doc)
+        return hits
+
+    def search(self, query, sections=None, limit=None):
+        """
+        文字列を含む文書を探す関数
+
+        Args:
+            query (str): 検索する文字列（全角・半角と大文字・小文字は区別しない。空白だけの文字列は探さない）
+            sections (list): 探す項目名（None の場合はすべて）
+            limit (int): 返す件数の上限
+
+        Returns:
+            list: (公開番号, 一致した項目名のリスト) のリスト（公開番号順）
+        """
+        self.flush()
+        query = normalize(query)
+        if not query or query.isspace():
+            return []
+        hits = {}
+        for section, name in enumerate(SECTIONS):
+            if sections is not None and name not in sections:
+                continue
+            for doc in self._search_section(query, section):
+                hits.setdefault(doc, []).append(name)
+        if not hits:
+            return []
+        results = []
+        # 変数の上限を超えないように分けて問い合わせる
+        ids = sorted(hits)
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            for doc, publication_number in self.db.execute(
+                    f"SELECT doc_id, publication_number FROM docs WHERE live = 1 AND doc_id IN ({marks})", chunk):
+                results.append((publication_number, hits[doc]))
+        results.sort()
+        return results[:limit] if limit is not None else results
+
+    # sinks.py の書き出し先と同じ使い方
+    def write(self, csv_name, row, parties=None):
+        self.add(row[_PUBLICATION_NUMBER], {name: row[i] for name, i in zip(SECTIONS, _SECTION_COLUMNS)})
+
+    def remove(self, csv_name, publication_number):
+        self.discard(publication_number)
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+if __name__ == "__main__":
+    # 使い方: python app/textindex.py <出力先ディレクトリ> <検索する文字列> [項目名...]
+    #         python app/textindex.py <出力先ディレクトリ> --optimize（すべてのセグメントを1つにまとめる）
+    index = TextIndex.in_directory(sys.argv[1])
+    if sys.argv[2] == '--optimize':
+        start = time.perf_counter()
+        index.optimize()
+        print(f"optimized ({time.perf_counter() - start:.1f} s)")
+        index.close()
+        sys.exit(0)
+    start = time.perf_counter()
+    found = index.search(sys.argv[2], sys.argv[3:] or None)
+    elapsed = time.perf_counter() - start
+    for publication_number, names in found:
+        print(publication_number, " ".join(names))
+    print(f"{len(found)} 件 ({elapsed * 1000:.1f} ms)")
+    index.close()
@@ -5,11 +5,19 @@ import logging
 logging.basicConfig(filename='unzip.log', level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
-def extract_zip(zip_path, extract_path):
+def extract_zip(zip_path, extract_path, nested=False):
+    # nested が True の場合は中のZIPも同じ場所（拡張子を除いたディレクトリ）に展開し、展開したZIPは消す
     try:
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
             zip_ref.extractall(extract_path)
         logging.info(f"Successfully extracted {zip_path} to {extract_path}")
+        if nested:
+            for root, _, names in os.walk(extract_path):
+                for name in names:
+                    if name.lower().endswith('.zip'):
+                        inner = os.path.join(root, name)
+                        extract_zip(inner, os.path.splitext(inner)[0], nested=True)
+                        os.remove(inner)
     except zipfile.BadZipFile:
         logging.error(f"The file {zip_path} is not a valid ZIP file")
         raise
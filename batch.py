@@ -0,0 +1,360 @@
+import os
+import sys
+import glob
+import time
+import signal
+import argparse
+import threading
+import contextlib
+
+# app/ 以下のモジュールは app/ をパスに入れて読み込む
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app'))
+from parse import xml_to_csv, redrive, CHECKPOINT_DOCS, CHECKPOINT_SECONDS
+from fields import BACKENDS, DEFAULT_BACKEND
+from metrics import Metrics
+from parsecache import CACHE_BYTES
+
+# 大量の一括ダウンロードを GUI を使わずに処理するコマンド
+#   python batch.py unzip 'data/*.zip' -o extracted        ZIPを展開する（入れ子のZIPも展開する）
+#   python batch.py parse 'data/*.zip' -o out --workers 8  XMLを解析してCSV（または Parquet など）に書き出す
+#   python batch.py load out --config db_config.ini         書き出したCSVをデータベースに投入する
+#   python batch.py run 'data/*.zip' -o out                 parse と load を続けて行う（--direct でCSVを読み直さずに投入する）
+#   python batch.py watch inbox -o out --config db_config.ini  inbox に届いたZIPを常駐して解析・投入する（ingest.py）
+#   python batch.py redrive out --config db_config.ini      out/quarantine/ に隔離した文書と行だけを処理し直す
+# parse と load は途中経過を保存するため、中断した場合は同じコマンドをもう一度実行すると続きから処理する。
+# 処理できない文書と投入できない行は出力先の quarantine/ に隔離して先に進む（quarantine.py）。
+# SIGTERM を受け取った場合は処理中の1件を書き終えてから止まる。
+
+# 展開し終えたディレクトリに置く目印
+EXTRACTED_MARK = '.extracted'
+# 進捗を表示する間隔（秒）
+PROGRESS_SECONDS = 10
+
+
+def expand_inputs(patterns):
+    """
+    入力の glob（** も使える）をファイル・ディレクトリのリストに展開する関数
+
+    一致するものが無いパターンがある場合は終了する。
+    """
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        if not matches:
+            sys.exit(f"入力が見つかりません: {pattern}")
+        paths += [m for m in matches if m not in paths]
+    return paths
+
+
+def format_seconds(seconds):
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class ProgressPrinter:
+    """
+    xml_to_csv の progress に渡し、interval 秒ごとに進捗を標準エラー出力に表示するもの
+    """
+
+    def __init__(self, name, interval=PROGRESS_SECONDS):
+        self.name = name
+        self.interval = interval
+        self.started = None
+        self.shown = 0.0
+
+    def __call__(self, done, total, counts):
+        now = time.monotonic()
+        if self.started is None:
+            self.started = now
+        if done < total and now - self.shown < self.interval:
+            return
+        self.shown = now
+        elapsed = now - self.started
+        text = f"[{self.name}] {done} / {total} documents"
+        if done and elapsed > 0:
+            rate = done / elapsed
+            text += f"  {rate:.1f} docs/s  ETA {format_seconds((total - done) / rate)}"
+        if counts.get("error"):
+            text += f"  errors {counts['error']}"
+        print(text, file=sys.stderr, flush=True)
+
+
+def stop_on_sigterm():
+    # SIGTERM で処理中の1件を書き終えてから止まるようにする（止めるための Event を返す）
+    cancel = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: cancel.set())
+    return cancel
+
+
+def make_metrics(args):
+    if not (args.metrics or args.metrics_json or args.metrics_prometheus):
+        return None
+    return Metrics(json_path=args.metrics_json, prometheus_path=args.metrics_prometheus,
+                   sample_every=args.profile_every, profile_dir=args.profile_dir,
+                   trace_memory=args.trace_memory)
+
+
+def cmd_unzip(args):
+    from unzip import extract_zip
+    for path in expand_inputs(args.inputs):
+        destination = os.path.join(args.output, os.path.splitext(os.path.basename(path))[0])
+        mark = os.path.join(destination, EXTRACTED_MARK)
+        if os.path.exists(mark) and not args.full:
+            print(f"Already extracted: {path}")
+            continue
+        print(f"Extracting {path} -> {destination}")
+        extract_zip(path, destination, nested=True)
+        # 目印は展開し終えてから置く（途中で止まった場合は次回もう一度展開する）
+        with open(mark, 'w', encoding='utf-8'):
+            pass
+    return 0
+
+
+def cmd_parse(args):
+    cancel = stop_on_sigterm()
+    metrics = make_metrics(args)
+    totals = {}
+    for path in expand_inputs(args.inputs):
+        with open(os.devnull, 'w') if args.quiet else contextlib.nullcontext(sys.stdout) as stdout, \
+                contextlib.redirect_stdout(stdout):
+            counts = xml_to_csv(
+                path, args.output, workers=args.workers, streaming=args.streaming,
+                incremental=not args.full, sharded=args.format == 'sharded', parquet=args.format == 'parquet',
+                text_index=args.text_index, code_index=args.code_index, store=args.store,
+                progress=ProgressPrinter(os.path.basename(path), args.progress_seconds), cancel=cancel,
+                metrics=metrics, checkpoint=args.checkpoint, checkpoint_seconds=args.checkpoint_seconds,
+                cache=args.cache, cache_bytes=int(args.cache_size * 2**20), backend=args.backend)
+        for status, n in counts.items():
+            totals[status] = totals.get(status, 0) + n
+        if cancel.is_set():
+            break
+    if args.quiet and metrics is not None:
+        metrics.report()
+    print(f"Accepted: {totals.get('ok', 0)}, Skipped: {totals.get('skip', 0)}, Errors: {totals.get('error', 0)}, "
+          f"Unchanged: {totals.get('unchanged', 0)}"
+          + (", Cancelled" if cancel.is_set() else ""))
+    # 中止した場合は続きが残っていることを終了コードで知らせる
+    return 1 if cancel.is_set() else 0
+
+
+def cmd_load(args):
+    # psycopg2 は投入する場合だけ必要
+    import csv_to_db
+    options = {}
+    if args.batch_size is not None:
+        options['batch_size'] = args.batch_size
+    if args.checkpoint_files is not None:
+        options['checkpoint'] = args.checkpoint_files
+    csv_to_db.csv_to_db_bulk(
+        args.output, upsert=not args.no_upsert, incremental=not args.full, parties=args.parties,
+        codes=args.codes, metrics=make_metrics(args), connections=args.connections, config_path=args.config,
+        **options)
+    return 0
+
+
+def cmd_run(args):
+    if args.format == 'parquet':
+        sys.exit("Parquet の出力はデータベースに投入できません（parse を使ってください）")
+    if args.direct:
+        return cmd_run_direct(args)
+    status = cmd_parse(args)
+    if status:
+        return status
+    return cmd_load(args)
+
+
+def cmd_run_direct(args):
+    # CSVを読み直さずに、解析した行をそのまま1つの接続で投入する（csv_to_db.xml_to_db）
+    import csv_to_db
+    unsupported = [name for name, used in (('--text-index', args.text_index), ('--code-index', args.code_index),
+                                           ('--store', args.store), ('--connections', args.connections > 1))
+                   if used]
+    if unsupported:
+        sys.exit(f"--direct では {', '.join(unsupported)} を使えません（--direct を付けずに実行してください）")
+    metrics = make_metrics(args)
+    options = {} if args.batch_size is None else {'batch_size': args.batch_size}
+    connection = csv_to_db.get_connection(args.config)
+    try:
+        for path in expand_inputs(args.inputs):
+            with open(os.devnull, 'w') if args.quiet else contextlib.nullcontext(sys.stdout) as stdout, \
+                    contextlib.redirect_stdout(stdout):
+                stats = csv_to_db.xml_to_db(
+                    path, connection, csv_dir=args.output, workers=args.workers, streaming=args.streaming,
+                    upsert=not args.no_upsert, manifest_dir=None if args.full else args.output,
+                    sharded=args.format == 'sharded', parties=args.parties, codes=args.codes, metrics=metrics,
+                    quarantine_dir=args.output, **options)
+            print(f"Loaded {path}: {max((count for count, _ in stats.values()), default=0)} rows")
+    finally:
+        connection.close()
+    return 0
+
+
+def cmd_redrive(args):
+    with open(os.devnull, 'w') if args.quiet else contextlib.nullcontext(sys.stdout) as stdout, \
+            contextlib.redirect_stdout(stdout):
+        counts = redrive(
+            args.output, workers=args.workers, streaming=args.streaming, sharded=args.format == 'sharded',
+            parquet=args.format == 'parquet', text_index=args.text_index, code_index=args.code_index,
+            store=args.store, metrics=make_metrics(args), backend=args.backend)
+    if args.quiet:
+        print(f"Redriven: {counts['ok']}, Skipped: {counts['skip']}, Still failing: {counts['error']}")
+    failed = counts['error']
+    if not args.no_load and args.format != 'parquet':
+        # psycopg2 は投入する場合だけ必要
+        import csv_to_db
+        # 処理し直した文書のCSVを投入してから、隔離した行を投入し直す
+        options = {} if args.batch_size is None else {'batch_size': args.batch_size}
+        csv_to_db.csv_to_db_bulk(
+            args.output, upsert=not args.no_upsert, parties=args.parties, codes=args.codes,
+            connections=args.connections, config_path=args.config, **options)
+        connection = csv_to_db.get_connection(args.config)
+        try:
+            failed += csv_to_db.redrive_rows(
+                args.output, connection, upsert=not args.no_upsert, parties=args.parties, codes=args.codes)[1]
+        finally:
+            connection.close()
+    # まだ処理できないものが残っていることを終了コードで知らせる
+    return 1 if failed else 0
+
+
+def cmd_watch(args):
+    # psycopg2 は投入する場合だけ必要
+    from ingest import Ingester
+    if args.format == 'parquet':
+        sys.exit("Parquet の出力はデータベースに投入できません")
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: stop.set())
+    load_options = {'upsert': not args.no_upsert, 'parties': args.parties, 'codes': args.codes}
+    if args.batch_size is not None:
+        load_options['batch_size'] = args.batch_size
+    if args.checkpoint_files is not None:
+        load_options['checkpoint'] = args.checkpoint_files
+    metrics = Metrics(json_path=args.metrics_json, prometheus_path=args.metrics_prometheus)
+    ingester = Ingester(
+        args.inbox, args.output, config_path=args.config, workers=args.workers, connections=args.connections,
+        parse_options={
+            'streaming': args.streaming, 'sharded': args.format == 'sharded', 'text_index': args.text_index,
+            'code_index': args.code_index, 'store': args.store, 'checkpoint': args.checkpoint,
+            'checkpoint_seconds': args.checkpoint_seconds, 'cache': args.cache,
+            'cache_bytes': int(args.cache_size * 2**20), 'backend': args.backend},
+        load_options=load_options, metrics=metrics,
+        archive_metrics=(lambda: Metrics(sample_every=args.profile_every, profile_dir=args.profile_dir,
+                                         trace_memory=args.trace_memory)) if args.metrics else None,
+        progress=lambda name: ProgressPrinter(name, args.progress_seconds), quiet=args.quiet,
+        **{name: getattr(args, name) for name in ('poll_seconds', 'settle_seconds')
+           if getattr(args, name) is not None})
+    ingester.run(stop, once=args.once)
+    metrics.report()
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="特許公報のXMLの一括処理（展開・解析・データベースへの投入）")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_metrics_options(p):
+        p.add_argument('--metrics', action='store_true', help="段階ごとの時間と件数の集計を表示する")
+        p.add_argument('--metrics-json', help="集計を書き出す JSON ファイル")
+        p.add_argument('--metrics-prometheus', help="集計を書き出す Prometheus の textfile")
+        p.add_argument('--profile-every', type=int, default=0, help="この件数ごとに1件を標本にする")
+        p.add_argument('--profile-dir', help="標本の cProfile の結果を書き出すディレクトリ")
+        p.add_argument('--trace-memory', action='store_true', help="標本の tracemalloc のピークを測る")
+
+    def add_parse_options(p, inputs=True):
+        if inputs:
+            p.add_argument('inputs', nargs='+', help="ZIPファイルまたはXMLのディレクトリ（glob を使える。例: 'data/**/*.zip'）")
+        p.add_argument('-o', '--output', required=True, help="出力先ディレクトリ")
+        p.add_argument('--workers', type=int, default=None, help="解析に使うプロセス数（既定はCPU数）")
+        p.add_argument('--streaming', action='store_true', help="逐次読み込みで抽出する（非常に大きなXML向け）")
+        p.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND,
+                       help="解析の実装（lxml は lxml が必要。どちらでも同じ行になる）")
+        p.add_argument('--format', choices=('csv', 'sharded', 'parquet'), default='csv',
+                       help="出力の形式（csv: 出願番号ごとのCSV、sharded: まとめたCSVと索引、parquet: 公開月ごと）")
+        p.add_argument('--text-index', action='store_true', help="全文検索用の索引も作る")
+        p.add_argument('--code-index', action='store_true', help="分類・テーマコード・Fタームの索引も作る")
+        p.add_argument('--store', action='store_true', help="公開番号・出願番号・日付・IPC・出願人で引ける保存先も作る")
+        p.add_argument('--checkpoint', type=int, default=CHECKPOINT_DOCS, help="途中経過を保存する件数の間隔")
+        p.add_argument('--checkpoint-seconds', type=float, default=CHECKPOINT_SECONDS,
+                       help="途中経過を保存する秒数の間隔")
+        p.add_argument('--cache', help="解析結果のキャッシュを置くディレクトリ（同じXMLを解析し直す場合に読み直さない）")
+        p.add_argument('--cache-size', type=float, default=CACHE_BYTES / 2**20, help="キャッシュの大きさの上限（MB）")
+        p.add_argument('--progress-seconds', type=float, default=PROGRESS_SECONDS, help="進捗を表示する間隔（秒）")
+        p.add_argument('--quiet', action='store_true', help="1件ごとの表示を省く")
+
+    def add_load_options(p):
+        p.add_argument('--config', default='db_config.ini', help="データベースの接続情報")
+        p.add_argument('--connections', type=int, default=1, help="投入に使う接続数（2以上で並列に投入する）")
+        p.add_argument('--batch-size', type=int, help="1トランザクションで投入する行数（既定は csv_to_db.BATCH_SIZE）")
+        p.add_argument('--checkpoint-files', type=int,
+                       help="投入済みとして記録するCSVファイル数の間隔（既定は csv_to_db.CHECKPOINT_FILES）")
+        p.add_argument('--parties', action='store_true', help="当事者テーブルにも投入する")
+        p.add_argument('--codes', action='store_true', help="コードの辞書と配列のテーブルにも投入する")
+        p.add_argument('--no-upsert', action='store_true', help="既存の行を置き換えずに追加する")
+
+    p = commands.add_parser('unzip', help="ZIPを展開する（入れ子のZIPも展開する）")
+    p.add_argument('inputs', nargs='+', help="ZIPファイル（glob を使える）")
+    p.add_argument('-o', '--output', required=True, help="展開先ディレクトリ（ZIPごとにサブディレクトリを作る）")
+    p.add_argument('--full', action='store_true', help="展開済みのZIPも展開し直す")
+    p.set_defaults(func=cmd_unzip)
+
+    p = commands.add_parser('parse', help="XMLを解析して書き出す")
+    add_parse_options(p)
+    add_metrics_options(p)
+    p.add_argument('--full', action='store_true', help="前回から変わっていないXMLも処理し直す")
+    p.set_defaults(func=cmd_parse)
+
+    p = commands.add_parser('load', help="書き出したCSVをデータベースに投入する")
+    p.add_argument('output', help="CSVのディレクトリ（parse の出力先）")
+    add_load_options(p)
+    add_metrics_options(p)
+    p.add_argument('--full', action='store_true', help="投入済みのCSVも投入し直す")
+    p.set_defaults(func=cmd_load)
+
+    p = commands.add_parser('run', help="parse と load を続けて行う")
+    add_parse_options(p)
+    add_load_options(p)
+    add_metrics_options(p)
+    p.add_argument('--full', action='store_true', help="処理済みのXMLと投入済みのCSVも処理し直す")
+    p.add_argument('--direct', action='store_true',
+                   help="解析した行をCSVから読み直さずにそのまま投入する（1つの接続で解析と投入を同時に進める）")
+    p.set_defaults(func=cmd_run)
+
+    p = commands.add_parser('redrive', help="隔離した文書と行だけを処理し直す")
+    p.add_argument('output', help="parse の出力先（quarantine/ を含むディレクトリ）")
+    p.add_argument('--workers', type=int, default=None, help="解析に使うプロセス数（既定はCPU数）")
+    p.add_argument('--streaming', action='store_true', help="逐次読み込みで抽出する（非常に大きなXML向け）")
+    p.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND, help="解析の実装")
+    p.add_argument('--format', choices=('csv', 'sharded', 'parquet'), default='csv',
+                   help="出力の形式（隔離したときの parse と同じにする）")
+    p.add_argument('--text-index', action='store_true', help="全文検索用の索引も更新する")
+    p.add_argument('--code-index', action='store_true', help="分類・テーマコード・Fタームの索引も更新する")
+    p.add_argument('--store', action='store_true', help="公報の保存先も更新する")
+    p.add_argument('--quiet', action='store_true', help="1件ごとの表示を省く")
+    p.add_argument('--no-load', action='store_true', help="文書を処理し直すだけで、データベースには投入しない")
+    add_load_options(p)
+    add_metrics_options(p)
+    p.set_defaults(func=cmd_redrive)
+
+    p = commands.add_parser('watch', help="受信ディレクトリに届いたZIPを常駐して解析・投入する")
+    p.add_argument('inbox', help="受信ディレクトリ（下に processing/ done/ failed/ を作る）")
+    add_parse_options(p, inputs=False)
+    add_load_options(p)
+    add_metrics_options(p)
+    p.add_argument('--poll-seconds', type=float, help="受信ディレクトリを見る間隔（秒。既定は ingest.POLL_SECONDS）")
+    p.add_argument('--settle-seconds', type=float,
+                   help="大きさと更新時刻がこの秒数変わらなくなったZIPを処理する（既定は ingest.SETTLE_SECONDS）")
+    p.add_argument('--once', action='store_true', help="待っているZIPが無くなったら終了する")
+    p.set_defaults(func=cmd_watch)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import contextlib
+import filecmp
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from parse import xml_to_csv
+from fields import BACKENDS, FIELDS, NAMESPACES, Field, make_extractor
+from synth import make_bulk_zip, make_publication
+
+# 解析の実装（fields.BACKENDS）がすべて同じ行を作ることを確かめ、1件あたりの木の作成と抽出の時間を比べる
+# 使い方: python bench/bench_backends.py [件数]
+#
+# 確かめること:
+#   - 合成の公報（当事者・請求項・段落の数を変えたもの）の行と当事者の記録が実装によらず同じ
+#   - コメント・処理命令・実体参照・ルート直下の要素・入れ子の一致などの文書でも同じ
+#   - xml_to_csv の出力（ZIPを入力にした出願番号ごとのCSV）が実装によらず同じ
+
+COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+SIZES = (10, 100, 1000, 5000)
+
+_PAT = NAMESPACES['pat']
+_COM = NAMESPACES['com']
+
+# 取り出し方の違いが出やすい文書（列定義にルート直下と入れ子のパスを足して確かめる）
+EDGE_FIELDS = FIELDS + [
+    Field('number_joined', './/pat:PublicationNumber', " "),
+    Field('nested_number', './/com:P/pat:PublicationNumber'),
+]
+EDGE_DOCUMENTS = [
+    # ルート自身は対象外で、ルート直下の要素は対象
+    f'<pat:PublicationNumber xmlns:pat="{_PAT}">R<pat:PublicationNumber>A</pat:PublicationNumber>'
+    f'</pat:PublicationNumber>',
+    # 入れ子で一致する場合は文書順で最初の要素
+    f'<r xmlns:pat="{_PAT}" xmlns:com="{_COM}"><com:P><com:P><pat:PublicationNumber>1</pat:PublicationNumber>'
+    f'</com:P><pat:PublicationNumber>2</pat:PublicationNumber></com:P></r>',
+    # コメント・処理命令・内部の実体参照・CDATA・前後の空白
+    f'<!DOCTYPE r [<!ENTITY e "実体">]><r xmlns:pat="{_PAT}"><!-- c --><?pi x?>'
+    f'<pat:PublicationNumber>  &e;<![CDATA[<x>]]> <!-- c -->末尾<?pi y?>  </pat:PublicationNumber></r>',
+]
+
+
+def check_documents(backends):
+    extractors = {name: make_extractor(EDGE_FIELDS, backend=name) for name in backends}
+    documents = [doc.encode('utf-8') for doc in EDGE_DOCUMENTS]
+    rnd = random.Random(0)
+    for seed in range(COUNT):
+        documents.append(make_publication(
+            seed=seed, applicants=rnd.randint(0, 15), agents=rnd.randint(0, 3), inventors=rnd.randint(0, 15),
+            claims=rnd.randint(1, 30), paragraphs=rnd.randint(1, 200)))
+    for i, data in enumerate(documents):
+        rows = {}
+        for name, extractor in extractors.items():
+            results = extractor.scan(extractor.parse(io.BytesIO(data)))
+            rows[name] = (extractor.row(results, 0), extractor.parties(results))
+        base = rows[backends[0]]
+        for name, row in rows.items():
+            assert row == base, f"文書 {i}: {name} の行が {backends[0]} と違う"
+    print(f"  {len(documents)} documents: same rows and parties")
+
+
+def check_output(backends, work):
+    zip_path = os.path.join(work, 'input.zip')
+    make_bulk_zip(zip_path, COUNT, seed=1, pages=(1, 3), page_bytes=100)
+    outputs = []
+    for name in backends:
+        output = os.path.join(work, name)
+        with contextlib.redirect_stdout(io.StringIO()):
+            xml_to_csv(zip_path, output, workers=1, incremental=False, backend=name)
+        outputs.append(output)
+    files = sorted(f for f in os.listdir(outputs[0]) if f.endswith('.csv'))
+    for output in outputs[1:]:
+        assert sorted(f for f in os.listdir(output) if f.endswith('.csv')) == files
+        _, mismatch, errors = filecmp.cmpfiles(outputs[0], output, files, shallow=False)
+        assert not mismatch and not errors, f"{output}: {mismatch or errors}"
+    print(f"  xml_to_csv from a ZIP of {COUNT}: same {len(files)} CSV files")
+
+
+def latency(backends):
+    print(f"  {'paragraphs':>10} {'KB':>7} " + " ".join(f"{name + ' p50 ms':>14} {'max ms':>8}" for name in backends)
+          + "  speedup")
+    for paragraphs in SIZES:
+        data = make_publication(seed=2, applicants=5, inventors=8, paragraphs=paragraphs)
+        repeat = 50 if paragraphs < 1000 else 10
+        medians = []
+        text = f"  {paragraphs:>10} {len(data) / 1024:>7.0f} "
+        for name in backends:
+            extractor = make_extractor(backend=name)
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                extractor.row(extractor.scan(extractor.parse(io.BytesIO(data))), 0)
+                samples.append(time.perf_counter() - start)
+            samples.sort()
+            medians.append(samples[len(samples) // 2])
+            text += f"{samples[len(samples) // 2] * 1000:>14.2f} {samples[-1] * 1000:>8.2f} "
+        print(text + f" {medians[0] / medians[-1]:6.2f}x")
+
+
+def main():
+    backends = list(BACKENDS)
+    try:
+        make_extractor([], backend='lxml')
+    except ImportError:
+        sys.exit("lxml が必要です (pip install lxml)")
+    print(f"backends: {', '.join(backends)}")
+    work = tempfile.mkdtemp()
+    try:
+        check_documents(backends)
+        check_output(backends, work)
+    finally:
+        shutil.rmtree(work)
+    print("per-document parse + extract latency")
+    latency(backends)
+
+
+if __name__ == "__main__":
+    main()
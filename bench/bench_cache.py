@@ -0,0 +1,97 @@
+import contextlib
+import filecmp
+import io
+import os
+import sys
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import parse
+from parse import xml_to_csv
+from fields import FIELDS, Field
+from metrics import Metrics
+from synth import make_bulk_zip
+
+# 解析結果のキャッシュ（parsecache.py）の効果を測り、キャッシュの有無で出力が同じになることを確かめる
+# 使い方: python bench/bench_cache.py [件数]
+#
+# 測ること:
+#   - キャッシュなし / 空のキャッシュ（書き込みの分だけ遅い） / 同じ入力の2回目
+#   - 出力形式だけを変えた2回目（sharded）
+#   - 列を1つ足した2回目（足した列だけを取り出す）と、列を1つ減らした2回目（XMLを読まない）
+
+COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+# 足す列（既存の列と連結文字列が違うため、新しい取得対象になる）
+EXTRA_FIELD = Field('invention_title_joined', './/pat:InventionTitle', " ")
+
+
+def use_fields(fields):
+    # 列定義を差し替える（逐次処理のため、このプロセスの FieldExtractor を作り直せばよい）
+    parse.FIELDS = fields
+    parse._extractors.clear()
+
+
+def run(zip_path, output, cache=None, **options):
+    shutil.rmtree(output, ignore_errors=True)
+    metrics = Metrics()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        xml_to_csv(zip_path, output, workers=1, incremental=False, cache=cache, metrics=metrics, **options)
+    seconds = time.perf_counter() - start
+    return seconds, metrics.calls.get('parse', 0), metrics.calls.get('cache.hit', 0)
+
+
+def same(a, b):
+    compared = filecmp.dircmp(a, b)
+    return not (compared.left_only or compared.right_only or
+                filecmp.cmpfiles(a, b, compared.common_files, shallow=False)[1:] != ([], []))
+
+
+def main():
+    work = tempfile.mkdtemp()
+    try:
+        zip_path = os.path.join(work, 'input.zip')
+        make_bulk_zip(zip_path, COUNT, seed=0)
+        cache = os.path.join(work, 'cache')
+        print(f"{COUNT} documents")
+
+        def report(name, result, reference=None, output=None):
+            seconds, parsed, hits = result
+            text = f"  {name:<22} {seconds:7.3f} s  {COUNT / seconds:8.1f} docs/s  parsed {parsed:5d}  hits {hits:5d}"
+            if reference is not None:
+                assert same(reference, output), f"{name}: キャッシュなしの出力と違う"
+                text += "  (same output)"
+            print(text)
+
+        plain = os.path.join(work, 'plain')
+        # ZIPの一覧とPDFのページ数はプロセス内でも覚えるため、1回目は測らない
+        run(zip_path, plain)
+        report('no cache', run(zip_path, plain))
+        report('cold cache', run(zip_path, os.path.join(work, 'cold'), cache), plain, os.path.join(work, 'cold'))
+        report('warm cache', run(zip_path, os.path.join(work, 'warm'), cache), plain, os.path.join(work, 'warm'))
+
+        run(zip_path, os.path.join(work, 'plain_sharded'), sharded=True)
+        report('warm, sharded output', run(zip_path, os.path.join(work, 'sharded'), cache, sharded=True),
+               os.path.join(work, 'plain_sharded'), os.path.join(work, 'sharded'))
+
+        try:
+            use_fields(FIELDS + [EXTRA_FIELD])
+            run(zip_path, os.path.join(work, 'plain_added'))
+            report('warm, field added', run(zip_path, os.path.join(work, 'added'), cache),
+                   os.path.join(work, 'plain_added'), os.path.join(work, 'added'))
+            use_fields([f for f in FIELDS if f.name != 'drawing_description'])
+            run(zip_path, os.path.join(work, 'plain_removed'))
+            report('warm, field removed', run(zip_path, os.path.join(work, 'removed'), cache),
+                   os.path.join(work, 'plain_removed'), os.path.join(work, 'removed'))
+        finally:
+            use_fields(FIELDS)
+        print(f"  cache size: {os.path.getsize(os.path.join(cache, 'parse_cache.sqlite')) / 2**20:.1f} MB")
+    finally:
+        shutil.rmtree(work)
+
+
+if __name__ == "__main__":
+    main()
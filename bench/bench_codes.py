@@ -0,0 +1,152 @@
+import contextlib
+import io
+import os
+import sys
+import random
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from xml.etree.ElementTree import fromstring
+from fields import FIELDS, NAMESPACES, COLUMNS, FieldExtractor
+from codes import SCHEMES, CodeIndex, split_codes
+from synth import make_publication
+
+# 分類・テーマコード・Fタームを文字列のまま持つ場合と、コードの辞書と番号の配列にする場合を比較する
+# 使い方: python bench/bench_codes.py [件数]
+# PGDSN="host=localhost dbname=test user=postgres" を指定すると PostgreSQL でも比較する
+# （一時テーブルを使うため、既存のデータには触れない）
+
+IPC = COLUMNS.index('ipc')
+FI = COLUMNS.index('fi')
+THEME = COLUMNS.index('theme_code')
+FTERM = COLUMNS.index('fterm')
+PUB = COLUMNS.index('publication_number')
+
+
+def make_rows(count):
+    # 1件の行をもとに、公開番号と分類・テーマコード・Fタームだけを変えた行を作る
+    extractor = FieldExtractor(FIELDS, NAMESPACES)
+    template = [str(v) for v in extractor.row(extractor.scan(fromstring(make_publication(paragraphs=1))), 10)]
+    rnd = random.Random(0)
+    subclasses = [f"{rnd.choice('ABCDEFGH')}{rnd.randint(1, 99):02d}{rnd.choice('ABCDEFGHJKLMNPQ')}"
+                  for _ in range(300)]
+    themes = [f"{rnd.randint(2, 5)}{rnd.choice('ABCDEFGHJKLM')}{rnd.randint(0, 999):03d}" for _ in range(2000)]
+    rows = []
+    for i in range(count):
+        row = list(template)
+        row[PUB] = f"{2024000000 + i:010d}"
+        symbols = [f"{rnd.choice(subclasses)}{rnd.choice((1, 3, 5, 7, 13, 21, 33))}/{rnd.choice((0, 2, 4, 10, 12, 20)):02d}"
+                   for _ in range(rnd.randint(1, 5))]
+        sub, rest = symbols[0][:4], symbols[0][4:]
+        main, group = rest.split('/')
+        row[IPC] = f"{sub}{int(main):4d}/{group:<6}  20060101AFI20240101BHJP"
+        row[FI] = "      ".join(s + (f" {rnd.choice((101, 102, 301))}" if rnd.random() < 0.3 else "")
+                                + (f" {rnd.choice('ABZ')}" if rnd.random() < 0.3 else "") for s in symbols)
+        chosen = rnd.sample(themes, rnd.randint(1, 3))
+        row[THEME] = " ".join(chosen)
+        row[FTERM] = " ".join(f"{rnd.choice(chosen)}{rnd.choice(('AA', 'AB', 'BA', 'BB', 'CA', 'DA'))}"
+                              f"{rnd.randint(0, 20):02d}" for _ in range(rnd.randint(5, 30)))
+        rows.append(row)
+    return rows
+
+
+def local(rows):
+    work = tempfile.mkdtemp()
+    try:
+        index = CodeIndex.in_directory(work)
+        start = time.perf_counter()
+        for row in rows:
+            index.write(None, row)
+        index.commit()
+        build = time.perf_counter() - start
+        raw = sum(len(row[i].encode('utf-8')) for row in rows for i in (IPC, FI, THEME, FTERM))
+        ids = sum(4 * len(codes) for row in rows for codes in split_codes(row).values())
+        count = index.db.execute("SELECT count(*) FROM codes").fetchone()[0]
+        print(f"{len(rows)} patents, {count} distinct codes, build {len(rows) / build:.0f} patents/s")
+        print(f"raw text: {raw / 2**20:.1f} MB, ID arrays: {ids / 2**20:.1f} MB, "
+              f"index file: {os.path.getsize(index.path) / 2**20:.1f} MB (arrays + dictionary + inverted index)")
+
+        term = split_codes(rows[len(rows) // 2])['fterm'][0]
+        expected = sorted(row[PUB] for row in rows if term in split_codes(row)['fterm'])
+        # 文字列のまま持つ場合は全行の Fターム の列を部分一致で探す
+        start = time.perf_counter()
+        sorted(row[PUB] for row in rows if term in row[FTERM])
+        scan = time.perf_counter() - start
+        start = time.perf_counter()
+        found = index.publications('fterm', term)
+        lookup = time.perf_counter() - start
+        assert found == expected
+        print(f"F-term {term}: {len(found)} hits, scan {scan * 1000:.1f} ms, index {lookup * 1000:.2f} ms")
+        index.close()
+    finally:
+        shutil.rmtree(work)
+
+
+def postgres(rows, dsn):
+    import psycopg2
+    import csv_to_db
+    from bench_db import create_tables
+
+    connection = psycopg2.connect(dsn)
+    create_tables(connection)
+    with connection, connection.cursor() as cur:
+        for table, ddl in ((csv_to_db.CODE_TABLE, csv_to_db.CODE_TABLE_DDL),
+                           (csv_to_db.APPLICATION_CODE_TABLE, csv_to_db.APPLICATION_CODE_TABLE_DDL)):
+            cur.execute(f"DROP TABLE IF EXISTS pg_temp.{table}")
+            cur.execute(ddl.replace("CREATE TABLE IF NOT EXISTS", "CREATE TEMP TABLE"))
+        for scheme in SCHEMES:
+            cur.execute(f"CREATE INDEX ON pg_temp.{csv_to_db.APPLICATION_CODE_TABLE} USING gin ({scheme})")
+    with contextlib.redirect_stdout(io.StringIO()):
+        csv_to_db.bulk_load(connection, rows, 1000, False)
+    code_ids = {}
+    for i in range(0, len(rows), 1000):
+        with connection, connection.cursor() as cur:
+            csv_to_db.copy_rows(cur, csv_to_db.APPLICATION_CODE_TABLE,
+                                csv_to_db.code_rows(cur, rows[i:i + 1000], code_ids))
+
+    term = split_codes(rows[len(rows) // 2])['fterm'][0]
+    with connection.cursor() as cur:
+        cur.execute("ANALYZE")
+        sizes = {}
+        for table in ('pupa_application_basic_info', csv_to_db.APPLICATION_CODE_TABLE, csv_to_db.CODE_TABLE):
+            cur.execute("SELECT pg_total_relation_size(%s)", (f"pg_temp.{table}",))
+            sizes[table] = cur.fetchone()[0]
+        cur.execute("SELECT sum(pg_column_size(c8) + pg_column_size(c11) + pg_column_size(c12)"
+                    " + pg_column_size(c13)) FROM pupa_application_basic_info")
+        raw = cur.fetchone()[0]
+        cur.execute(f"SELECT sum(pg_column_size(ipc) + pg_column_size(fi) + pg_column_size(theme_code)"
+                    f" + pg_column_size(fterm)) FROM {csv_to_db.APPLICATION_CODE_TABLE}")
+        arrays = cur.fetchone()[0]
+        print(f"PostgreSQL: text columns {raw / 2**20:.1f} MB, integer[] columns {arrays / 2**20:.1f} MB, "
+              f"code tables with GIN {(sizes[csv_to_db.APPLICATION_CODE_TABLE] + sizes[csv_to_db.CODE_TABLE]) / 2**20:.1f} MB")
+
+        start = time.perf_counter()
+        cur.execute("SELECT c3 FROM pupa_application_basic_info WHERE c13 LIKE %s", (f"%{term}%",))
+        like = cur.fetchall()
+        like_time = time.perf_counter() - start
+        start = time.perf_counter()
+        cur.execute(f"SELECT a.publication_number FROM {csv_to_db.APPLICATION_CODE_TABLE} a"
+                    f" WHERE a.fterm @> ARRAY[(SELECT code_id FROM {csv_to_db.CODE_TABLE}"
+                    f" WHERE scheme = 'fterm' AND code = %s)]", (term,))
+        gin = cur.fetchall()
+        gin_time = time.perf_counter() - start
+        assert sorted(like) == sorted(gin)
+        print(f"F-term {term}: LIKE {like_time * 1000:.1f} ms, GIN {gin_time * 1000:.1f} ms")
+    connection.close()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    rows = make_rows(count)
+    local(rows)
+    dsn = os.environ.get("PGDSN")
+    if dsn:
+        postgres(rows, dsn)
+
+
+if __name__ == "__main__":
+    main()
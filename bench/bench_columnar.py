@@ -0,0 +1,123 @@
+import os
+import csv
+import sys
+import glob
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from xml.etree.ElementTree import fromstring
+from fields import FIELDS, NAMESPACES, COLUMNS, FieldExtractor
+from sinks import PerApplicationSink
+from columnar import ParquetSink, read_dataset, ds
+from synth import make_publication
+
+# 出願番号ごとのCSVと公開月ごとの Parquet について、ファイルの大きさと1列を読む時間を比較する
+# あわせて、途中経過を頻繁に保存（flush）してもファイルが増えないことと、
+# 書きかけのファイルを残して止まった場合に最後の flush() までの行が読めることを確かめる
+# 使い方: python bench/bench_columnar.py [件数]
+
+IPC = COLUMNS.index('ipc')
+
+
+def make_rows(count):
+    extractor = FieldExtractor(FIELDS, NAMESPACES)
+    rows = []
+    for i in range(count):
+        root = fromstring(make_publication(seed=i, paragraphs=30))
+        rows.append(extractor.row(extractor.scan(root), 10))
+    return rows
+
+
+def write(sink, rows):
+    for row in rows:
+        sink.write(row[COLUMNS.index('application_number')], row)
+    sink.close()
+
+
+def disk_usage(directory, suffix):
+    return sum(os.path.getsize(p) for p in glob.glob(os.path.join(directory, '**', '*' + suffix), recursive=True))
+
+
+def scan_csv(directory):
+    values = []
+    for path in glob.glob(os.path.join(directory, '*.csv')):
+        with open(path, encoding='utf-8', newline='') as f:
+            values += [row[IPC] for row in csv.reader(f)]
+    return values
+
+
+def check_checkpoints(work, rows, every=100):
+    # every 行ごとに flush() する場合と最後に1回だけの場合で、ファイルの数と時間を比べる
+    counts = {}
+    for label, interval in (('once', len(rows) + 1), (f'every {every}', every)):
+        directory = os.path.join(work, f'checkpoint_{interval}')
+        start = time.perf_counter()
+        sink = ParquetSink(directory)
+        for i, row in enumerate(rows, 1):
+            sink.write(row[COLUMNS.index('application_number')], row)
+            if i % interval == 0:
+                sink.flush()
+        sink.close()
+        counts[label] = len(glob.glob(os.path.join(directory, '*', '*.parquet')))
+        print(f"flush {label}: {counts[label]} files, {time.perf_counter() - start:.2f} s")
+    assert counts['once'] == counts[f'every {every}'], counts
+
+    # 書きかけのファイルがある状態を写し取り、開き直すと最後の flush() までの行が読めること
+    directory = os.path.join(work, 'crashed')
+    sink = ParquetSink(os.path.join(work, 'running'))
+    stop = len(rows) * 2 // 3 + every // 2
+    for i, row in enumerate(rows[:stop], 1):
+        sink.write(row[COLUMNS.index('application_number')], row)
+        if i % every == 0:
+            sink.flush()
+    shutil.copytree(os.path.join(work, 'running'), directory)
+    sink.close()
+    ParquetSink(directory)
+    recovered = read_dataset(directory, ['ipc']).num_rows
+    assert recovered == stop // every * every, (recovered, stop)
+    print(f"recovered {recovered} rows flushed before the copy ({stop} written)")
+
+
+def timeit(func, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    csv.field_size_limit(2**31 - 1)
+    work = tempfile.mkdtemp()
+    try:
+        rows = make_rows(count)
+        csv_dir = os.path.join(work, 'csv')
+        parquet_dir = os.path.join(work, 'parquet')
+        write(PerApplicationSink(csv_dir), rows)
+        write(ParquetSink(parquet_dir), rows)
+        assert sorted(scan_csv(csv_dir)) == sorted(read_dataset(parquet_dir, ['ipc']).column('ipc').to_pylist())
+
+        csv_size = disk_usage(csv_dir, '.csv')
+        parquet_size = disk_usage(parquet_dir, '.parquet')
+        print(f"{count} patents")
+        print(f"size: CSV {csv_size / 2**20:.1f} MB, Parquet {parquet_size / 2**20:.1f} MB "
+              f"({csv_size / parquet_size:.1f}x smaller)")
+
+        csv_scan = timeit(lambda: scan_csv(csv_dir))
+        parquet_scan = timeit(lambda: read_dataset(parquet_dir, ['ipc']))
+        month = timeit(lambda: read_dataset(parquet_dir, ['ipc'], ds.field('publication_month') == '2024-01'))
+        print(f"scan ipc: CSV {csv_scan * 1000:.1f} ms, Parquet {parquet_scan * 1000:.1f} ms "
+              f"({csv_scan / parquet_scan:.1f}x)")
+        print(f"scan ipc for one month: Parquet {month * 1000:.1f} ms")
+        check_checkpoints(work, rows)
+    finally:
+        shutil.rmtree(work)
+
+
+if __name__ == "__main__":
+    main()
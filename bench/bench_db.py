@@ -0,0 +1,78 @@
+import contextlib
+import io
+import os
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import csv_to_db
+from fields import FIELDS, NAMESPACES, FieldExtractor
+from xml.etree.ElementTree import fromstring
+from synth import make_publication
+
+# 1行ずつINSERTする従来の方法と COPY でまとめて投入する方法を比較する
+# 使い方: PGDSN="host=localhost dbname=test user=postgres" python bench/bench_db.py [行数]
+# テーブルは一時テーブルとして作るため、既存のデータには触れない
+
+
+def create_tables(connection):
+    with connection, connection.cursor() as cur:
+        for table, cols in csv_to_db.TABLE_COLUMNS.items():
+            defs = []
+            for i, col in enumerate(cols):
+                kind = "integer" if table == 'pupa_application_basic_info' and col in (9, 10) else "text"
+                defs.append(f"c{i} {kind}")
+            cur.execute(f"DROP TABLE IF EXISTS pg_temp.{table}")
+            cur.execute(f"CREATE TEMP TABLE {table} ({', '.join(defs)})")
+
+
+def make_rows(count):
+    extractor = FieldExtractor(FIELDS, NAMESPACES)
+    rows = []
+    for i in range(count):
+        root = fromstring(make_publication(seed=i, paragraphs=20))
+        rows.append([str(v) for v in extractor.row(extractor.scan(root), 10)])
+    return rows
+
+
+def legacy_load(connection, rows):
+    # csv_to_db() と同じく1行ずつ文字列でINSERTし、毎回コミットする
+    cur = connection.cursor()
+    for row in rows:
+        for table, values in csv_to_db.table_rows(row).items():
+            literals = ",".join("'{}'".format(str(v).replace("'", "''")) for v in values)
+            cur.execute(f"INSERT INTO {table} VALUES({literals})")
+            connection.commit()
+    cur.close()
+
+
+def main():
+    dsn = os.environ.get("PGDSN", "dbname=postgres")
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    connection = psycopg2.connect(dsn)
+    rows = make_rows(count)
+
+    create_tables(connection)
+    start = time.perf_counter()
+    legacy_load(connection, rows)
+    legacy = time.perf_counter() - start
+    print(f"INSERT per row: {count / legacy:.0f} patents/s")
+
+    for upsert in (False, True):
+        for batch_size in (100, 1000, 5000):
+            create_tables(connection)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                csv_to_db.bulk_load(connection, rows, batch_size, upsert)
+            elapsed = time.perf_counter() - start
+            label = "upsert" if upsert else "COPY"
+            print(f"{label} batch={batch_size}: {count / elapsed:.0f} patents/s ({legacy / elapsed:.1f}x)")
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+from xml.etree.ElementTree import fromstring
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from fields import FIELDS, NAMESPACES, PARTY_COLUMNS, PARTY_ROLES, FieldExtractor, element_text
+from synth import make_publication
+
+# 旧実装（列ごとに .// で木全体を検索する）と1回走査の抽出を比較する
+
+_PARTY_ITEMS = ('identifier', 'name', 'address')
+
+
+def legacy_xpath(f):
+    # 旧実装の出願人・代理人・発明者の列は Applicant[n] のような位置指定のパスだった
+    if f.name not in PARTY_COLUMNS:
+        return f.xpath
+    role, n, attr = PARTY_COLUMNS[f.name]
+    base, *items = PARTY_ROLES[role]
+    return f"{base}[{n}]/{items[_PARTY_ITEMS.index(attr)]}"
+
+
+def legacy_row(elem, page_count):
+    def safe_get_text(xpath, join_text=""):
+        element = elem.find(xpath, namespaces=NAMESPACES)
+        return element_text(element, join_text) if element is not None else ""
+
+    data = []
+    for f in FIELDS:
+        xpath = legacy_xpath(f)
+        if xpath is None:
+            data.append(page_count if f.value is None else f.value)
+        else:
+            text = safe_get_text(xpath, f.join_text)
+            data.append(f.transform(text) if f.transform else text)
+    return data
+
+
+def timeit(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    extractor = FieldExtractor(FIELDS, NAMESPACES)
+    print(f"{'paragraphs':>10} {'elements':>9} {'legacy ms':>10} {'single ms':>10} {'speedup':>8}")
+    for paragraphs in (10, 100, 1000, 5000):
+        root = fromstring(make_publication(seed=1, applicants=5, inventors=8, paragraphs=paragraphs))
+        assert legacy_row(root, 7) == extractor.row(extractor.scan(root), 7)
+        repeat = 20 if paragraphs < 1000 else 5
+        legacy = timeit(lambda: legacy_row(root, 7), repeat)
+        single = timeit(lambda: extractor.row(extractor.scan(root), 7), repeat)
+        elements = sum(1 for _ in root.iter())
+        print(f"{paragraphs:>10} {elements:>9} {legacy * 1000:>10.2f} {single * 1000:>10.2f} {legacy / single:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
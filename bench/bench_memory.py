@@ -0,0 +1,41 @@
+import io
+import os
+import sys
+import time
+import tracemalloc
+from xml.etree.ElementTree import parse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from fields import FIELDS, NAMESPACES, FieldExtractor
+from synth import make_publication
+
+# parse() で木全体を作る場合と逐次読み込みの場合のピークメモリを比較する
+
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak, elapsed
+
+
+def main():
+    extractor = FieldExtractor(FIELDS, NAMESPACES)
+    print(f"{'xml MB':>7} {'parse MB':>9} {'stream MB':>10} {'parse s':>8} {'stream s':>9}")
+    for paragraphs in (1000, 10000, 40000):
+        xml = make_publication(seed=2, paragraphs=paragraphs, claims=200)
+        tree_result, tree_peak, tree_time = measure(
+            lambda: extractor.scan(parse(io.BytesIO(xml)).getroot()))
+        stream_result, stream_peak, stream_time = measure(
+            lambda: extractor.scan_stream(io.BytesIO(xml)))
+        assert tree_result == stream_result
+        print(f"{len(xml) / 2**20:>7.1f} {tree_peak / 2**20:>9.1f} {stream_peak / 2**20:>10.1f}"
+              f" {tree_time:>8.2f} {stream_time:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
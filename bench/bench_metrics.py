@@ -0,0 +1,56 @@
+import contextlib
+import io
+import os
+import sys
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from parse import xml_to_csv
+from metrics import Metrics
+from synth import make_bulk_zip
+
+# 計測なし・計測あり・標本の cProfile/tracemalloc ありで xml_to_csv の速度を比べる
+# 使い方: python bench/bench_metrics.py [件数] [繰り返し回数]
+
+COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+REPEAT = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+
+def run(zip_path, work, metrics):
+    output = os.path.join(work, 'out')
+    shutil.rmtree(output, ignore_errors=True)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        xml_to_csv(zip_path, output, workers=1, incremental=False, metrics=metrics)
+    return time.perf_counter() - start
+
+
+def main():
+    work = tempfile.mkdtemp()
+    try:
+        zip_path = os.path.join(work, 'input.zip')
+        make_bulk_zip(zip_path, COUNT, seed=0)
+        cases = {
+            'disabled': lambda: None,
+            'enabled': lambda: Metrics(),
+            'sampled 1/50': lambda: Metrics(sample_every=50, profile_dir=os.path.join(work, 'prof'),
+                                           trace_memory=True),
+        }
+        best = {}
+        for _ in range(REPEAT):
+            for name, make in cases.items():
+                seconds = run(zip_path, work, make())
+                best[name] = min(best.get(name, seconds), seconds)
+        base = best['disabled']
+        print(f"{COUNT} documents, best of {REPEAT}")
+        for name, seconds in best.items():
+            print(f"  {name:<14} {seconds:7.3f} s  {COUNT / seconds:8.1f} docs/s  {seconds / base - 1:+7.1%}")
+    finally:
+        shutil.rmtree(work)
+
+
+if __name__ == "__main__":
+    main()
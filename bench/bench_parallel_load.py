@@ -0,0 +1,139 @@
+import contextlib
+import io
+import os
+import sys
+import threading
+import time
+
+import psycopg2
+from psycopg2.extensions import make_dsn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import csv_to_db
+from bench_db import make_rows
+
+# csv_to_db.parallel_load の接続数ごとの速度を測り、結果が1接続の bulk_load と同じになることを確かめる
+# 使い方: PGDSN="host=localhost dbname=test user=postgres" python bench/bench_parallel_load.py [行数]
+# テーブルは bench_parallel スキーマに作り、終了時にスキーマごと消す
+#
+# 確かめること:
+#   - 同じ公開番号の古い版を先に流しても、最後の版が残る（公開番号ごとの順序が保たれる）
+#   - 各テーブルの内容（md5）が接続数によらず同じ
+#   - 投入中に接続を1つ切断しても、そのバッチをやり直して同じ結果になる
+
+SCHEMA = 'bench_parallel'
+CONNECTIONS = (1, 2, 4, 8)
+TITLE = 7
+
+
+def create_tables(connection):
+    # bench_db.create_tables と同じ形の通常のテーブル（複数の接続から見えるようにする）
+    with connection, connection.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cur.execute(f"CREATE SCHEMA {SCHEMA}")
+        for table, cols in csv_to_db.TABLE_COLUMNS.items():
+            defs = []
+            for i, col in enumerate(cols):
+                kind = "integer" if table == 'pupa_application_basic_info' and col in (9, 10) else "text"
+                defs.append(f"c{i} {kind}")
+            cur.execute(f"CREATE TABLE {SCHEMA}.{table} ({', '.join(defs)})")
+
+
+def make_input(count):
+    # 元の行の公開番号を変えて count 件にし、1割の行は題名の違う古い版を先に流す
+    base = make_rows(min(count, 500))
+    final = []
+    for i in range(count):
+        row = list(base[i % len(base)])
+        row[3] = f"{row[3]}-{i:07d}"
+        final.append(row)
+    stale = []
+    for row in final[::10]:
+        old = list(row)
+        old[TITLE] = "古い版"
+        stale.append(old)
+    return stale + final, final
+
+
+def checksums(connection, tables):
+    sums = {}
+    with connection.cursor() as cur:
+        for table in tables:
+            key = csv_to_db._key_column(cur, table)
+            if table == csv_to_db.APPLICATION_CODE_TABLE:
+                # コード番号は投入の順で変わるため、コードの文字列に戻して比べる
+                cur.execute(f"SELECT md5(string_agg(t.{key} || ':' || ("
+                            f"SELECT string_agg(c.code, ',' ORDER BY u.n) FROM unnest(t.fterm) WITH ORDINALITY u(id, n)"
+                            f" JOIN {csv_to_db.CODE_TABLE} c ON c.code_id = u.id), ',' ORDER BY t.{key}))"
+                            f" FROM {table} t")
+            else:
+                cur.execute(f"SELECT md5(string_agg(t::text, '|' ORDER BY t::text)) FROM {table} t")
+            sums[table] = cur.fetchone()[0]
+        cur.execute("SELECT count(*) FROM pupa_application_basic_info WHERE c7 = '古い版'")
+        sums['stale'] = cur.fetchone()[0]
+    return sums
+
+
+def kill_one_backend(dsn, delay):
+    # 投入中の接続を1つ切断する（一時的なエラーからのやり直しを確かめる）
+    time.sleep(delay)
+    connection = psycopg2.connect(dsn)
+    with connection, connection.cursor() as cur:
+        cur.execute("SELECT pg_terminate_backend(pid) FROM pg_stat_activity"
+                    " WHERE pid <> pg_backend_pid() AND datname = current_database()"
+                    " AND state <> 'idle' AND query ILIKE '%COPY%' LIMIT 1")
+    connection.close()
+
+
+def run(dsn, rows, connections, kill=False):
+    connection = psycopg2.connect(dsn)
+    create_tables(connection)
+    for table in (csv_to_db.PARTY_TABLE, csv_to_db.APPLICATION_CODE_TABLE, csv_to_db.CODE_TABLE):
+        with connection, connection.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {table}")
+    killer = threading.Thread(target=kill_one_backend, args=(dsn, 0.5)) if kill else None
+    if killer is not None:
+        killer.start()
+    out = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(out):
+        if connections == 1 and not kill:
+            csv_to_db.bulk_load(connection, rows, parties=True, codes=True)
+        else:
+            csv_to_db.parallel_load(dsn, rows, connections, parties=True, codes=True)
+    elapsed = time.perf_counter() - start
+    if killer is not None:
+        killer.join()
+    sums = checksums(connection, csv_to_db.load_tables(parties=True, codes=True))
+    connection.close()
+    return elapsed, sums, out.getvalue().count("Retrying")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    dsn = make_dsn(os.environ.get("PGDSN", "dbname=postgres"), options=f"-c search_path={SCHEMA},public")
+    rows, final = make_input(count)
+    print(f"{len(final)} publications ({len(rows) - len(final)} stale versions first), "
+          f"server: {os.cpu_count()} local CPUs")
+    try:
+        baseline = None
+        for connections in CONNECTIONS:
+            elapsed, sums, _ = run(dsn, rows, connections)
+            baseline = baseline or (elapsed, sums)
+            assert sums['stale'] == 0, "古い版が残っている"
+            assert sums == baseline[1], f"{connections} 接続の結果が1接続と違う"
+            print(f"  {connections} connections: {len(rows) / elapsed:8.0f} rows/s ({baseline[0] / elapsed:.2f}x)")
+        elapsed, sums, retried = run(dsn, rows, 4, kill=True)
+        assert sums == baseline[1], "切断からやり直した結果が1接続と違う"
+        print(f"  4 connections, one backend killed: {len(rows) / elapsed:8.0f} rows/s, {retried} batch retried")
+    finally:
+        connection = psycopg2.connect(dsn)
+        with connection, connection.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import PyPDF2
+from pdfpages import fast_page_count, page_count
+from synth import make_pdf
+
+# PyPDF2 で全体を読む従来の方法と trailer/ページツリーだけを読む方法を比較する
+
+
+def pypdf2_page_count(path):
+    with open(path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+
+def timeit(func, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    work = tempfile.mkdtemp()
+    try:
+        print(f"{'pages':>6} {'MB':>6} {'PyPDF2 ms':>10} {'fast ms':>8} {'cached ms':>10}")
+        for pages, page_bytes in ((100, 20000), (300, 50000), (800, 50000)):
+            path = os.path.join(work, f"{pages}.pdf")
+            with open(path, 'wb') as f:
+                f.write(make_pdf(pages, page_bytes))
+            assert pypdf2_page_count(path) == fast_page_count(path) == pages
+            legacy = timeit(lambda: pypdf2_page_count(path))
+            fast = timeit(lambda: fast_page_count(path))
+            page_count(path)
+            cached = timeit(lambda: page_count(path))
+            size = os.path.getsize(path) / 2**20
+            print(f"{pages:>6} {size:>6.1f} {legacy * 1000:>10.2f} {fast * 1000:>8.3f} {cached * 1000:>10.4f}")
+    finally:
+        shutil.rmtree(work)
+
+
+if __name__ == "__main__":
+    main()
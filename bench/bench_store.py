@@ -0,0 +1,157 @@
+import contextlib
+import csv
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from xml.etree.ElementTree import fromstring
+from parse import xml_to_csv
+from fields import FIELDS, NAMESPACES, COLUMNS, FieldExtractor, Party
+from store import PublicationStore, main_ipc
+from synth import make_bulk_zip, make_publication
+
+# 公報の保存先（store.py）の読み出しの速さを測り、xml_to_csv の store=True で CSV と同じ行が入ることを確かめる
+# 使い方: python bench/bench_store.py [件数]（数百万件の場合は作るのに数分かかる）
+#
+# 測ること:
+#   - 作る速さとファイルの大きさ
+#   - 公開番号で1件を引く時間の分布（p50 / p99）と、まとめて引く場合の1件あたりの時間
+#   - 出願番号・出願人・IPCで引く時間、公開日の範囲を読む速さ
+
+COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+LOOKUPS = 20000
+
+PUB = COLUMNS.index('publication_number')
+APP = COLUMNS.index('application_number')
+PUB_DATE = COLUMNS.index('publication_date')
+FILING_DATE = COLUMNS.index('filing_date')
+IPC = COLUMNS.index('ipc')
+
+
+def publication_number(i):
+    return f"{2024000000 + i:010d}"
+
+
+def make_rows(count):
+    # 数種類の行をもとに、公開番号・出願番号・日付・IPC・出願人だけを変えた行を順に作る
+    extractor = FieldExtractor(FIELDS, NAMESPACES)
+    templates = []
+    for seed in range(8):
+        results = extractor.scan(fromstring(make_publication(seed=seed, paragraphs=5 + seed * 5)))
+        templates.append(extractor.row(results, 10))
+    rnd = random.Random(0)
+    subclasses = [f"{rnd.choice('ABCDEFGH')}{rnd.randint(1, 99):02d}{rnd.choice('ABCDEFGHJKLMNPQ')}"
+                  for _ in range(600)]
+    for i in range(count):
+        row = list(templates[i % len(templates)])
+        row[PUB] = publication_number(i)
+        row[APP] = f"{2022000000 + i:010d}"
+        # 1日あたり約500件
+        row[PUB_DATE] = f"{2020 + i // 180000:04d}{1 + i // 15000 % 12:02d}{1 + i // 500 % 28:02d}"
+        row[FILING_DATE] = f"{2018 + i // 180000:04d}{1 + i // 15000 % 12:02d}{1 + i // 500 % 28:02d}"
+        row[IPC] = f"{rnd.choice(subclasses)}  {rnd.randint(1, 40):2d}/00        20060101AFI20240101BHJP"
+        parties = [Party('applicant', k + 1, f"{rnd.randint(0, 99999):09d}", f"株式会社テスト{k}", "東京都")
+                   for k in range(rnd.randint(1, 3))]
+        yield row, parties
+
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def check_output(work):
+    # xml_to_csv の store=True で、保存先の行が出願番号ごとのCSVの行と同じになることを確かめる
+    zip_path = os.path.join(work, 'input.zip')
+    output = os.path.join(work, 'output')
+    make_bulk_zip(zip_path, 200, seed=3, pages=(1, 3), page_bytes=100)
+    with contextlib.redirect_stdout(io.StringIO()):
+        xml_to_csv(zip_path, output, workers=1, store=True)
+    store = PublicationStore.in_directory(output, readonly=True)
+    count = 0
+    for name in os.listdir(output):
+        if not name.endswith('.csv'):
+            continue
+        with open(os.path.join(output, name), encoding='utf-8', newline='') as f:
+            for row in csv.reader(f):
+                record = store.get(row[PUB])
+                assert record is not None, f"{row[PUB]} が保存先に無い"
+                assert ["" if v is None else str(v) for v in record.row] == row, f"{row[PUB]} の行が違う"
+                assert row[PUB] in [r.row[PUB] for r in store.by_application(row[APP])]
+                count += 1
+    assert count == len(store)
+    print(f"  xml_to_csv(store=True) of 200 documents: {count} publications, same rows as the CSV")
+    store.close()
+
+
+def main():
+    work = tempfile.mkdtemp()
+    try:
+        check_output(work)
+
+        store = PublicationStore.in_directory(work)
+        start = time.perf_counter()
+        for row, parties in make_rows(COUNT):
+            store.add(row, parties)
+        store.close()
+        build = time.perf_counter() - start
+        size = os.path.getsize(store.path)
+        print(f"  {COUNT} publications: build {COUNT / build:.0f} docs/s, {size / 2**20:.0f} MB"
+              f" ({size / COUNT / 1024:.1f} KB/doc)")
+
+        store = PublicationStore.in_directory(work, readonly=True)
+        rnd = random.Random(1)
+        keys = [publication_number(rnd.randrange(COUNT)) for _ in range(LOOKUPS)]
+        # ページを一度読んでから測る
+        for key in keys[:1000]:
+            store.get(key)
+        samples = []
+        for key in keys:
+            t = time.perf_counter()
+            record = store.get(key)
+            samples.append(time.perf_counter() - t)
+            assert record.row[PUB] == key
+        samples.sort()
+        print(f"  get: p50 {percentile(samples, 0.5) * 1e6:.0f} us, p99 {percentile(samples, 0.99) * 1e6:.0f} us,"
+              f" max {samples[-1] * 1e6:.0f} us")
+
+        t = time.perf_counter()
+        records = store.get_many(keys)
+        seconds = time.perf_counter() - t
+        assert [r.row[PUB] for r in records] == keys
+        print(f"  get_many({len(keys)}): {seconds * 1e6 / len(keys):.0f} us/doc")
+
+        record = store.get(keys[0])
+        for name, run in (
+                ('by_application', lambda: list(store.by_application(record.row[APP]))),
+                ('by_applicant', lambda: list(store.by_applicant(record.parties[0].identifier))),
+                ('by_ipc', lambda: list(store.by_ipc(main_ipc(record.row[IPC])))),
+                ('by_ipc (subclass)', lambda: list(store.by_ipc(main_ipc(record.row[IPC])[:4], prefix=True)))):
+            t = time.perf_counter()
+            found = run()
+            print(f"  {name}: {len(found)} docs, {(time.perf_counter() - t) * 1000:.2f} ms")
+            assert any(r.row[PUB] == keys[0] for r in found)
+
+        day = record.row[PUB_DATE]
+        t = time.perf_counter()
+        found = list(store.between('publication_date', day[:6] + '01', day[:6] + '31'))
+        seconds = time.perf_counter() - t
+        assert all(r.row[PUB_DATE][:6] == day[:6] for r in found)
+        print(f"  between (1 month of publication_date): {len(found)} docs, {seconds * 1000:.1f} ms"
+              f" ({len(found) / seconds:.0f} docs/s)")
+        t = time.perf_counter()
+        numbers = list(store.between('publication_date', day[:6] + '01', day[:6] + '31', numbers=True))
+        assert numbers == [r.row[PUB] for r in found]
+        print(f"  between (numbers only): {(time.perf_counter() - t) * 1000:.1f} ms")
+        store.close()
+    finally:
+        shutil.rmtree(work)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import os
+import csv
+import sys
+import glob
+import random
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from xml.etree.ElementTree import fromstring
+from fields import FIELDS, NAMESPACES, COLUMNS, FieldExtractor
+from sinks import PerApplicationSink
+from textindex import TextIndex, SECTIONS, normalize
+from synth import make_publication, make_vocabulary, _WORDS
+
+# CSVを読んで部分文字列を探す従来の方法と、2-gram 索引での検索を比較する
+# 使い方: python bench/bench_textindex.py [件数]
+# 既定の15語の語彙（どの2文字の組もほぼ全文書に現れる最悪の場合）と、5000語の語彙の両方で測る
+
+EMBODIMENT = COLUMNS.index('embodiment')
+
+
+def scan_csv(directory, query):
+    query = normalize(query)
+    columns = [COLUMNS.index(name) for name in SECTIONS]
+    found = []
+    for path in glob.glob(os.path.join(directory, '*.csv')):
+        with open(path, encoding='utf-8', newline='') as f:
+            for row in csv.reader(f):
+                names = [SECTIONS[i] for i, c in enumerate(columns) if query in normalize(row[c])]
+                if names:
+                    found.append((row[COLUMNS.index('publication_number')], names))
+    return sorted(found)
+
+
+def check_merge(vocab):
+    # セグメントをまとめた後も、置き換え・取り除いた文書を含めて CSV を読む方法と同じ結果になることを確かめる
+    work = tempfile.mkdtemp()
+    try:
+        extractor = FieldExtractor(FIELDS, NAMESPACES)
+        index = TextIndex.in_directory(work, flush_docs=10, merge_segments=3)
+        rnd = random.Random(1)
+        rows = {}
+        for i in range(300):
+            row = extractor.row(extractor.scan(fromstring(make_publication(seed=i, paragraphs=3, vocab=vocab))), 10)
+            # 公開番号を60件に絞り、置き換えと取り除きを起こす
+            row[COLUMNS.index('publication_number')] = f"P{rnd.randrange(60):03d}"
+            if rnd.random() < 0.2:
+                index.remove(None, row[COLUMNS.index('publication_number')])
+                rows.pop(row[COLUMNS.index('publication_number')], None)
+                continue
+            index.write(None, row)
+            rows[row[COLUMNS.index('publication_number')]] = row
+        queries = [row[EMBODIMENT][10:10 + n] for row, n in zip(rows.values(), (1, 2, 3, 5, 8))]
+        for label in ("merged", "optimized"):
+            if label == "optimized":
+                index.optimize()
+            levels = index.db.execute("SELECT level FROM segments ORDER BY segment").fetchall()
+            for query in queries:
+                expected = sorted(
+                    (number, names) for number, names in
+                    ((number, [name for name in SECTIONS
+                               if normalize(query) in normalize(row[COLUMNS.index(name)])])
+                     for number, row in rows.items()) if names)
+                assert index.search(query) == expected, (label, query)
+            print(f"  {label}: segments at levels {[r[0] for r in levels]}, same results as scanning the rows")
+        index.close()
+    finally:
+        shutil.rmtree(work)
+
+
+def run(count, vocab, label):
+    work = tempfile.mkdtemp()
+    try:
+        extractor = FieldExtractor(FIELDS, NAMESPACES)
+        sink = PerApplicationSink(work)
+        index = TextIndex.in_directory(work)
+        rnd = random.Random(0)
+        queries = []
+        build = 0.0
+        for i in range(count):
+            xml = make_publication(seed=i, paragraphs=30, vocab=vocab)
+            row = extractor.row(extractor.scan(fromstring(xml)), 10)
+            sink.write(row[COLUMNS.index('application_number')], row)
+            start = time.perf_counter()
+            index.write(None, row)
+            build += time.perf_counter() - start
+            if len(queries) < 4 and rnd.random() < 0.01:
+                # 本文から切り出した2～8文字を検索語にする
+                text = row[EMBODIMENT]
+                length = 2 + 2 * len(queries)
+                p = rnd.randrange(len(text) - length)
+                queries.append(text[p:p + length])
+        start = time.perf_counter()
+        index.flush()
+        build += time.perf_counter() - start
+        csv_size = sum(os.path.getsize(p) for p in glob.glob(os.path.join(work, '*.csv')))
+        print(f"{label}: {count} patents, CSV {csv_size / 2**20:.1f} MB")
+        print(f"index build: {build:.2f} s ({count / build:.0f} patents/s), "
+              f"{os.path.getsize(index.path) / 2**20:.1f} MB")
+
+        print(f"{'query':<12} {'hits':>6} {'CSV scan ms':>12} {'index ms':>9}")
+        for query in queries:
+            start = time.perf_counter()
+            expected = scan_csv(work, query)
+            scan = time.perf_counter() - start
+            start = time.perf_counter()
+            found = index.search(query)
+            search = time.perf_counter() - start
+            assert found == expected, query
+            print(f"{len(query):>2} chars {len(found):>10} {scan * 1000:>12.1f} {search * 1000:>9.1f}")
+        index.close()
+    finally:
+        shutil.rmtree(work)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    csv.field_size_limit(2**31 - 1)
+    check_merge(_WORDS)
+    run(count, _WORDS, "15 words")
+    run(count, make_vocabulary(), "5000 words")
+
+
+if __name__ == "__main__":
+    main()
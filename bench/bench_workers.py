@@ -0,0 +1,51 @@
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from parse import xml_to_csv
+from synth import make_publication
+
+# xml_to_csv のプロセス数ごとのスループットを測る
+
+
+def make_corpus(directory, count, paragraphs):
+    for i in range(count):
+        d = os.path.join(directory, f"{i:06d}")
+        os.makedirs(d)
+        with open(os.path.join(d, f"{i:06d}.xml"), 'wb') as f:
+            f.write(make_publication(seed=i, paragraphs=paragraphs))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    paragraphs = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    cpus = os.cpu_count() or 1
+    counts = sorted({1, 2, 4, 8, cpus} & set(range(1, cpus + 1)))
+
+    work = tempfile.mkdtemp()
+    try:
+        ipt = os.path.join(work, "xml")
+        make_corpus(ipt, count, paragraphs)
+        print(f"{count} documents, {paragraphs} paragraphs each, {cpus} CPUs")
+        print(f"{'workers':>8} {'seconds':>8} {'docs/s':>8} {'scaling':>8}")
+        base = None
+        for workers in counts:
+            opt = os.path.join(work, f"csv{workers}")
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                xml_to_csv(ipt, opt, workers=workers)
+            elapsed = time.perf_counter() - start
+            base = base or elapsed
+            print(f"{workers:>8} {elapsed:>8.2f} {count / elapsed:>8.1f} {base / elapsed:>7.2f}x")
+    finally:
+        shutil.rmtree(work)
+
+
+if __name__ == "__main__":
+    main()
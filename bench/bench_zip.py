@@ -0,0 +1,109 @@
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from parse import redrive, xml_to_csv
+from quarantine import Quarantine
+from synth import make_bulk_zip, make_pdf, make_publication
+
+# ZIPを展開してから解析する従来の方法と、ZIPから直接読む方法を比較する
+# 使い方: python bench/bench_zip.py [件数]
+
+
+def make_zip(path, count):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for i in range(count):
+            zf.writestr(f"JPA_{i:06d}/JPA_{i:06d}.xml", make_publication(seed=i))
+            zf.writestr(f"JPA_{i:06d}/JPA_{i:06d}.pdf", make_pdf(pages=5, page_bytes=40000, seed=i))
+
+
+def disk_usage(directory):
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def run(zip_path, out, extract):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        xml_to_csv(zip_path, out, workers=1, incremental=False, extract=extract)
+    return time.perf_counter() - start, disk_usage(out)
+
+
+def check_nested(work):
+    # 入れ子のZIP（一括ダウンロードの形）でも、展開してから解析する方法と直接読む方法で同じ件数・同じ行になることを確かめる
+    zip_path = os.path.join(work, "nested.zip")
+    make_bulk_zip(zip_path, 40, seed=5, pages=(1, 3), page_bytes=100, per_zip=8)
+    counts = {}
+    rows = {}
+    for extract in (True, False):
+        out = os.path.join(work, f"nested-{extract}")
+        with contextlib.redirect_stdout(io.StringIO()):
+            counts[extract] = xml_to_csv(zip_path, out, workers=1, incremental=False, extract=extract)
+        rows[extract] = sorted(line for name in os.listdir(out) if name.endswith('.csv')
+                               for line in open(os.path.join(out, name), encoding='utf-8'))
+    assert counts[True] == counts[False] and counts[True]['ok'] > 0, counts
+    assert rows[True] == rows[False]
+    print(f"nested ZIP: extract and direct both give {counts[True]['ok']} accepted, {counts[True]['skip']} skipped")
+
+
+def check_redrive_extracted(work):
+    # 展開してから解析する場合も、入れ子のZIPの中で処理できなかった文書を隔離し、redrive で処理し直せることを確かめる
+    zip_path = os.path.join(work, "broken.zip")
+    inner = io.BytesIO()
+    with zipfile.ZipFile(inner, 'w') as zf:
+        for i in range(3):
+            xml = make_publication(seed=100 + i)
+            zf.writestr(f"JPA_{i:06d}/JPA_{i:06d}.xml", xml[:len(xml) // 2] if i == 1 else xml)
+            zf.writestr(f"JPA_{i:06d}/JPA_{i:06d}.pdf", make_pdf(pages=2, page_bytes=100, seed=i))
+    with zipfile.ZipFile(zip_path, 'w') as zf:
+        zf.writestr("DATA/inner.zip", inner.getvalue())
+    out = os.path.join(work, "broken")
+    with contextlib.redirect_stdout(io.StringIO()):
+        counts = xml_to_csv(zip_path, out, workers=1, extract=True)
+    assert counts['error'] == 1 and counts['ok'] + counts['skip'] == 2, counts
+    quarantine = Quarantine.in_directory(out)
+    documents = quarantine.documents()
+    assert len(documents) == 1 and documents[0].name == "JPA_000001.xml", documents
+    quarantine.close()
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert redrive(out, workers=1)['error'] == 1
+    # 隔離した写しを直してから処理し直す
+    with open(documents[0], 'wb') as f:
+        f.write(make_publication(seed=101))
+    with contextlib.redirect_stdout(io.StringIO()):
+        redriven = redrive(out, workers=1)
+    quarantine = Quarantine.in_directory(out)
+    assert redriven['ok'] + redriven['skip'] == 1 and quarantine.counts() == (0, 0), (redriven, quarantine.counts())
+    quarantine.close()
+    print("nested ZIP with a broken document: quarantined in extract mode and redriven")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    work = tempfile.mkdtemp()
+    try:
+        check_nested(work)
+        check_redrive_extracted(work)
+        zip_path = os.path.join(work, "input.zip")
+        make_zip(zip_path, count)
+        print(f"ZIP: {count} patents, {os.path.getsize(zip_path) / 2**20:.1f} MB")
+        legacy, legacy_bytes = run(zip_path, os.path.join(work, "extract"), extract=True)
+        direct, direct_bytes = run(zip_path, os.path.join(work, "direct"), extract=False)
+        print(f"extract + parse: {legacy:.2f} s, {legacy_bytes / 2**20:.1f} MB written")
+        print(f"direct from ZIP: {direct:.2f} s, {direct_bytes / 2**20:.1f} MB written ({legacy / direct:.2f}x)")
+    finally:
+        shutil.rmtree(work)
+
+
+if __name__ == "__main__":
+    main()
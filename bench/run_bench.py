@@ -0,0 +1,266 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import pickle
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from xml.etree.ElementTree import parse
+
+try:
+    import resource
+except ImportError:  # Windows ではピークRSSを測らない
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'app'))
+
+from synth import make_bulk_zip
+
+# 合成の一括ダウンロードZIPを作り、処理の段階ごとに 件数/秒・MB/秒・ピークRSS を測る
+# 使い方: python bench/run_bench.py [--count 500] [--workers 4] [--compare 前回の結果.json]
+# PGDSN="host=localhost dbname=test user=postgres" を指定すると db の段階も測る（一時テーブルを使う）
+# 結果は bench/results/ に JSON で保存する
+#
+# 段階:
+#   unzip    : unzip.extract_zip でZIPを展開する（MB は ZIP の大きさ）
+#   parse    : 展開したXMLを1件ずつ読み、全列を取り出す（MB は XML の大きさ）
+#   pdf      : 展開したPDFのページ数を求める（キャッシュは使わない。MB は PDF の大きさ）
+#   csv      : parse の行を出願番号ごとのCSVに書く（MB は書いたCSVの大きさ）
+#   db       : parse の行を csv_to_db.bulk_load で投入する（MB は値の大きさ）
+#   pipeline : xml_to_csv でZIPから直接CSVまで通して変換する（MB は ZIP の大きさ）
+# 各段階は新しいプロセスで動かすため、ピークRSSは段階ごとの値になる（前の段階の行を読み込んだ分を含む）
+
+STAGES = ('unzip', 'parse', 'pdf', 'csv', 'db', 'pipeline')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+
+def _size(paths):
+    return sum(os.path.getsize(p) for p in paths)
+
+
+def stage_unzip(work, options):
+    from unzip import extract_zip
+    extract_zip(work / 'input.zip', work / 'extracted')
+    # 入れ子のZIPは展開した場所でさらに展開する
+    inner = list((work / 'extracted').glob('**/*.zip'))
+    while inner:
+        for path in inner:
+            extract_zip(path, path.with_suffix(''))
+            path.unlink()
+        inner = list((work / 'extracted').glob('**/*.zip'))
+    documents = sum(1 for _ in (work / 'extracted').glob('**/*.xml'))
+    return documents, os.path.getsize(work / 'input.zip')
+
+
+def stage_parse(work, options):
+    from fields import FIELDS, NAMESPACES, FieldExtractor
+    extractor = FieldExtractor(FIELDS, NAMESPACES)
+    paths = sorted((work / 'extracted').glob('**/*.xml'))
+    rows = []
+    for path in paths:
+        results = extractor.scan(parse(path).getroot())
+        rows.append((extractor.application_number(results), extractor.row(results, 0)))
+    return len(paths), _size(paths), rows
+
+
+def stage_pdf(work, options):
+    from parse import get_pdf_page_count
+    import pdfpages
+    pdfpages._cached_page_count.cache_clear()
+    pdfpages._cached_listing.cache_clear()
+    paths = sorted((work / 'extracted').glob('**/*.pdf'))
+    for path in paths:
+        get_pdf_page_count(path.parent)
+    return len(paths), _size(paths)
+
+
+def stage_csv(work, options):
+    from sinks import PerApplicationSink
+    rows = _load_rows(work)
+    start = time.perf_counter()
+    sink = PerApplicationSink(work / 'csv')
+    for csv_name, row in rows:
+        sink.write(csv_name, row)
+    sink.close()
+    return len(rows), _size((work / 'csv').glob('*.csv')), start
+
+
+def stage_db(work, options):
+    import psycopg2
+    import csv_to_db
+    from bench_db import create_tables
+    rows = [[str(v) for v in row] for _, row in _load_rows(work)]
+    connection = psycopg2.connect(options['dsn'])
+    create_tables(connection)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        csv_to_db.bulk_load(connection, rows)
+    connection.close()
+    return len(rows), sum(len(v.encode('utf-8')) for row in rows for v in row), start
+
+
+def stage_pipeline(work, options):
+    from parse import xml_to_csv
+    with contextlib.redirect_stdout(io.StringIO()):
+        counts = xml_to_csv(str(work / 'input.zip'), str(work / 'pipeline'),
+                            workers=options['workers'], incremental=False)
+    return sum(counts.values()), os.path.getsize(work / 'input.zip')
+
+
+def _load_rows(work):
+    with open(work / 'rows.pickle', 'rb') as f:
+        return pickle.load(f)
+
+
+def _peak_rss(who):
+    # ピークRSS（MB）。Linux は KB、macOS はバイトで返る
+    if resource is None:
+        return None
+    if who == resource.RUSAGE_SELF and os.path.exists('/proc/self/status'):
+        # ru_maxrss は exec の前の値を引き継ぐため、Linux ではこのプロセス自身の値（VmHWM）を読む
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2**10
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (2**20 if sys.platform == 'darwin' else 2**10)
+
+
+def _run_stage(name, work, options, results):
+    # 新しいプロセスの中で1つの段階を動かす
+    work = Path(work)
+    os.chdir(work)  # unzip.log などは作業ディレクトリに書く
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        outcome = globals()[f'stage_{name}'](work, options)
+    elapsed = time.perf_counter() - start
+    documents, size = outcome[:2]
+    if name == 'parse':
+        # 行の保存は測らない
+        with open(work / 'rows.pickle', 'wb') as f:
+            pickle.dump(outcome[2], f)
+    elif len(outcome) > 2:
+        # 前の段階の行を読み込む時間は測らない
+        elapsed = time.perf_counter() - outcome[2]
+    results.put({
+        'seconds': elapsed,
+        'documents': documents,
+        'bytes': size,
+        'docs_per_s': documents / elapsed if elapsed else None,
+        'mb_per_s': size / 2**20 / elapsed if elapsed else None,
+        'peak_rss_mb': _peak_rss(resource.RUSAGE_SELF) if resource else None,
+        'workers_peak_rss_mb': _peak_rss(resource.RUSAGE_CHILDREN) if resource else None,
+    })
+
+
+def run_stage(name, work, options):
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    process = ctx.Process(target=_run_stage, args=(name, str(work), options, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_stages(stages, previous=None):
+    print(f"{'stage':<9} {'docs':>6} {'docs/s':>9} {'MB/s':>8} {'peak RSS MB':>12} {'workers MB':>11}"
+          + (f" {'vs previous':>12}" if previous else ""))
+    for name, r in stages.items():
+        rss = f"{r['peak_rss_mb']:.0f}" if r['peak_rss_mb'] is not None else "-"
+        workers = f"{r['workers_peak_rss_mb']:.0f}" if r['workers_peak_rss_mb'] else "-"
+        line = (f"{name:<9} {r['documents']:>6} {r['docs_per_s']:>9.1f} {r['mb_per_s']:>8.1f}"
+                f" {rss:>12} {workers:>11}")
+        old = (previous or {}).get(name)
+        if old and old.get('docs_per_s'):
+            line += f" {r['docs_per_s'] / old['docs_per_s']:>11.2f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="段階ごとの処理速度とピークRSSを測る")
+    parser.add_argument('--count', type=int, default=500, help="公報の数")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help="pipeline の解析に使うプロセス数")
+    parser.add_argument('--paragraphs', type=int, nargs=2, default=(10, 80), help="段落数の範囲")
+    parser.add_argument('--pages', type=int, nargs=2, default=(3, 30), help="PDFのページ数の範囲")
+    parser.add_argument('--per-zip', type=int, default=0, help="この件数ごとに入れ子のZIPにまとめる")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--output', help="結果のJSONファイル（既定は bench/results/<日時>.json）")
+    parser.add_argument('--compare', help="比べる前回の結果のJSONファイル")
+    args = parser.parse_args()
+
+    options = {'workers': args.workers, 'dsn': os.environ.get('PGDSN')}
+    stages = [s for s in args.stages if s != 'db' or options['dsn']]
+    if 'db' in args.stages and not options['dsn']:
+        print("PGDSN が無いため db は測りません")
+
+    work = Path(tempfile.mkdtemp())
+    try:
+        corpus = {'count': args.count, 'seed': args.seed, 'paragraphs': list(args.paragraphs),
+                  'pages': list(args.pages), 'per_zip': args.per_zip}
+        corpus['designations'] = make_bulk_zip(
+            work / 'input.zip', args.count, seed=args.seed, paragraphs=tuple(args.paragraphs),
+            pages=tuple(args.pages), per_zip=args.per_zip)
+        corpus['zip_bytes'] = os.path.getsize(work / 'input.zip')
+        print(f"corpus: {args.count} publications, {corpus['zip_bytes'] / 2**20:.1f} MB ZIP")
+
+        # parse 以降は展開済みのファイルと parse の行を使う
+        needed = set(stages)
+        if needed & {'parse', 'pdf', 'csv', 'db'}:
+            needed.add('unzip')
+        if needed & {'csv', 'db'}:
+            needed.add('parse')
+        results = {}
+        for name in STAGES:
+            if name in needed:
+                results[name] = run_stage(name, work, options)
+        results = {name: r for name, r in results.items() if name in stages}
+    finally:
+        shutil.rmtree(work)
+
+    report = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'workers': args.workers,
+        'corpus': corpus,
+        'stages': results,
+    }
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)['stages']
+    print_stages(results, previous)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"saved: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import io
+import random
+import zipfile
+import collections
+from xml.sax.saxutils import escape
+
+# ベンチマーク用の合成ST96公報XMLを作る
+
+NS_DECL = (
+    'xmlns:jppat="http://www.jpo.go.jp/standards/XMLSchema/ST96/JPPatent" '
+    'xmlns:com="http://www.wipo.int/standards/XMLSchema/ST96/Common" '
+    'xmlns:pat="http://www.wipo.int/standards/XMLSchema/ST96/Patent" '
+    'xmlns:jpcom="http://www.jpo.go.jp/standards/XMLSchema/ST96/JPCommon" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+)
+
+# 一括ダウンロードに含まれる公報種別とその割合（処理対象外の種別も混ざる）
+DESIGNATION_MIX = (
+    ("公開特許公報(A)", 0.80),
+    ("公表特許公報(A)", 0.10),
+    ("再公表特許(A1)", 0.05),
+    ("特許公報(B)", 0.05),
+)
+
+_WORDS = "本発明 装置 制御部 信号 基板 樹脂 構成 実施形態 前記 第1 第2 により 備える 方法 工程".split()
+
+
+def _sentence(rnd, words=20, vocab=_WORDS):
+    return escape("".join(rnd.choice(vocab) for _ in range(words)) + "。")
+
+
+def _paragraphs(rnd, count, number=1, vocab=_WORDS):
+    parts = []
+    for i in range(count):
+        parts.append(
+            f'<com:P com:pNumber="{number + i:04d}">{_sentence(rnd, vocab=vocab)}'
+            f'<com:B>{_sentence(rnd, 3, vocab=vocab)}</com:B>{_sentence(rnd, vocab=vocab)}'
+            f'<com:Sub>1</com:Sub>{_sentence(rnd, 5, vocab=vocab)}</com:P>'
+        )
+    return "".join(parts)
+
+
+def _contact(rnd, name, address=True):
+    addr = ""
+    if address:
+        addr = (
+            '<com:PostalAddressBag><com:PostalAddress>'
+            f'<com:PostalAddressText>東京都千代田区{rnd.randint(1, 9)}丁目{rnd.randint(1, 30)}番</com:PostalAddressText>'
+            '</com:PostalAddress></com:PostalAddressBag>'
+        )
+    return f'<jpcom:Contact><com:Name><com:EntityName>{name}</com:EntityName></com:Name>{addr}</jpcom:Contact>'
+
+
+def make_publication(seed=0, designation="公開特許公報(A)", applicants=2, agents=2,
+                     inventors=3, claims=10, paragraphs=50, vocab=_WORDS):
+    """
+    合成の公報XMLを作る関数
+
+    Args:
+        seed (int): 乱数の種（同じ値なら同じ文書になる）
+        designation (str): PlainLanguageDesignationText に入れる公報種別
+        applicants (int): 出願人の数
+        agents (int): 代理人の数
+        inventors (int): 発明者の数
+        claims (int): 請求項の数
+        paragraphs (int): 発明を実施するための形態の段落数
+        vocab (list): 本文に使う語（make_vocabulary を参照）
+
+    Returns:
+        bytes: UTF-8 のXML
+    """
+    rnd = random.Random(seed)
+    pub = f"{2024000000 + seed:010d}"
+    app_no = f"{2022000000 + seed:010d}"
+
+    applicant_xml = "".join(
+        f'<jppat:Applicant com:sequenceNumber="{i}">'
+        f'<com:PartyIdentifier>{100000000 + i:09d}</com:PartyIdentifier>'
+        f'{_contact(rnd, f"株式会社テスト{i}")}</jppat:Applicant>'
+        for i in range(1, applicants + 1)
+    )
+    agent_xml = "".join(
+        f'<jppat:RegisteredPractitioner com:sequenceNumber="{i}">'
+        f'<pat:RegisteredPractitionerRegistrationNumber>{110000000 + i}</pat:RegisteredPractitionerRegistrationNumber>'
+        f'{_contact(rnd, f"弁理士{i}", address=False)}</jppat:RegisteredPractitioner>'
+        for i in range(1, agents + 1)
+    )
+    inventor_xml = "".join(
+        f'<jppat:Inventor com:sequenceNumber="{i}">{_contact(rnd, f"発明者{i}")}</jppat:Inventor>'
+        for i in range(1, inventors + 1)
+    )
+    claim_xml = "".join(
+        f'<pat:Claim com:claimNumber="{i}"><pat:ClaimText>{_sentence(rnd, 40, vocab=vocab)}</pat:ClaimText></pat:Claim>'
+        for i in range(1, claims + 1)
+    )
+
+    xml = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<jppat:PatentPublication {NS_DECL}>'
+        '<jppat:UnexaminedPatentPublicationBibliographicData>'
+        '<jppat:PublicationIdentification>'
+        f'<pat:PublicationNumber>{pub}</pat:PublicationNumber>'
+        f'<com:PublicationDate>2024-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}</com:PublicationDate>'
+        '</jppat:PublicationIdentification>'
+        f'<pat:PlainLanguageDesignationText>{designation}</pat:PlainLanguageDesignationText>'
+        '<jppat:ApplicationIdentification>'
+        f'<com:ApplicationNumber><com:ApplicationNumberText>{app_no}</com:ApplicationNumberText></com:ApplicationNumber>'
+        f'<pat:FilingDate>2022-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}</pat:FilingDate>'
+        '</jppat:ApplicationIdentification>'
+        f'<pat:InventionTitle>{_sentence(rnd, 4, vocab=vocab)}</pat:InventionTitle>'
+        '<jppat:IPCClassification><pat:MainClassification>H01L  21/00        20060101AFI20240101BHJP</pat:MainClassification></jppat:IPCClassification>'
+        '<jppat:NationalClassification><pat:MainClassification>H01L21/00</pat:MainClassification>'
+        '<pat:FurtherClassification>H01L21/02</pat:FurtherClassification></jppat:NationalClassification>'
+        '<jppat:ThemeCodeInformationBag><jppat:ThemeCodeInformation>5F045</jppat:ThemeCodeInformation></jppat:ThemeCodeInformationBag>'
+        '<jppat:FtermInformationBag><jppat:FtermInformation>5F045AA01</jppat:FtermInformation></jppat:FtermInformationBag>'
+        f'<jppat:ClaimTotalQuantitySet><pat:ClaimTotalQuantity>{claims}</pat:ClaimTotalQuantity></jppat:ClaimTotalQuantitySet>'
+        '<jppat:PartyBag>'
+        f'<jppat:ApplicantBag>{applicant_xml}</jppat:ApplicantBag>'
+        f'<jppat:InventorBag>{inventor_xml}</jppat:InventorBag>'
+        f'<jppat:RegisteredPractitionerBag>{agent_xml}</jppat:RegisteredPractitionerBag>'
+        '</jppat:PartyBag>'
+        '</jppat:UnexaminedPatentPublicationBibliographicData>'
+        f'<pat:Abstract>{_paragraphs(rnd, 2, vocab=vocab)}</pat:Abstract>'
+        f'<pat:Claims>{claim_xml}</pat:Claims>'
+        '<jppat:Description>'
+        f'<pat:TechnicalField>{_paragraphs(rnd, 1, vocab=vocab)}</pat:TechnicalField>'
+        f'<pat:BackgroundArt>{_paragraphs(rnd, 3, vocab=vocab)}</pat:BackgroundArt>'
+        '<com:CitationBag>'
+        '<com:PatentCitationBag><com:P><com:PatentCitation><com:PatentCitationText>特開2020-000001号公報</com:PatentCitationText></com:PatentCitation></com:P></com:PatentCitationBag>'
+        '<com:NPLCitationBag><com:P><com:NPLCitation><com:NPLCitationText>テスト文献</com:NPLCitationText></com:NPLCitation></com:P></com:NPLCitationBag>'
+        '</com:CitationBag>'
+        '<pat:InventionSummary>'
+        f'<pat:TechnicalProblem>{_paragraphs(rnd, 2, vocab=vocab)}</pat:TechnicalProblem>'
+        f'<pat:TechnicalSolution>{_paragraphs(rnd, 2, vocab=vocab)}</pat:TechnicalSolution>'
+        f'<pat:AdvantageousEffects>{_paragraphs(rnd, 1, vocab=vocab)}</pat:AdvantageousEffects>'
+        '</pat:InventionSummary>'
+        '<pat:DrawingDescription><com:P><com:FigureReference>【図1】構成図</com:FigureReference></com:P></pat:DrawingDescription>'
+        f'<pat:EmbodimentDescription>{_paragraphs(rnd, paragraphs, vocab=vocab)}</pat:EmbodimentDescription>'
+        f'<pat:IndustrialApplicability>{_paragraphs(rnd, 1, vocab=vocab)}</pat:IndustrialApplicability>'
+        '</jppat:Description>'
+        '</jppat:PatentPublication>'
+    )
+    return xml.encode('utf-8')
+
+
+def make_vocabulary(size=5000, seed=0):
+    """
+    本文用の語彙を作る関数
+
+    既定の語彙は15語しかなく、どの2文字の組もほぼすべての文書に現れる。
+    全文検索のように文字の出現の偏りが結果に効く場合はこちらを使う。
+
+    Args:
+        size (int): 語数
+        seed (int): 乱数の種
+
+    Returns:
+        list: 2～4文字の語のリスト（漢字とカタカナ）
+    """
+    rnd = random.Random(seed)
+    kanji = [chr(c) for c in range(0x4E00, 0x4E00 + 2000)]
+    kana = [chr(c) for c in range(0x30A1, 0x30F6)]
+    words = []
+    for _ in range(size):
+        chars = kana if rnd.random() < 0.2 else kanji
+        words.append("".join(rnd.choice(chars) for _ in range(rnd.randint(2, 4))))
+    return words
+
+
+def make_pdf(pages=1, page_bytes=0, seed=0):
+    """
+    指定ページ数のダミーPDFを作る関数（相互参照表は従来形式）
+
+    Args:
+        pages (int): ページ数
+        page_bytes (int): 各ページに入れるダミーのコンテンツの大きさ（スキャン画像の代わり）
+        seed (int): 乱数の種
+
+    Returns:
+        bytes: PDFファイルの中身
+    """
+    rnd = random.Random(seed)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # ページツリーは後で作る
+    ]
+    kids = []
+    for _ in range(pages):
+        content = rnd.randbytes(page_bytes)
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        content_num = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents %d 0 R >>" % content_num)
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [" + b" ".join(kids) + b"] /Count %d >>" % pages
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for num, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % num + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def make_bulk_zip(path, count, seed=0, designations=DESIGNATION_MIX, applicants=(1, 3), agents=(0, 2),
+                  inventors=(1, 5), claims=(1, 20), paragraphs=(10, 80), pages=(3, 30), page_bytes=20000,
+                  per_zip=0):
+    """
+    一括ダウンロードと同じ形のZIP（公報ごとのディレクトリにXMLとPDF）を作る関数
+
+    件数の指定は (最小, 最大) の範囲で、公報ごとに一様に選ぶ。
+
+    Args:
+        path (str): 作るZIPファイルのパス
+        count (int): 公報の数
+        seed (int): 乱数の種（同じ値なら同じZIPになる）
+        designations (tuple): (公報種別, 割合) の組
+        applicants, agents, inventors (tuple): 出願人・代理人・発明者の数の範囲
+        claims (tuple): 請求項の数の範囲
+        paragraphs (tuple): 発明を実施するための形態の段落数の範囲
+        pages (tuple): PDFのページ数の範囲
+        page_bytes (int): PDFの各ページの大きさ
+        per_zip (int): 0 より大きい場合はこの件数ごとに内側のZIPにまとめる（入れ子のZIP）
+
+    Returns:
+        dict: 公報種別ごとの件数
+    """
+    rnd = random.Random(seed)
+    names = [name for name, _ in designations]
+    weights = [weight for _, weight in designations]
+    counts = collections.Counter()
+
+    def write_documents(zf, start, stop):
+        for i in range(start, stop):
+            designation = rnd.choices(names, weights)[0]
+            counts[designation] += 1
+            doc = f"JPA_{2024000000 + seed * 1000000 + i:010d}"
+            zf.writestr(f"DOCUMENT/P_A/{doc}/{doc}.xml", make_publication(
+                seed=seed * 1000000 + i, designation=designation,
+                applicants=rnd.randint(*applicants), agents=rnd.randint(*agents),
+                inventors=rnd.randint(*inventors), claims=rnd.randint(*claims),
+                paragraphs=rnd.randint(*paragraphs)))
+            zf.writestr(f"DOCUMENT/P_A/{doc}/{doc}.pdf",
+                        make_pdf(pages=rnd.randint(*pages), page_bytes=page_bytes, seed=i))
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        if per_zip <= 0:
+            write_documents(zf, 0, count)
+        else:
+            for start in range(0, count, per_zip):
+                buf = io.BytesIO()
+                with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as inner:
+                    write_documents(inner, start, min(count, start + per_zip))
+                zf.writestr(f"DATA/{start // per_zip + 1:04d}.zip", buf.getvalue())
+    return dict(counts)
@@ -2,14 +2,32 @@
 
 #coding:utf-8
 import os
+import io
+import re
 import sys
 import csv
+import time
 import psycopg2
 from pathlib import Path
 import pathlib
 import glob
 import logging
 import configparser
+import queue
+import threading
+import zlib
+import psycopg2.pool
+
+# app/ 以下のモジュールは app/ をパスに入れて読み込む
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app'))
+from parse import has_output, iter_results, write_result
+from sources import iter_sources
+from sinks import PerApplicationSink, ShardedSink
+from manifest import Manifest, MANIFEST_NAME
+from fields import Party, parties_from_row
+from codes import SCHEMES, split_codes
+from metrics import NULL_METRICS
+from quarantine import Quarantine
 
 maxInt = sys.maxsize
 while True:
@@ -37,27 +55,822 @@ src = R""
 # ipt = sys.argv[1])
 # opt = sys.argv[2])
 
-# configparserの宣言とiniファイルの読み込み
-config_ini = configparser.ConfigParser()
-config_ini.read('db_config.ini', encoding='utf-8')
-#　自分で別途変更が必要　GitHubに挙げないならべた付けでもよいが、セキュリティ的にはよくない
+# 1トランザクションでまとめて投入する行数
+BATCH_SIZE = 1000
+
+# XMLから直接投入するときに解析と投入の間に置く行数の上限
+QUEUE_SIZE = 5000
+
+# CSVから投入するときに、投入済みとしてマニフェストに記録するCSVファイル数の間隔
+CHECKPOINT_FILES = 10000
+
+# parallel_load の接続数の既定値と、一時的なエラーでバッチをやり直す回数・最初の待ち時間（秒）
+CONNECTIONS = 4
+RETRIES = 3
+RETRY_WAIT = 1.0
+
+# やり直せば成功する可能性のあるエラー（デッドロック・直列化の失敗・接続の切断など）
+# 接続が切れると取り消しの時点で InterfaceError になるため、それも含める（やり直す前に接続し直す）
+TRANSIENT_ERRORS = (psycopg2.extensions.TransactionRollbackError, psycopg2.OperationalError,
+                    psycopg2.InterfaceError)
+
+# 行の内容が原因のエラー（値の型や長さ・制約の違反、列の足りない行など）
+# quarantine を指定した場合は、バッチを分けて投入し直し、投入できない行だけを隔離する
+ROW_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError, ValueError, IndexError, TypeError)
+
+# 各テーブルに入れるCSVの列番号（列の並びは app/fields.py の FIELDS を参照）
+TABLE_COLUMNS = {
+    # 公開特許公報出願テーブル
+    # 公開種別(jp)～Fターム、出願人1、出願人2、代理人1、発明者1、要約
+    'pupa_application_basic_info': list(range(0, 20)) + [50, 51, 74, 75, 98],
+    # 公開特許公報出願人情報（公開種別(jp)、公開種別(st16)、公開番号、出願人1～12）
+    'pupa_applicant_info': [0, 1, 3] + list(range(14, 50)),
+    # 公開特許公報代理人情報（代理人1～12）
+    'pupa_agent_info': [0, 1, 3] + list(range(50, 74)),
+    # 公開特許公報発明者情報（発明者1～12）
+    'pupa_inventor_info': [0, 1, 3] + list(range(74, 98)),
+    # 公開特許公報文書情報
+    'pupa_text_info': [0, 1, 3] + list(range(99, 110)),
+}
+
+# 出願人・代理人・発明者を1件1行で入れるテーブル（件数の上限なし。parties=True の場合のみ使う）
+PARTY_TABLE = 'pupa_party_info'
+PARTY_TABLE_DDL = (
+    f"CREATE TABLE IF NOT EXISTS {PARTY_TABLE} ("
+    " kind_jp text, kind_st16 text, publication_number text,"
+    " role text, sequence integer, identifier text, name text, address text)"
+)
+
+# 分類・テーマコード・Fタームのコードの辞書と、公報ごとのコード番号の配列（codes=True の場合のみ使う）
+# 配列の列には GIN 索引を作るため、「Fターム X を持つ公報」は配列の包含（@>）で索引から探せる
+CODE_TABLE = 'pupa_code'
+CODE_TABLE_DDL = (
+    f"CREATE TABLE IF NOT EXISTS {CODE_TABLE} ("
+    " code_id serial PRIMARY KEY, scheme text NOT NULL, code text NOT NULL, UNIQUE (scheme, code))"
+)
+APPLICATION_CODE_TABLE = 'pupa_application_code'
+APPLICATION_CODE_TABLE_DDL = (
+    f"CREATE TABLE IF NOT EXISTS {APPLICATION_CODE_TABLE} ("
+    " kind_jp text, kind_st16 text, publication_number text, "
+    + ", ".join(f"{scheme} integer[]" for scheme in SCHEMES) + ")"
+)
+
+
+def get_connection(config_path='db_config.ini'):
+    connection = psycopg2.connect(get_dsn(config_path))
+    connection.get_backend_pid()
+    return connection
+
+
+def get_dsn(config_path='db_config.ini'):
+    # configparserの宣言とiniファイルの読み込み
+    config_ini = configparser.ConfigParser()
+    config_ini.read(config_path, encoding='utf-8')
+    #　自分で別途変更が必要　GitHubに挙げないならべた付けでもよいが、セキュリティ的にはよくない
+
+    # config,iniから値取得（.iniのファイルを本番用に書き換える）
+    host = config_ini['DEFAULT']['host']
+    port = config_ini['DEFAULT']['port']
+    dbname = config_ini['DEFAULT']['dbname']
+    user = config_ini['DEFAULT']['user']
+    password = config_ini['DEFAULT']['password']
+
+    #↑最初はベタ打ちでもよい。
+
+    conText = "host={} port={} dbname={} user={} password={}"
+    conText = conText.format(host, port, dbname, user, password)
+    return conText
+
+
+def read_csv_rows(src, files=None):
+    # src 以下のCSVファイル（files を指定した場合はそのファイル）の行を順に返す
+    src_path = Path(src)
+    print(src_path)
+    for cp in files if files is not None else src_path.glob('**/*.csv'):
+        with open(cp, newline = '', encoding='utf-8') as cpf:
+            print(cpf)
+            yield from csv.reader(cpf)
+
+
+def table_rows(row):
+    """
+    CSVの1行を各テーブルに入れる行に分ける関数
+
+    Args:
+        row (list): CSVの1行（110列）
+
+    Returns:
+        dict: テーブル名 -> 値のリスト
+    """
+    # 請求項の数と全ページ数に値が無い場合は -1 にする
+    row = list(row)
+    if row[9] == '' or row[9] is None: row[9] = -1
+    if row[10] == '' or row[10] is None: row[10] = -1
+    return {table: [row[i] for i in cols] for table, cols in TABLE_COLUMNS.items()}
+
+
+def party_rows(row, parties=None):
+    """
+    CSVの1行と当事者の記録から、当事者テーブルに入れる行を作る関数
+
+    Args:
+        row (list): CSVの1行（110列）
+        parties (list): fields.Party のリスト（None の場合は行の12件分の列から作る）
+
+    Returns:
+        list: 当事者1件ごとの値のリスト
+    """
+    if parties is None:
+        parties = parties_from_row(row)
+    return [[row[0], row[1], row[3], p.role, p.sequence, p.identifier or "", p.name or "", p.address or ""]
+            for p in parties]
+
+
+def create_party_table(connection):
+    # 当事者テーブルが無ければ作る
+    with connection, connection.cursor() as cur:
+        cur.execute(PARTY_TABLE_DDL)
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {PARTY_TABLE}_publication_number"
+                    f" ON {PARTY_TABLE} (publication_number)")
+
+
+def create_code_tables(connection):
+    # コードの辞書と配列のテーブルが無ければ作る
+    with connection, connection.cursor() as cur:
+        cur.execute(CODE_TABLE_DDL)
+        cur.execute(APPLICATION_CODE_TABLE_DDL)
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {APPLICATION_CODE_TABLE}_publication_number"
+                    f" ON {APPLICATION_CODE_TABLE} (publication_number)")
+        for scheme in SCHEMES:
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {APPLICATION_CODE_TABLE}_{scheme}"
+                        f" ON {APPLICATION_CODE_TABLE} USING gin ({scheme})")
+
+
+def intern_codes(cur, keys, code_ids):
+    """
+    コードの辞書に無いコードを追加し、番号を code_ids に入れる関数
+
+    Args:
+        cur: psycopg2 のカーソル
+        keys (iterable): (列名, コード) の組
+        code_ids (dict): (列名, コード) -> 番号（投入中に使い回す）
+    """
+    missing = sorted({key for key in keys if key not in code_ids})
+    if not missing:
+        return
+    stage = f"{CODE_TABLE}_stage"
+    cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {stage} (scheme text, code text) ON COMMIT DELETE ROWS")
+    copy_rows(cur, stage, missing)
+    # 並列に投入する場合にデッドロックしないよう、どの接続も同じ順に追加する
+    cur.execute(f"INSERT INTO {CODE_TABLE} (scheme, code) SELECT scheme, code FROM {stage}"
+                " ORDER BY scheme, code ON CONFLICT (scheme, code) DO NOTHING")
+    cur.execute(f"SELECT c.scheme, c.code, c.code_id FROM {CODE_TABLE} c"
+                f" JOIN {stage} s ON s.scheme = c.scheme AND s.code = c.code")
+    for scheme, code, code_id in cur.fetchall():
+        code_ids[(scheme, code)] = code_id
+
+
+def code_rows(cur, rows, code_ids):
+    """
+    CSVの行から、コードの配列のテーブルに入れる行を作る関数
+
+    Args:
+        cur: psycopg2 のカーソル（新しいコードを辞書に追加する）
+        rows (list): CSVの行（110列）
+        code_ids (dict): (列名, コード) -> 番号
+
+    Returns:
+        list: 公報ごとの値のリスト（配列は '{1,2,3}' の形）
+    """
+    split = [split_codes(row) for row in rows]
+    intern_codes(cur, ((scheme, code) for codes in split for scheme, values in codes.items()
+                       for code in values), code_ids)
+    return [[row[0], row[1], row[3]]
+            + ["{" + ",".join(str(code_ids[(scheme, code)]) for code in codes[scheme]) + "}"
+               for scheme in SCHEMES]
+            for row, codes in zip(rows, split)]
+
+
+def copy_rows(cur, table, rows):
+    # COPY FROM STDIN で値をそのままデータとして送る（エスケープは不要）
+    # 空文字列が NULL にならないよう、すべての値を引用符で囲む
+    buf = io.StringIO()
+    csv.writer(buf, quoting=csv.QUOTE_ALL).writerows(rows)
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} FROM STDIN WITH (FORMAT csv)", buf)
+
+
+# 公報の行から作る子のテーブル（upsert では入れる行ではなく、バッチのすべての公開番号で古い行を消す）
+_BATCH_KEYED_TABLES = {PARTY_TABLE, APPLICATION_CODE_TABLE}
+
+# テーブル名 -> 公開番号の列名
+_key_columns = {PARTY_TABLE: 'publication_number', APPLICATION_CODE_TABLE: 'publication_number'}
+
+
+def _key_column(cur, table):
+    # 公開番号が入る列の名前をカタログから調べる（テーブル定義は変えない）
+    if table not in _key_columns:
+        cur.execute(
+            "SELECT attname FROM pg_attribute WHERE attrelid = %s::regclass"
+            " AND attnum > 0 AND NOT attisdropped ORDER BY attnum", (table,))
+        names = [r[0] for r in cur.fetchall()]
+        _key_columns[table] = names[TABLE_COLUMNS[table].index(3)]
+    return _key_columns[table]
+
+
+def create_key_indexes(connection):
+    # upsert で同じ公開番号の行を消すときに表全体を読まないよう、公報のテーブルの公開番号の列に索引を作る
+    # （既にある場合は作らない。CREATE INDEX IF NOT EXISTS でも表をロックするため、先に名前で確かめる）
+    with connection, connection.cursor() as cur:
+        for table in TABLE_COLUMNS:
+            name = f"{table}_publication_number"
+            cur.execute("SELECT to_regclass(%s)", (name,))
+            if cur.fetchone()[0] is None:
+                print(f"Creating index {name}")
+                cur.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ("{_key_column(cur, table)}")')
+
+
+def upsert_rows(cur, table, rows, keys=None):
+    # 一時テーブルに COPY してから、同じ公開番号の行を消して入れ直す（公開番号が空の行は消さずに追加する）
+    # keys を渡した場合は、入れる行が無い公報も含めて keys の公開番号の行をすべて消す
+    # （当事者のテーブルなど、公報ごとの行の数が変わるテーブルで古い行を残さない）
+    stage = f"{table}_stage"
+    cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {stage} (LIKE {table}) ON COMMIT DELETE ROWS")
+    copy_rows(cur, stage, rows)
+    key = _key_column(cur, table)
+    if keys is None:
+        cur.execute(f'DELETE FROM {table} t USING {stage} s WHERE t."{key}" = s."{key}" AND s."{key}" <> \'\'')
+    else:
+        cur.execute(f'DELETE FROM {table} WHERE "{key}" = ANY(%s)', ([k for k in keys if k],))
+    cur.execute(f"INSERT INTO {table} SELECT * FROM {stage}")
+
+
+def load_tables(parties=False, codes=False):
+    # 投入するテーブル名のリスト
+    return list(TABLE_COLUMNS) + ([PARTY_TABLE] if parties else []) + ([APPLICATION_CODE_TABLE] if codes else [])
+
+
+def load_batch(connection, batch, tables, upsert=True, parties=False, codes=False, code_ids=None,
+               metrics=NULL_METRICS):
+    """
+    1バッチ分の行を1トランザクションで各テーブルに COPY する関数
+
+    Args:
+        connection: psycopg2 の接続
+        batch (list): (CSVの行, fields.Party のリスト または None) のリスト
+        tables (list): 投入するテーブル名（load_tables の戻り値）
+        upsert, parties, codes: bulk_load を参照
+        code_ids (dict): (列名, コード) -> 番号（codes の場合に投入中に使い回す）
+        metrics (metrics.Metrics): テーブルごとの COPY の時間（db.<テーブル名>）と行数を足す
+
+    Returns:
+        dict: テーブル名 -> (行数, COPYにかかった秒数)（コミットできた場合だけ返る）
+    """
+    if upsert:
+        # 同じバッチ内に同じ公開番号があれば後の行を使う（公開番号が空の行は置き換えられないためすべて投入する）
+        latest = {row[3]: i for i, (row, _) in enumerate(batch) if row[3]}
+        batch = [(row, found) for i, (row, found) in enumerate(batch) if not row[3] or latest[row[3]] == i]
+    per_table = {table: [] for table in tables}
+    with metrics.timer('db.split'):
+        for row, found in batch:
+            for table, values in table_rows(row).items():
+                per_table[table].append(values)
+            if parties:
+                per_table[PARTY_TABLE] += party_rows(row, found)
+    # 公報ごとの行の数が変わるテーブルは、バッチのすべての公開番号の行を消してから入れる
+    keys = [row[3] for row, _ in batch]
+    result = {}
+    with connection:
+        with connection.cursor() as cur:
+            if codes:
+                with metrics.timer('db.intern_codes'):
+                    per_table[APPLICATION_CODE_TABLE] = code_rows(cur, [row for row, _ in batch], code_ids)
+            for table, values in per_table.items():
+                start = time.perf_counter()
+                if not upsert:
+                    copy_rows(cur, table, values)
+                else:
+                    upsert_rows(cur, table, values, keys if table in _BATCH_KEYED_TABLES else None)
+                result[table] = (len(values), time.perf_counter() - start)
+    for table, (count, seconds) in result.items():
+        metrics.add_time(f"db.{table}", seconds)
+        metrics.count(f"rows.{table}", count)
+    return result
+
 
-# config,iniから値取得（.iniのファイルを本番用に書き換える）
-host = config_ini['DEFAULT']['host']
-port = config_ini['DEFAULT']['port']
-dbname = config_ini['DEFAULT']['dbname']
-user = config_ini['DEFAULT']['user']
-password = config_ini['DEFAULT']['password']
+def iter_batches(rows, batch_size):
+    # 行を (行, 当事者) の組にして batch_size 件ずつ返す
+    batch = []
+    for row in rows:
+        batch.append(row if isinstance(row, tuple) else (row, None))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-#↑最初はベタ打ちでもよい。
 
-conText = "host={} port={} dbname={} user={} password={}"
-conText = conText.format(host, port, dbname, user, password)
-connection = psycopg2.connect(conText)
-connection.get_backend_pid()
-cur = connection.cursor()#接続情報を受け取る
+class BatchLoader:
+    """
+    1つの接続でバッチを投入するもの（load_batch に、一時的なエラーのやり直しと行の隔離を加える）
 
-def csv_to_db(src):
+    一時的なエラー（TRANSIENT_ERRORS）の場合は、そのトランザクションを retries 回までやり直す
+    （待ち時間は RETRY_WAIT 秒から倍にしていく）。接続が切れた場合は reconnect(古い接続) で接続し直し、
+    reconnect が無ければそのまま失敗する。
+    行のエラー（ROW_ERRORS）の場合は、quarantine を指定していればバッチを半分ずつに分けて投入し直し、
+    1行でも投入できない行だけを quarantine に記録して先に進む（正常な行は1バッチ1トランザクションのまま）。
+
+    Args:
+        connection: psycopg2 の接続（接続し直した場合は新しい接続に置き換わる）
+        tables, upsert, parties, codes, metrics: load_batch を参照
+        retries (int): 一時的なエラーでやり直す回数の上限
+        reconnect (callable): 切れた接続の代わりの接続を返す関数
+        quarantine (quarantine.Quarantine): 投入できない行の隔離先（None の場合は行のエラーでも失敗する）
+    """
+
+    def __init__(self, connection, tables, upsert=True, parties=False, codes=False, metrics=NULL_METRICS,
+                 retries=RETRIES, reconnect=None, quarantine=None):
+        self.connection = connection
+        self.tables = tables
+        self.upsert = upsert
+        self.parties = parties
+        self.codes = codes
+        self.metrics = metrics
+        self.retries = retries
+        self.reconnect = reconnect
+        self.quarantine = quarantine
+        # コードの番号は接続ごとに持つ（やり直したトランザクションで追加した番号を他の接続が使わないように）
+        self.code_ids = {}
+
+    def load(self, batch):
+        """
+        バッチを投入する関数
+
+        Returns:
+            dict: テーブル名 -> (行数, COPYにかかった秒数)（隔離した行は含まない）
+        """
+        try:
+            return self._load_retrying(batch)
+        except ROW_ERRORS as e:
+            if self.quarantine is None:
+                raise
+            # 取り消したトランザクションで追加したコードの番号は使えない
+            self.code_ids.clear()
+            if len(batch) == 1:
+                row, found = batch[0]
+                table, field = _error_location(e)
+                self.quarantine.add_row(row, found, e, table, field)
+                self.metrics.count('db.quarantined_rows')
+                print(f"Quarantined a row ({row[3] if len(row) > 3 else '?'}): {type(e).__name__}: {e}".rstrip())
+                return {}
+            middle = len(batch) // 2
+            result = self.load(batch[:middle])
+            for table, (count, seconds) in self.load(batch[middle:]).items():
+                total = result.get(table, (0, 0.0))
+                result[table] = (total[0] + count, total[1] + seconds)
+            return result
+
+    def _load_retrying(self, batch):
+        for attempt in range(self.retries + 1):
+            try:
+                return load_batch(self.connection, batch, self.tables, self.upsert, self.parties, self.codes,
+                                  self.code_ids, self.metrics)
+            except TRANSIENT_ERRORS as e:
+                if attempt == self.retries or (self.connection.closed and self.reconnect is None):
+                    raise
+                print(f"Retrying a batch of {len(batch)} rows ({attempt + 1}/{self.retries}): {e}".rstrip())
+                self.metrics.count('db.retries')
+                self.code_ids.clear()
+                if self.connection.closed:
+                    self.connection = self.reconnect(self.connection)
+                time.sleep(RETRY_WAIT * 2 ** attempt)
+
+
+def _error_location(e):
+    # 投入できなかったテーブルと列（PostgreSQL の診断情報から分かる場合。分からなければ None）
+    diag = getattr(e, 'diag', None)
+    if diag is None:
+        return None, None
+    table, column = diag.table_name, diag.column_name
+    m = re.search(r'COPY (\w+), line \d+(?:, column (\w+))?', diag.context or "")
+    if m:
+        table, column = table or m.group(1), column or m.group(2)
+    if table and table.endswith('_stage'):
+        # upsert の一時テーブル
+        table = table[:-len('_stage')]
+    return table, column
+
+
+def bulk_load(connection, rows, batch_size=BATCH_SIZE, upsert=True, parties=False, codes=False, metrics=NULL_METRICS,
+              retries=RETRIES, quarantine=None):
+    """
+    行を batch_size 件ずつ、1バッチ1トランザクションで5つのテーブルに COPY する関数
+
+    Args:
+        connection: psycopg2 の接続
+        rows (iterable): CSVの行（110列）、または (行, fields.Party のリスト) の組
+        batch_size (int): 1トランザクションで投入する行数
+        upsert (bool): True の場合は公開番号が同じ既存の行を置き換える
+            （同じデータを何度投入しても結果が変わらない）
+        parties (bool): True の場合は当事者テーブル（PARTY_TABLE）にも投入する
+            （当事者の記録が無い行は12件分の列から作る）
+        codes (bool): True の場合はコードの辞書（CODE_TABLE）と配列のテーブル（APPLICATION_CODE_TABLE）にも投入する
+        metrics (metrics.Metrics): 指定した場合はテーブルごとの COPY の時間（db.<テーブル名>）と行数を足す
+        retries (int): デッドロックなどの一時的なエラーでバッチをやり直す回数の上限
+            （接続が切れた場合は接続し直せないため失敗する。BatchLoader を参照）
+        quarantine (quarantine.Quarantine): 指定した場合は投入できない行だけを隔離して先に進む
+
+    Returns:
+        dict: テーブル名 -> (行数, COPYにかかった秒数)
+    """
+    tables = load_tables(parties, codes)
+    stats = {table: [0, 0.0] for table in tables}
+    if upsert:
+        create_key_indexes(connection)
+    if parties:
+        create_party_table(connection)
+    if codes:
+        create_code_tables(connection)
+    loader = BatchLoader(connection, tables, upsert, parties, codes, metrics, retries, quarantine=quarantine)
+
+    for batch in iter_batches(rows, batch_size):
+        for table, (count, seconds) in loader.load(batch).items():
+            stats[table][0] += count
+            stats[table][1] += seconds
+
+    for table, (count, seconds) in stats.items():
+        rate = count / seconds if seconds else 0
+        print(f"{table}: {count} rows, {rate:.0f} rows/s")
+    return {table: tuple(v) for table, v in stats.items()}
+
+
+def _partition(row, connections):
+    # 同じ公開番号の行は常に同じ接続に渡す（Python の hash は実行ごとに変わるため crc32 を使う）
+    return zlib.crc32(str(row[3]).encode('utf-8')) % connections
+
+
+def parallel_load(dsn, rows, connections=CONNECTIONS, batch_size=BATCH_SIZE, upsert=True, parties=False,
+                  codes=False, retries=RETRIES, metrics=NULL_METRICS, pool=None, quarantine=None):
+    """
+    行を公開番号で connections 個に振り分け、接続プールの接続ごとのスレッドで並列に投入する関数
+
+    同じ公開番号の行は入力の順のまま同じ接続に渡すため、置き換え（upsert）の結果は bulk_load と同じになり、
+    接続どうしが同じ行を取り合うこともない。各接続は batch_size 件ごとに1トランザクションで投入し、
+    デッドロックや接続の切断などの一時的なエラー（TRANSIENT_ERRORS）の場合は、そのバッチを retries 回まで
+    やり直す（やり直すまでの待ち時間は RETRY_WAIT 秒から倍にしていく。BatchLoader を参照）。
+
+    Args:
+        dsn (str): 接続文字列（get_dsn を参照）
+        rows (iterable): CSVの行（110列）、または (行, fields.Party のリスト) の組
+        connections (int): 接続数（投入するスレッド数）
+        batch_size, upsert, parties, codes, metrics, quarantine: bulk_load を参照
+        retries (int): 一時的なエラーでバッチをやり直す回数の上限
+        pool (psycopg2.pool.ThreadedConnectionPool): 指定した場合は dsn から接続せずにこのプールの接続を使い、
+            終了時も閉じない（常駐する処理で接続を使い回す場合。接続数の上限は connections 以上にする）
+
+    Returns:
+        dict: テーブル名 -> (行数, COPYにかかった秒数の全接続の合計)
+    """
+    tables = load_tables(parties, codes)
+    stats = {table: [0, 0.0] for table in tables}
+    lock = threading.Lock()
+    stop = threading.Event()
+    errors = []
+    started = time.perf_counter()
+
+    own_pool = pool is None
+    if own_pool:
+        pool = psycopg2.pool.ThreadedConnectionPool(1, connections, dsn)
+    connection = pool.getconn()
+    try:
+        if upsert:
+            create_key_indexes(connection)
+        if parties:
+            create_party_table(connection)
+        if codes:
+            create_code_tables(connection)
+    finally:
+        pool.putconn(connection)
+
+    def reconnect(connection):
+        pool.putconn(connection, close=True)
+        return pool.getconn()
+
+    def work(batches):
+        loader = None
+        try:
+            loader = BatchLoader(pool.getconn(), tables, upsert, parties, codes, metrics, retries, reconnect,
+                                 quarantine)
+            while not stop.is_set():
+                try:
+                    batch = batches.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if batch is None:
+                    return
+                result = loader.load(batch)
+                with lock:
+                    for table, (count, seconds) in result.items():
+                        stats[table][0] += count
+                        stats[table][1] += seconds
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            if loader is not None:
+                pool.putconn(loader.connection, close=bool(loader.connection.closed))
+
+    def put(batches, item):
+        # 投入側で失敗した場合は待たずに諦める
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    # 接続ごとに2バッチまで先に用意しておく
+    queues = [queue.Queue(maxsize=2) for _ in range(connections)]
+    workers = [threading.Thread(target=work, args=(q,), daemon=True) for q in queues]
+    for worker in workers:
+        worker.start()
+    try:
+        pending = [[] for _ in range(connections)]
+        for row in rows:
+            if stop.is_set():
+                break
+            item = row if isinstance(row, tuple) else (row, None)
+            i = _partition(item[0], connections)
+            pending[i].append(item)
+            if len(pending[i]) >= batch_size:
+                put(queues[i], pending[i])
+                pending[i] = []
+        for q, batch in zip(queues, pending):
+            if batch:
+                put(q, batch)
+            put(q, None)
+    finally:
+        if sys.exc_info()[0] is not None:
+            stop.set()
+        for worker in workers:
+            worker.join()
+        if own_pool:
+            pool.closeall()
+    if errors:
+        raise errors[0]
+
+    elapsed = time.perf_counter() - started
+    for table, (count, seconds) in stats.items():
+        print(f"{table}: {count} rows")
+    documents = stats[tables[0]][0]
+    rate = documents / elapsed if elapsed else 0
+    print(f"{connections} connections: {documents} rows in {elapsed:.1f} s, {rate:.0f} rows/s")
+    return {table: tuple(v) for table, v in stats.items()}
+
+
+def csv_to_db_bulk(src, batch_size=BATCH_SIZE, upsert=True, incremental=True, parties=False, codes=False,
+                   metrics=None, connection=None, checkpoint=CHECKPOINT_FILES, connections=1,
+                   config_path='db_config.ini', pool=None, quarantine=True):
+    """
+    CSVファイルを COPY でまとめて投入する関数
+
+    Args:
+        src (str): CSVファイルのディレクトリ（xml_to_csv の出力先）
+        batch_size (int): 1トランザクションで投入する行数
+        upsert (bool): True の場合は公開番号が同じ既存の行を置き換える
+        incremental (bool): True の場合は src のマニフェストを使い、
+            前回投入してから変わっていないCSVを読み飛ばす
+        parties (bool): True の場合は当事者テーブルにも投入する（12件分の列から作る）
+        codes (bool): True の場合はコードの辞書と配列のテーブルにも投入する
+        metrics (metrics.Metrics): 指定した場合はテーブルごとの時間と行数を集め、終了時に集計を表示する
+        connection: psycopg2 の接続（None の場合は config_path から接続し、終了時に閉じる）
+        checkpoint (int): incremental の場合に、このCSVファイル数ごとに投入済みとして記録する
+            （途中で止まっても、次回は記録していないCSVから投入する）
+        connections (int): 2以上の場合は config_path の接続先にこの数の接続を開き、
+            parallel_load で並列に投入する（connection は使わない）
+        config_path (str): 接続情報の ini ファイル
+        pool (psycopg2.pool.ThreadedConnectionPool): 指定した場合は config_path から接続せずに
+            このプールの接続を使い、終了時に返す（常駐する処理で接続を使い回す場合）
+        quarantine (bool): True の場合は投入できない行を src の quarantine/ に隔離して先に進む
+            （quarantine.Quarantine を参照。redrive_rows で隔離した行だけを投入し直す）
+
+    Returns:
+        dict: テーブル名 -> (行数, COPYにかかった秒数)
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+    quarantine = Quarantine.in_directory(src) if quarantine else None
+    own_connection = False
+    if connections > 1:
+        dsn = get_dsn(config_path) if pool is None else None
+
+        def load(rows):
+            return parallel_load(dsn, rows, connections, batch_size, upsert, parties, codes, metrics=metrics,
+                                 pool=pool, quarantine=quarantine)
+    else:
+        if pool is not None:
+            connection = pool.getconn()
+        elif connection is None:
+            own_connection = True
+            connection = get_connection(config_path)
+
+        def load(rows):
+            return bulk_load(connection, rows, batch_size, upsert, parties, codes, metrics, quarantine=quarantine)
+    try:
+        if not incremental:
+            stats = load(read_csv_rows(src))
+        else:
+            stats = _load_changed_csv(load, src, checkpoint)
+    finally:
+        if own_connection:
+            connection.close()
+        elif pool is not None and connections <= 1:
+            # 切れた接続はプールに戻さずに閉じる（次回は接続し直す）
+            pool.putconn(connection, close=bool(connection.closed))
+        if quarantine is not None:
+            quarantine.close()
+    metrics.finish()
+    return stats
+
+
+def redrive_rows(src, connection, upsert=True, parties=False, codes=False, metrics=None):
+    """
+    src の quarantine/ に隔離した行だけを投入し直す関数
+
+    1行ずつ1トランザクションで投入し、投入できた行は隔離を解く。
+    まだ投入できない行は新しいエラーで記録し直す（試行回数が増える）。
+
+    Args:
+        src (str): CSVのディレクトリ（csv_to_db_bulk の src）
+        connection: psycopg2 の接続
+        upsert, parties, codes, metrics: bulk_load を参照
+
+    Returns:
+        tuple: (投入できた行数, まだ投入できない行数)
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+    quarantine = Quarantine.in_directory(src)
+    loaded = failed = 0
+    try:
+        entries = quarantine.rows()
+        print(f"Quarantined rows: {len(entries)}")
+        if not entries:
+            return loaded, failed
+        if upsert:
+            create_key_indexes(connection)
+        if parties:
+            create_party_table(connection)
+        if codes:
+            create_code_tables(connection)
+        loader = BatchLoader(connection, load_tables(parties, codes), upsert, parties, codes, metrics,
+                             quarantine=quarantine)
+        for row_id, row, found in entries:
+            found = None if found is None else [Party(*p) for p in found]
+            if loader.load([(row, found)]):
+                quarantine.resolve_row(row_id)
+                loaded += 1
+            else:
+                failed += 1
+    finally:
+        quarantine.close()
+    print(f"Redriven rows: {loaded}, Still failing: {failed}")
+    return loaded, failed
+
+
+def _load_changed_csv(load, src, checkpoint):
+    # 前回から変わったCSVを checkpoint 個ずつ load で投入し、投入し終えた分をマニフェストに記録する
+    manifest = Manifest(Path(src) / MANIFEST_NAME)
+    stats = {}
+    try:
+        files = [cp for cp in Path(src).glob('**/*.csv') if manifest.csv_changed(cp)]
+        print(f"Changed CSV files: {len(files)}")
+        for i in range(0, len(files), checkpoint):
+            chunk = files[i:i + checkpoint]
+            for table, (count, seconds) in load(read_csv_rows(src, chunk)).items():
+                total = stats.get(table, (0, 0.0))
+                stats[table] = (total[0] + count, total[1] + seconds)
+            manifest.mark_csv_loaded(chunk)
+            if len(files) > checkpoint:
+                print(f"Loaded CSV files: {i + len(chunk)} / {len(files)}")
+    finally:
+        manifest.close()
+    return stats
+
+
+def xml_to_db(ipt, connection, csv_dir=None, workers=None, streaming=False,
+              batch_size=BATCH_SIZE, queue_size=QUEUE_SIZE, upsert=True, manifest_dir=None,
+              sharded=False, parties=False, codes=False, metrics=None, quarantine_dir=None):
+    """
+    XMLを解析した行を、CSVを経由せずにそのままデータベースへ投入する関数
+
+    解析（別スレッドから xml_to_csv と同じプロセスプールを使う）と投入は同時に進み、
+    その間は上限付きのキューで行を受け渡す。列の並びとテーブルへの振り分けは
+    CSVから投入する場合と同じ。
+
+    Args:
+        ipt (str): XMLファイルを探すディレクトリ（サブディレクトリも含む）、またはZIPファイル
+        connection: psycopg2 の接続
+        csv_dir (str): 指定した場合は従来と同じCSVもこのディレクトリに書き出す
+        workers (int): 解析に使うプロセス数（None の場合はCPU数）
+        streaming (bool): True の場合は逐次読み込みで抽出する
+        batch_size (int): 1トランザクションで投入する行数
+        queue_size (int): 解析済みでまだ投入していない行数の上限
+        upsert (bool): True の場合は公開番号が同じ既存の行を置き換える
+        manifest_dir (str): 指定した場合はこのディレクトリのマニフェストを使い、
+            前回から変わっていないXMLを読み飛ばす
+        sharded (bool): True の場合は csv_dir にまとめたCSVと索引を書き出す（xml_to_csv を参照）
+        parties (bool): True の場合は当事者テーブルにも投入する（13件目以降も含む）
+        codes (bool): True の場合はコードの辞書と配列のテーブルにも投入する
+        metrics (metrics.Metrics): 指定した場合は解析と投入の段階ごとの時間を集め、終了時に集計を表示する
+            （解析と投入は同時に進むため、段階の合計は経過時間より長くなる）
+        quarantine_dir (str): 指定した場合は処理できない文書と投入できない行を、このディレクトリの
+            quarantine/ に隔離して先に進む（xml_to_csv, csv_to_db_bulk と同じ）
+
+    Returns:
+        dict: テーブル名 -> (行数, COPYにかかった秒数)
+    """
+    if metrics is None:
+        metrics = NULL_METRICS
+    xml_path = iter_sources(ipt)
+    sink = None
+    # 前回の行を置き換えるのは、マニフェストに前回の行の記録がある文書（マニフェストを使わない場合は CSV の出力先に
+    # 前回の書き出しがあるとき）だけ
+    replace_all = csv_dir is not None and manifest_dir is None and has_output(csv_dir)
+    replaced = set()
+    if csv_dir is not None:
+        sink = ShardedSink(csv_dir) if sharded else PerApplicationSink(csv_dir)
+    manifest = Manifest.in_directory(manifest_dir) if manifest_dir is not None else None
+    if manifest is not None:
+        xml_path = [f for f in xml_path if manifest.needs_processing(f)]
+        # マニフェストは解析のスレッドから使えないため、ここで調べておく
+        replaced = {str(f) for f in xml_path if manifest.previous(f) is not None}
+    quarantine = Quarantine.in_directory(quarantine_dir) if quarantine_dir is not None else None
+    # マニフェストへの記録は投入が終わってから行う（途中で失敗したら次回やり直す）
+    finished = []
+
+    rows = queue.Queue(maxsize=queue_size)
+    done = object()
+    stop = threading.Event()
+    errors = []
+
+    def produce():
+        try:
+            for result in iter_results(xml_path, workers, streaming, metrics=metrics):
+                if stop.is_set():
+                    break
+                replace = replace_all or str(result[1]) in replaced
+                with metrics.timer('write'):
+                    status = write_result(sink, result, replace=replace, quarantine=quarantine)
+                metrics.count(f"documents.{status}")
+                if status == "ok":
+                    rows.put((result[3], result[4]))
+                finished.append((result[1], status, result[2], result[3]))
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            if sink is not None:
+                sink.close()
+            rows.put(done)
+
+    def consume():
+        while True:
+            row = rows.get()
+            if row is done:
+                return
+            yield row
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        stats = bulk_load(connection, consume(), batch_size, upsert, parties, codes, metrics, quarantine=quarantine)
+    finally:
+        # 投入側で失敗した場合も解析側が止まるようにキューを空ける
+        stop.set()
+        while producer.is_alive():
+            try:
+                rows.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        producer.join()
+        if quarantine is not None:
+            quarantine.close()
+    if errors:
+        raise errors[0]
+    if manifest is not None:
+        for xml_file, status, csv_name, data in finished:
+            if status == "ok":
+                manifest.record(xml_file, status, csv_name, data[3])
+            else:
+                manifest.record(xml_file, status)
+        manifest.close()
+    metrics.finish()
+    return stats
+
+
+def csv_to_db(src, connection):
+    # 1行ずつ INSERT する従来の投入（connection: psycopg2 の接続。通常は csv_to_db_bulk を使う）
+    cur = connection.cursor()
     # p = Path(ipt)
     # for dir_num in range(1, 900):　
     #     src_path = src + '/' + str(dir_num) 
@@ -227,10 +1040,26 @@ def csv_to_db(src):
                 # print(clm)
                 cur.execute(clm)
                 connection.commit()
+    cur.close()
+
+if __name__ == "__main__":
+    # 展開・解析・投入をまとめて行う場合は batch.py を使う（python batch.py load -h）
+    # python csv_to_db.py --xml <XMLのディレクトリまたはZIPファイル> [CSVの出力先] では
+    # CSVを経由せずXMLから直接投入する（xml_to_db。CSVの出力先を指定した場合はCSVも書き出す）
+    direct = len(sys.argv) > 2 and sys.argv[1] == '--xml'
+    src = sys.argv[2 if direct else 1] if len(sys.argv) > 1 else src
+    if not src:
+        sys.exit("使い方: python csv_to_db.py <CSVのディレクトリ>\n"
+                 "        python csv_to_db.py --xml <XMLのディレクトリまたはZIPファイル> [CSVの出力先]")
+    connection = get_connection()
+
+    if direct:
+        xml_to_db(src, connection, csv_dir=sys.argv[3] if len(sys.argv) > 3 else None)
+    else:
+        csv_to_db_bulk(src, connection=connection)
+    # csv_to_db(src, connection)  # 1行ずつINSERTする従来の方法
+    # xml_to_csv(src)
+    connection.close()
 
-csv_to_db(src)
-# xml_to_csv(src)
-cur.close()
-connection.close()
+    print('done.')
 
-print('done.')
@@ -0,0 +1,278 @@
+import os
+import sys
+import time
+import signal
+import threading
+import zipfile
+import traceback
+import contextlib
+import multiprocessing
+
+import psycopg2.pool
+
+# app/ 以下のモジュールは app/ をパスに入れて読み込む
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app'))
+import csv_to_db
+from parse import xml_to_csv, _init_worker
+from metrics import Metrics, NULL_METRICS
+
+# 受信ディレクトリに置かれたZIPを、常駐したまま順に解析してデータベースに投入する（python batch.py watch -h）
+# 解析のワーカープロセスとデータベースの接続は起動時に1回だけ用意し、アーカイブごとに使い回す。
+#
+# 受信ディレクトリ（inbox）の下に次のディレクトリを作る（同じファイルシステムのため、移動は os.replace で一度に行う）
+#   processing/  処理中のアーカイブ（止めた場合は次回の起動時にここから続きを処理する）
+#   done/        投入し終えたアーカイブ
+#   failed/      処理できなかったアーカイブと、その理由（<名前>.error.txt）
+# 処理中のアーカイブは「受け取った時刻（ナノ秒）-元の名前」に名前を変える。
+# 同じ名前のアーカイブがまた届いた場合に、ワーカーが開いたままの前のアーカイブと取り違えないためと、
+# 出力先（<出力先>/<名前を変えたアーカイブの拡張子を除いた名前>）を分けるため。
+#
+# 受信ディレクトリの *.zip は、大きさと更新時刻が settle 秒変わらなくなってから処理する。
+# 書き込みに時間のかかる場合は、別の名前（*.zip.part など）で書き込んでから .zip に名前を変えると確実。
+
+PROCESSING_DIR = 'processing'
+DONE_DIR = 'done'
+FAILED_DIR = 'failed'
+
+# 受信ディレクトリを見る間隔と、書き込みが終わったとみなすまでの秒数
+POLL_SECONDS = 5.0
+SETTLE_SECONDS = 10.0
+
+# データベースに接続できない場合に同じアーカイブの投入をやり直すまでの待ち時間（秒。倍にしていく）
+DB_RETRY_WAIT = 5.0
+DB_RETRY_WAIT_MAX = 300.0
+
+# 受け取ってから投入し終えるまでの時間の区切り（秒）
+ARCHIVE_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400)
+
+
+class Ingester:
+    """
+    受信ディレクトリを見張り、届いたZIPを届いた順に解析・投入するもの
+
+    解析は xml_to_csv（incremental。ZIPは展開せずに読む）、投入は csv_to_db.csv_to_db_bulk（incremental）で行う。
+    データベースに接続できない場合（csv_to_db.TRANSIENT_ERRORS）は、アーカイブを processing/ に残したまま
+    待ってからやり直す。それ以外のエラーの場合はアーカイブを failed/ に移して次のアーカイブに進む。
+
+    集計（metrics）には次の値を入れ、アーカイブを1つ処理するたびと、受信ディレクトリを見るたびに書き出す。
+        ingest_queue_depth             処理を待っているアーカイブの数（処理中の分を含む）
+        ingest_oldest_waiting_seconds  最も長く待っているアーカイブの待ち時間
+        ingest_last_success_timestamp  最後に投入し終えた時刻（UNIX時刻）
+        archive_latency_seconds        受け取ってから投入し終えるまでの時間の分布
+        archive_processing_seconds     1アーカイブの解析と投入にかかった時間の分布
+
+    Args:
+        inbox (str): 受信ディレクトリ
+        output (str): CSVの出力先（アーカイブごとにサブディレクトリを作る）
+        config_path (str): データベースの接続情報の ini ファイル
+        workers (int): 解析に使うプロセス数（None の場合はCPU数、1 以下の場合はプロセスを使わない）
+        connections (int): 投入に使う接続数（2以上で並列に投入する）
+        parse_options (dict): xml_to_csv に渡すその他の引数（streaming, sharded, cache など）
+        load_options (dict): csv_to_db_bulk に渡すその他の引数（upsert, parties, codes など）
+        metrics (metrics.Metrics): 常駐している間の集計
+        archive_metrics (callable): 指定した場合はアーカイブごとに呼び、戻り値の Metrics を
+            xml_to_csv と csv_to_db_bulk に渡す（段階ごとの時間をアーカイブごとに表示する）
+        progress (callable): 指定した場合はアーカイブの名前で呼び、戻り値を xml_to_csv の progress に渡す
+        poll_seconds (float): 受信ディレクトリを見る間隔
+        settle_seconds (float): 書き込みが終わったとみなすまでの秒数
+        quiet (bool): True の場合は解析と投入の1件ごとの表示を省く
+    """
+
+    def __init__(self, inbox, output, config_path='db_config.ini', workers=None, connections=1,
+                 parse_options=None, load_options=None, metrics=NULL_METRICS, archive_metrics=None,
+                 progress=None, poll_seconds=POLL_SECONDS, settle_seconds=SETTLE_SECONDS, quiet=False):
+        self.inbox = os.path.abspath(inbox)
+        self.output = os.path.abspath(output)
+        self.config_path = config_path
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.connections = max(1, connections)
+        self.parse_options = parse_options or {}
+        self.load_options = load_options or {}
+        self.metrics = metrics
+        self.archive_metrics = archive_metrics
+        self.progress = progress
+        self.poll_seconds = poll_seconds
+        self.settle_seconds = settle_seconds
+        self.quiet = quiet
+        self.processing = os.path.join(self.inbox, PROCESSING_DIR)
+        self.done = os.path.join(self.inbox, DONE_DIR)
+        self.failed = os.path.join(self.inbox, FAILED_DIR)
+        # 受信ディレクトリのファイル名 -> (大きさ, 更新時刻, 最初に見つけた時刻, 変わらなくなった時刻)
+        self.seen = {}
+        self.pool = None
+        self.db_pool = None
+        self.db_wait = DB_RETRY_WAIT
+
+    def start(self):
+        # ワーカーは接続より先に作る（接続を引き継がないように）
+        for directory in (self.inbox, self.processing, self.done, self.failed, self.output):
+            os.makedirs(directory, exist_ok=True)
+        if self.workers > 1:
+            self.pool = multiprocessing.Pool(self.workers, initializer=_init_worker)
+        self.db_pool = psycopg2.pool.ThreadedConnectionPool(
+            1, self.connections, csv_to_db.get_dsn(self.config_path))
+
+    def close(self):
+        if self.pool is not None:
+            # 処理中に止めた場合はワーカーに残った文書を待たない
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        if self.db_pool is not None:
+            self.db_pool.closeall()
+            self.db_pool = None
+
+    def scan(self, now=None):
+        """
+        受信ディレクトリを見て、書き込みが終わったZIPの名前を届いた順に返す関数
+        """
+        now = time.time() if now is None else now
+        current = {}
+        with os.scandir(self.inbox) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or not entry.name.lower().endswith('.zip') or not entry.is_file():
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                previous = self.seen.get(entry.name)
+                if previous is not None and previous[:2] == (st.st_size, st.st_mtime_ns):
+                    current[entry.name] = previous
+                else:
+                    first_seen = previous[2] if previous is not None else now
+                    current[entry.name] = (st.st_size, st.st_mtime_ns, first_seen, now)
+        self.seen = current
+        ready = [name for name, (_, _, _, stable) in current.items() if now - stable >= self.settle_seconds]
+        return sorted(ready, key=lambda name: (current[name][1], name))
+
+    def pending(self):
+        # 処理中のアーカイブ（前回止めた分やデータベースを待っている分）を受け取った順に返す
+        return sorted(name for name in os.listdir(self.processing) if name.lower().endswith('.zip'))
+
+    def claim(self, name):
+        # 受信ディレクトリから processing/ に移す（戻り値は移した後の名前）
+        received = self.seen.pop(name)[2]
+        claimed = f"{int(received * 1e9)}-{name}"
+        os.replace(os.path.join(self.inbox, name), os.path.join(self.processing, claimed))
+        return claimed
+
+    def update_gauges(self, ready, now=None):
+        now = time.time() if now is None else now
+        waiting = [_received(name) for name in self.pending()] + [self.seen[name][2] for name in ready]
+        self.metrics.gauge('ingest_queue_depth', len(waiting))
+        self.metrics.gauge('ingest_oldest_waiting_seconds', now - min(waiting) if waiting else 0)
+        self.metrics.write()
+
+    def run(self, stop, once=False):
+        """
+        stop がセットされるまで受信ディレクトリを見張り、届いたアーカイブを処理する関数
+
+        Args:
+            stop (threading.Event): セットされると処理中の文書を書き終えてから止める
+                （アーカイブは processing/ に残り、次回の起動時に続きから処理する）
+            once (bool): True の場合は待っているアーカイブが無くなったら終了する
+        """
+        self.start()
+        try:
+            while not stop.is_set():
+                ready = self.scan()
+                self.update_gauges(ready)
+                pending = self.pending()
+                if pending:
+                    if not self.ingest(pending[0], stop):
+                        stop.wait(self.db_wait)
+                        self.db_wait = min(self.db_wait * 2, DB_RETRY_WAIT_MAX)
+                    continue
+                if ready:
+                    self.claim(ready[0])
+                    continue
+                if once and not self.seen:
+                    break
+                stop.wait(self.poll_seconds)
+        finally:
+            self.close()
+            self.update_gauges([])
+
+    def ingest(self, claimed, stop):
+        """
+        processing/ のアーカイブを1つ解析して投入し、done/ または failed/ に移す関数
+
+        Returns:
+            bool: False の場合はデータベースに接続できなかったため、アーカイブを processing/ に残した
+        """
+        path = os.path.join(self.processing, claimed)
+        output = os.path.join(self.output, os.path.splitext(claimed)[0])
+        metrics = self.archive_metrics() if self.archive_metrics is not None else None
+        progress = self.progress(claimed) if self.progress is not None else None
+        started = time.perf_counter()
+        print(f"Ingesting {claimed}")
+        try:
+            if not zipfile.is_zipfile(path):
+                raise zipfile.BadZipFile(f"Not a ZIP file: {claimed}")
+            with self.metrics.timer('ingest.parse'), _quiet(self.quiet):
+                counts = xml_to_csv(path, output, workers=self.workers, incremental=True, metrics=metrics,
+                                    progress=progress, cancel=stop, pool=self.pool, **self.parse_options)
+            if stop.is_set():
+                return True
+            with self.metrics.timer('ingest.load'), _quiet(self.quiet):
+                stats = csv_to_db.csv_to_db_bulk(output, incremental=True, metrics=metrics,
+                                                 connections=self.connections, pool=self.db_pool,
+                                                 **self.load_options)
+        except csv_to_db.TRANSIENT_ERRORS as e:
+            print(f"Database unavailable, retrying {claimed} in {self.db_wait:g} s: {e}".rstrip())
+            self.metrics.count('ingest.db_retries')
+            return False
+        except Exception:
+            print(f"Failed to ingest {claimed}")
+            traceback.print_exc()
+            self.fail(claimed, traceback.format_exc())
+            return True
+
+        self.db_wait = DB_RETRY_WAIT
+        os.replace(path, os.path.join(self.done, claimed))
+        now = time.time()
+        seconds = time.perf_counter() - started
+        latency = now - _received(claimed)
+        for status, n in counts.items():
+            self.metrics.count(f"documents.{status}", n)
+        for table, (count, _) in stats.items():
+            self.metrics.count(f"rows.{table}", count)
+        self.metrics.count('archives.done')
+        self.metrics.observe('archive_processing_seconds', seconds, ARCHIVE_BUCKETS)
+        self.metrics.observe('archive_latency_seconds', latency, ARCHIVE_BUCKETS)
+        self.metrics.gauge('ingest_last_success_timestamp', now)
+        rows = max((count for count, _ in stats.values()), default=0)
+        print(f"Done {claimed}: {counts.get('ok', 0)} documents parsed, {rows} rows loaded in {seconds:.1f} s "
+              f"({latency:.1f} s since received)")
+        return True
+
+    def fail(self, claimed, detail):
+        os.replace(os.path.join(self.processing, claimed), os.path.join(self.failed, claimed))
+        with open(os.path.join(self.failed, claimed + '.error.txt'), 'w', encoding='utf-8') as f:
+            f.write(detail)
+        self.metrics.count('archives.failed')
+
+
+@contextlib.contextmanager
+def _quiet(quiet):
+    # 1件ごとの表示を省く場合は標準出力を捨てる
+    if not quiet:
+        yield
+        return
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def _received(claimed):
+    # processing/ の名前の先頭の受け取った時刻（ナノ秒）
+    return int(claimed.split('-', 1)[0]) / 1e9
+
+
+if __name__ == "__main__":
+    # オプションは batch.py watch を使う（python batch.py watch -h）
+    if len(sys.argv) < 3:
+        sys.exit("使い方: python ingest.py <受信ディレクトリ> <CSVの出力先>")
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    Ingester(sys.argv[1], sys.argv[2], metrics=Metrics()).run(stop)